@@ -0,0 +1,74 @@
+# bench_digest.py
+#
+# Compares checksum throughput of the old one-algorithm-at-a-time
+# 64 KiB read loop against util.digests and util.digest_files.
+#
+# Usage:
+#
+# python benchmarks/bench_digest.py [size_in_mb] [file_count]
+#
+# ----------------------------------------------------------------------
+import hashlib
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from dpnclient import util
+
+def legacy_digest(abs_path, algorithm):
+    """
+    The original util.digest: a fresh 64 KiB bytes object per read.
+    """
+    size = 65536
+    checksum = hashlib.new(algorithm)
+    with open(abs_path, 'rb') as f:
+        buf = f.read(size)
+        while len(buf) > 0:
+            checksum.update(buf)
+            buf = f.read(size)
+    return checksum.hexdigest()
+
+def make_files(directory, size_mb, count):
+    paths = []
+    block = os.urandom(1024 * 1024)
+    for i in range(count):
+        path = os.path.join(directory, "bench{0}.bin".format(i))
+        with open(path, 'wb') as f:
+            for j in range(size_mb):
+                f.write(block)
+        paths.append(path)
+    return paths
+
+def timed(label, total_bytes, func):
+    start = time.time()
+    func()
+    elapsed = time.time() - start
+    print("{0:<45} {1:8.3f}s {2:8.3f} GB/s".format(
+        label, elapsed, total_bytes / elapsed / 1e9))
+    return {'seconds': elapsed, 'gb_per_s': total_bytes / elapsed / 1e9}
+
+def run(size_mb=256, count=4):
+    """
+    Runs the digest benchmarks and returns their results, keyed by name.
+    """
+    algorithms = ['md5', 'sha256']
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        paths = make_files(directory, size_mb, count)
+        total = size_mb * 1024 * 1024 * count
+        results['legacy_digest'] = timed(
+            "legacy digest, md5 then sha256", total,
+            lambda: [legacy_digest(p, a) for p in paths for a in algorithms])
+        results['digests_single_pass'] = timed(
+            "util.digests, single pass", total,
+            lambda: [util.digests(p, algorithms, force=True) for p in paths])
+        results['digest_files'] = timed(
+            "util.digest_files, {0} workers".format(util.DEFAULT_DIGEST_WORKERS),
+            total, lambda: util.digest_files(paths, algorithms, force=True))
+    return results
+
+if __name__ == "__main__":
+    args = [int(arg) for arg in sys.argv[1:3]]
+    run(*args)
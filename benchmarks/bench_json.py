@@ -0,0 +1,71 @@
+# bench_json.py
+#
+# Compares decoding a big page of bag entries with the standard json
+# module against jsoncodec.loads (orjson, when installed) and the
+# incremental jsoncodec.StreamedPage.
+#
+# Usage:
+#
+# python benchmarks/bench_json.py [record_count]
+#
+# ----------------------------------------------------------------------
+import gc
+import json
+import os
+import sys
+import time
+import uuid
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from dpnclient import jsoncodec
+
+def make_page(count):
+    results = []
+    for i in range(count):
+        results.append({
+            'uuid': str(uuid.uuid4()), 'local_id': 'bag-{0}'.format(i),
+            'size': 1024 * i, 'first_version': None, 'version_number': 1,
+            'ingest_node': 'aptrust', 'original_node': 'aptrust',
+            'admin_node': 'aptrust', 'bag_type': 'D', 'rights': [],
+            'interpretive': [], 'replicating_nodes': ['chron', 'sdr'],
+            'fixities': [{'algorithm': 'sha256', 'digest': '0' * 64}],
+            'created_at': '2015-01-01T00:00:00Z',
+            'updated_at': '2015-01-01T00:00:00Z'})
+    return {'count': count, 'next': None, 'previous': None, 'results': results}
+
+def timed(label, total_bytes, func):
+    # Like timeit, time with the garbage collector off: otherwise its
+    # passes over the many small objects decoded swamp the decoder.
+    gc.collect()
+    gc.disable()
+    try:
+        start = time.time()
+        func()
+        elapsed = time.time() - start
+    finally:
+        gc.enable()
+    print("{0:<45} {1:8.3f}s {2:8.1f} MB/s".format(
+        label, elapsed, total_bytes / elapsed / 1e6))
+    return {'seconds': elapsed, 'mb_per_s': total_bytes / elapsed / 1e6}
+
+def run(count=50000):
+    """
+    Runs the JSON benchmarks and returns their results, keyed by name.
+    """
+    data = json.dumps(make_page(count)).encode('utf-8')
+    chunks = [data[i:i + jsoncodec.DEFAULT_CHUNK_SIZE]
+              for i in range(0, len(data), jsoncodec.DEFAULT_CHUNK_SIZE)]
+    results = {}
+    results['json_loads'] = timed(
+        "json.loads", len(data), lambda: json.loads(data.decode('utf-8')))
+    results['jsoncodec_loads'] = timed(
+        "jsoncodec.loads ({0})".format(jsoncodec.BACKEND), len(data),
+        lambda: jsoncodec.loads(data))
+    results['streamed_page'] = timed(
+        "jsoncodec.StreamedPage", len(data),
+        lambda: sum(1 for record in jsoncodec.StreamedPage(chunks).results))
+    return results
+
+if __name__ == "__main__":
+    args = [int(arg) for arg in sys.argv[1:2]]
+    run(*args)
@@ -0,0 +1,214 @@
+# run_benchmarks.py
+#
+# Measures client performance against in-process FakeRegistry servers,
+# so results are comparable across versions without a real DPN node.
+# Covers pagination, bulk creation, registry audits, update
+# throughput, concurrent polling, JSON decoding and util.digest
+# throughput. Results are saved as JSON under benchmarks/results/ so
+# you can compare them with earlier runs.
+#
+# Usage:
+#
+# python benchmarks/run_benchmarks.py [--label LABEL] [--compare LABEL]
+#                                     [--latency SECONDS]
+#
+# LABEL defaults to the output of `git describe --always --dirty`.
+#
+# ----------------------------------------------------------------------
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from dpnclient import paging
+from dpnclient.client import Client
+from dpnclient.fake_registry import FakeRegistry
+from dpnclient.mirror import RegistryMirror
+import bench_digest
+import bench_json
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+
+class BenchSettings:
+    MY_NODE = 'local'
+    KEYS = {}
+
+def timed(name, func, results, count=None):
+    start = time.time()
+    func()
+    elapsed = time.time() - start
+    results[name] = {'seconds': elapsed}
+    if count:
+        results[name]['per_second'] = count / elapsed
+    print("{0:<50} {1:8.3f}s".format(name, elapsed))
+
+def make_client(registry, remotes):
+    """
+    Returns a Client for registry that knows about each remote registry.
+    """
+    settings = BenchSettings()
+    settings.KEYS = {}
+    registry.add('node', {'namespace': 'local', 'api_root': registry.url,
+                          'replicate_from': False, 'replicate_to': False,
+                          'restore_from': False, 'restore_to': False})
+    for namespace, remote in remotes.items():
+        registry.add('node', {'namespace': namespace, 'api_root': remote.url,
+                              'replicate_from': True, 'replicate_to': True,
+                              'restore_from': True, 'restore_to': True})
+        settings.KEYS[namespace] = remote.token
+    config = {'url': registry.url, 'token': registry.token,
+              'rsync_host': 'localhost', 'max_xfer_size': 0}
+    return Client(settings, config, pool_maxsize=16)
+
+def add_transfers(registry, count):
+    for i in range(count):
+        registry.add('replicate', {'replication_id': str(uuid.uuid4()),
+                                   'status': 'Requested', 'to_node': 'local',
+                                   'link': 'dpn.local@remote:outbound/{0}.tar'.format(i),
+                                   'size': 1000})
+
+def sequential_pages(list_method, page_size, **kwargs):
+    """
+    The original get_transfer_requests loop: one page at a time.
+    """
+    records = []
+    page = 0
+    while True:
+        page += 1
+        data = list_method(page=page, page_size=page_size, **kwargs).json()
+        records.extend(data['results'])
+        if len(records) >= data['count']:
+            return records
+
+def bench_registry(latency, results):
+    remotes = dict(("node{0}".format(i), FakeRegistry(token="token{0}".format(i),
+                                                    latency=latency).start())
+                   for i in range(4))
+    registry = FakeRegistry(latency=latency).start()
+    try:
+        for remote in remotes.values():
+            add_transfers(remote, 500)
+        client = make_client(registry, remotes)
+        remote_client = client.remote_client('node0')
+        filters = {'status': 'Requested', 'to_node': 'local'}
+
+        # Pagination
+        timed("pagination: sequential pages (500 records)",
+              lambda: sequential_pages(remote_client.transfer_list, 20, **filters),
+              results, 500)
+        timed("pagination: paging.fetch_all (500 records)",
+              lambda: paging.fetch_all(remote_client.transfer_list, page_size=20, **filters),
+              results, 500)
+        timed("pagination: paging.iter_records (500 records)",
+              lambda: list(paging.iter_records(remote_client.transfer_list, page_size=20, **filters)),
+              results, 500)
+        timed("pagination: iter_records, incremental (500 records)",
+              lambda: list(paging.iter_records(remote_client.transfer_list, page_size=20,
+                                               incremental=True, **filters)),
+              results, 500)
+
+        # Bulk creation
+        bags = [{'obj_id': str(uuid.uuid4()), 'bag_size': 1000, 'bag_type': 'D',
+                 'fixity': 'abc', 'local_id': str(i)} for i in range(200)]
+        timed("creation: create_bag_entry loop (100 bags)",
+              lambda: [client.create_bag_entry(**bag) for bag in bags[:100]],
+              results, 100)
+        timed("creation: create_bag_entries (100 bags)",
+              lambda: client.create_bag_entries(bags[100:]), results, 100)
+
+        # Registry audits: remote paging vs. the local mirror
+        local_id = bags[150]['local_id']
+        timed("audit: find bag by local_id, paging remote (200 bags)",
+              lambda: [b for b in paging.iter_records(client.bag_list, page_size=20)
+                       if b['local_id'] == local_id], results)
+        with tempfile.TemporaryDirectory() as directory:
+            mirror = RegistryMirror(os.path.join(directory, 'mirror.sqlite3'))
+            timed("audit: RegistryMirror.sync (200 bags)",
+                  lambda: mirror.sync(client, collections=('bag',)), results, 200)
+            timed("audit: find bag by local_id, local mirror (200 bags)",
+                  lambda: mirror.find('bag', local_id=local_id), results)
+            mirror.close()
+
+        # Update throughput
+        xfer_ids = [r['replication_id'] for r in remote_client.transfer_list(
+            page_size=200).json()['results']]
+        timed("updates: set_transfer_fixity loop (100 updates)",
+              lambda: [client.set_transfer_fixity('node0', rid, 'abc') for rid in xfer_ids[:100]],
+              results, 100)
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            timed("updates: set_transfer_fixity, 8 threads (100 updates)",
+                  lambda: list(executor.map(
+                      lambda rid: client.set_transfer_fixity('node0', rid, 'abc'),
+                      xfer_ids[100:200])),
+                  results, 100)
+
+        # Concurrent polling
+        timed("polling: get_transfer_requests per node (4 nodes)",
+              lambda: [client.get_transfer_requests(ns) for ns in sorted(remotes)],
+              results)
+        timed("polling: poll_all_transfer_requests (4 nodes)",
+              lambda: client.poll_all_transfer_requests(), results)
+        client.poll_all_transfer_requests(incremental=True)
+        timed("polling: incremental, nothing changed (4 nodes)",
+              lambda: client.poll_all_transfer_requests(incremental=True), results)
+        client.close()
+    finally:
+        registry.stop()
+        for remote in remotes.values():
+            remote.stop()
+
+def default_label():
+    try:
+        return subprocess.check_output(
+            ['git', 'describe', '--always', '--dirty'],
+            cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return time.strftime('%Y%m%d-%H%M%S')
+
+def compare(results, label):
+    path = os.path.join(RESULTS_DIR, label + '.json')
+    if not os.path.exists(path):
+        print("\nNo results labeled {0} to compare with. Record them first "
+              "with --label {0}.".format(label))
+        return
+    with open(path) as f:
+        old = json.load(f)['results']
+    print("\nCompared with {0}:".format(label))
+    for name, result in sorted(results.items()):
+        if name in old:
+            ratio = old[name]['seconds'] / result['seconds']
+            print("{0:<50} {1:6.2f}x".format(name, ratio))
+
+def main():
+    parser = argparse.ArgumentParser(description='Run DPN client benchmarks.')
+    parser.add_argument('--label', default=None)
+    parser.add_argument('--compare', default=None)
+    parser.add_argument('--latency', type=float, default=0.005)
+    parser.add_argument('--digest-mb', type=int, default=64)
+    args = parser.parse_args()
+    label = args.label or default_label()
+    results = {}
+    bench_registry(args.latency, results)
+    for name, result in bench_json.run().items():
+        results['json: ' + name] = result
+    for name, result in bench_digest.run(args.digest_mb, 2).items():
+        results['digest: ' + name] = result
+    if not os.path.isdir(RESULTS_DIR):
+        os.makedirs(RESULTS_DIR)
+    path = os.path.join(RESULTS_DIR, label + '.json')
+    with open(path, 'w') as f:
+        json.dump({'label': label, 'latency': args.latency,
+                   'created_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+                   'results': results}, f, indent=2, sort_keys=True)
+    print("\nSaved results to {0}".format(path))
+    if args.compare:
+        compare(results, args.compare)
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,23 @@
 # Package dpnclient - A REST client for DPN.
+from . import bagit
 from . import const
+from . import fixity_cache
+from . import jsoncodec
+from . import metrics
+from . import mirror
+from . import packaging
+from . import paging
+from . import pipeline
+from . import records
+from . import replication
+from . import resilience
+from . import response_cache
+from . import restore
+from . import scheduler
+from . import transfer
+from . import update_queue
 from . import util
+from . import watermarks
 from .base_client import BaseClient
 from .client import Client
+from .async_client import AsyncBaseClient, AsyncClient
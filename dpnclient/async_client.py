@@ -0,0 +1,302 @@
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from .base_client import BaseClient
+from .client import Client
+
+# Default number of worker threads (and pooled connections per host)
+# behind each async client.
+DEFAULT_MAX_WORKERS = 32
+
+class AsyncBaseClient:
+    """
+    Asyncio version of BaseClient. Every list/get/create/update method
+    of BaseClient has an awaitable equivalent here with the same
+    arguments, return value (requests.Response) and error semantics:
+    methods that don't get the expected response from the server raise
+    a RequestException.
+
+    The calls run on a thread pool that shares one pooled BaseClient, so
+    you can have many calls in flight on a single event loop. The number
+    of calls actually on the wire at once is limited by max_workers; the
+    rest wait their turn without blocking the loop.
+
+    :param max_workers: Number of calls that may be on the wire at once.
+    This is also the number of keep-alive connections held open per host.
+
+    :param client: An existing BaseClient to wrap. If omitted, a new one
+    is created from url and token.
+    """
+    def __init__(self, url, token, max_workers=DEFAULT_MAX_WORKERS, client=None):
+        if client is None:
+            client = BaseClient(url, token, pool_maxsize=max_workers)
+        self.client = client
+        self.url = client.url
+        self.token = client.token
+        self.max_workers = max_workers
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.aclose()
+        return False
+
+    def close(self):
+        """
+        Shuts down the worker threads and closes pooled connections. This
+        waits for calls in flight; from a coroutine, use aclose() instead.
+        """
+        self.executor.shutdown(wait=True)
+        self.client.close()
+
+    async def aclose(self):
+        """
+        Awaitable close(). The blocking shutdown runs on the loop's default
+        executor, so other coroutines keep running meanwhile.
+        """
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self.close)
+
+    async def _call(self, func, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self.executor, functools.partial(func, *args, **kwargs))
+
+# ------------------------------------------------------------------
+# Node methods
+# ------------------------------------------------------------------
+    async def node_list(self, **kwargs):
+        """
+        Awaitable BaseClient.node_list.
+        """
+        return await self._call(self.client.node_list, **kwargs)
+
+    async def node_get(self, namespace):
+        """
+        Awaitable BaseClient.node_get.
+        """
+        return await self._call(self.client.node_get, namespace)
+
+# ------------------------------------------------------------------
+# Bag methods
+# ------------------------------------------------------------------
+    async def bag_list(self, **kwargs):
+        """
+        Awaitable BaseClient.bag_list.
+        """
+        return await self._call(self.client.bag_list, **kwargs)
+
+    async def bag_get(self, obj_id):
+        """
+        Awaitable BaseClient.bag_get.
+        """
+        return await self._call(self.client.bag_get, obj_id)
+
+    async def bag_create(self, obj):
+        """
+        Awaitable BaseClient.bag_create.
+        """
+        return await self._call(self.client.bag_create, obj)
+
+    async def bag_update(self, obj):
+        """
+        Awaitable BaseClient.bag_update.
+        """
+        return await self._call(self.client.bag_update, obj)
+
+# ------------------------------------------------------------------
+# Restoration methods
+# ------------------------------------------------------------------
+    async def restore_list(self, **kwargs):
+        """
+        Awaitable BaseClient.restore_list.
+        """
+        return await self._call(self.client.restore_list, **kwargs)
+
+    async def restore_get(self, restore_id):
+        """
+        Awaitable BaseClient.restore_get.
+        """
+        return await self._call(self.client.restore_get, restore_id)
+
+    async def restore_create(self, obj):
+        """
+        Awaitable BaseClient.restore_create.
+        """
+        return await self._call(self.client.restore_create, obj)
+
+    async def restore_update(self, obj):
+        """
+        Awaitable BaseClient.restore_update.
+        """
+        return await self._call(self.client.restore_update, obj)
+
+# ------------------------------------------------------------------
+# Replication Transfer methods
+# ------------------------------------------------------------------
+    async def transfer_list(self, **kwargs):
+        """
+        Awaitable BaseClient.transfer_list.
+        """
+        return await self._call(self.client.transfer_list, **kwargs)
+
+    async def transfer_get(self, replication_id):
+        """
+        Awaitable BaseClient.transfer_get.
+        """
+        return await self._call(self.client.transfer_get, replication_id)
+
+    async def transfer_create(self, obj):
+        """
+        Awaitable BaseClient.transfer_create.
+        """
+        return await self._call(self.client.transfer_create, obj)
+
+    async def transfer_update(self, obj):
+        """
+        Awaitable BaseClient.transfer_update.
+        """
+        return await self._call(self.client.transfer_update, obj)
+
+
+class AsyncClient(AsyncBaseClient):
+    """
+    Asyncio version of Client. It exposes the awaitable BaseClient
+    methods of AsyncBaseClient plus awaitable versions of the Client
+    helpers. Node information (my_node, replicate_from, etc.) is read
+    straight from the wrapped Client. The first read fetches the node
+    list, which would block the event loop, so await load_nodes() once
+    before using any of it:
+
+        client = AsyncClient(settings, active_config)
+        await client.load_nodes()
+        for node in client.replicate_from:
+            ...
+
+    :param settings: See Client.
+    :param active_config: See Client.
+    :param max_workers: See AsyncBaseClient.
+    :param client: An existing Client to wrap. If omitted, a new one is
+    created from settings and active_config.
+    """
+    def __init__(self, settings, active_config, max_workers=DEFAULT_MAX_WORKERS,
+                 client=None):
+        if client is None:
+            client = Client(settings, active_config, pool_maxsize=max_workers)
+        super(AsyncClient, self).__init__(client.url, client.token,
+                                          max_workers=max_workers, client=client)
+        self.settings = client.settings
+
+    def __getattr__(self, name):
+        # Node topology and settings come from the wrapped Client.
+        if name in ('my_node', 'all_nodes', 'replicate_to', 'replicate_from',
+                    'restore_to', 'restore_from', 'nodes_by_namespace',
+                    'rsync_host', 'max_xfer_size'):
+            return getattr(self.client, name)
+        raise AttributeError(name)
+
+    async def load_nodes(self):
+        """
+        Loads node information (from the node cache file or the server)
+        on the executor, so reading my_node, replicate_from, etc. won't
+        block the event loop. Does nothing if it's already loaded.
+        """
+        await self._call(getattr, self.client, 'all_nodes')
+
+    async def refresh_nodes(self):
+        """
+        Awaitable Client.refresh_nodes.
+        """
+        return await self._call(self.client.refresh_nodes)
+
+    async def create_bag_entry(self, obj_id, bag_size, bag_type, fixity, local_id):
+        """
+        Awaitable Client.create_bag_entry.
+        """
+        return await self._call(self.client.create_bag_entry, obj_id,
+                                bag_size, bag_type, fixity, local_id)
+
+    async def create_transfer_request(self, obj_id, bag_size, username, fixity):
+        """
+        Awaitable Client.create_transfer_request.
+        """
+        return await self._call(self.client.create_transfer_request, obj_id,
+                                bag_size, username, fixity)
+
+    async def get_transfer_requests(self, remote_node_namespace, **kwargs):
+        """
+        Awaitable Client.get_transfer_requests.
+        """
+        return await self._call(self.client.get_transfer_requests,
+                                remote_node_namespace, **kwargs)
+
+    async def poll_transfer_changes(self, remote_node_namespace, **kwargs):
+        """
+        Awaitable Client.poll_transfer_changes.
+        """
+        return await self._call(self.client.poll_transfer_changes,
+                                remote_node_namespace, **kwargs)
+
+    async def reject_transfer_request(self, remote_node_namespace, replication_id):
+        """
+        Awaitable Client.reject_transfer_request.
+        """
+        return await self._call(self.client.reject_transfer_request,
+                                remote_node_namespace, replication_id)
+
+    async def set_transfer_fixity(self, remote_node_namespace, replication_id, fixity):
+        """
+        Awaitable Client.set_transfer_fixity.
+        """
+        return await self._call(self.client.set_transfer_fixity,
+                                remote_node_namespace, replication_id, fixity)
+
+    async def get_restore_requests(self, remote_node_namespace, **kwargs):
+        """
+        Awaitable Client.get_restore_requests.
+        """
+        return await self._call(self.client.get_restore_requests,
+                                remote_node_namespace, **kwargs)
+
+    async def update_restore_request(self, remote_node_namespace, restore_id,
+                                     status, link=None):
+        """
+        Awaitable Client.update_restore_request.
+        """
+        return await self._call(self.client.update_restore_request,
+                                remote_node_namespace, restore_id, status, link)
+
+    async def fulfill_restore_requests(self, namespaces=None, **kwargs):
+        """
+        Awaitable Client.fulfill_restore_requests.
+        """
+        return await self._call(self.client.fulfill_restore_requests,
+                                namespaces, **kwargs)
+
+    async def poll_all_transfer_requests(self, **kwargs):
+        """
+        Awaitable Client.poll_all_transfer_requests.
+        """
+        return await self._call(self.client.poll_all_transfer_requests, **kwargs)
+
+    async def create_bag_entries(self, batch, **kwargs):
+        """
+        Awaitable Client.create_bag_entries.
+        """
+        return await self._call(self.client.create_bag_entries, batch, **kwargs)
+
+    async def create_transfer_requests(self, batch, to_nodes, **kwargs):
+        """
+        Awaitable Client.create_transfer_requests.
+        """
+        return await self._call(self.client.create_transfer_requests, batch,
+                                to_nodes, **kwargs)
+
+    async def package_and_register(self, bag_dir, local_id, **kwargs):
+        """
+        Awaitable Client.package_and_register.
+        """
+        return await self._call(self.client.package_and_register, bag_dir,
+                                local_id, **kwargs)
@@ -0,0 +1,208 @@
+import os
+import queue
+import tarfile
+from concurrent.futures import ThreadPoolExecutor
+from . import const
+from . import fixity_cache
+from . import util
+
+# Payload files at least this big are hashed on a worker thread while
+# the tar is read, instead of on the reading thread.
+DEFAULT_LARGE_FILE_SIZE = 8 * 1024 * 1024
+
+# Default max number of large files to hash at once.
+DEFAULT_HASH_WORKERS = 2
+
+# Max number of blocks read ahead of each worker.
+DEFAULT_READ_AHEAD = 8
+
+# Marks the end of a worker's input queue.
+_END_OF_FILE = object()
+
+class _HashingReader:
+    """
+    File wrapper that hashes every byte read through it.
+    """
+    def __init__(self, f, algorithm):
+        self.f = f
+        self.checksum = util.new_checksum(algorithm)
+
+    def read(self, size=-1):
+        data = self.f.read(size)
+        self.checksum.update(data)
+        return data
+
+    def finish(self, block_size):
+        """
+        Reads (and hashes) whatever tarfile left unread at the end of
+        the file, and returns the whole-file hex digest.
+        """
+        while self.read(block_size):
+            pass
+        return self.checksum.hexdigest()
+
+
+def validate_tar(path, algorithm=const.FIXITY_SHA256,
+                 block_size=util.DEFAULT_BLOCK_SIZE,
+                 large_file_size=DEFAULT_LARGE_FILE_SIZE,
+                 hash_workers=DEFAULT_HASH_WORKERS):
+    """
+    Validates a BagIt bag inside a tar file in one sequential pass,
+    without extracting anything. Every file in the bag is hashed as it
+    streams by, and the results are checked against the bag's payload
+    manifest (manifest-<algorithm>.txt) and tag manifest
+    (tagmanifest-<algorithm>.txt), whatever order they come in. Large
+    payload files are handed to worker threads block by block, so hashing
+    one overlaps with reading the next. The whole tar file is hashed in
+    the same pass, so the bag's DPN fixity comes for free. If a fixity
+    cache is configured, that digest is saved to it.
+
+    Paths are relative to the bag directory, so a tar of bag_name/...
+    is handled the same as one with the bag's files at its root.
+
+    :param path: Path to the tar file.
+    :param algorithm: Either 'md5' or 'sha256'.
+    :param block_size: Number of bytes to read at a time.
+    :param large_file_size: Size from which payload files are hashed by
+    workers.
+    :param hash_workers: Max number of large files to hash at once.
+
+    :returns: A dict with keys 'valid' (True if nothing is missing, extra
+    or mismatched), 'missing' (files listed in a manifest but not in the
+    tar, and required tag files that aren't there), 'extra' (payload
+    files not in the payload manifest), 'mismatched' (files whose digest
+    doesn't match their manifest), 'file_count', 'byte_count' (bytes of
+    file content) and 'tar_digest' (digest of the whole tar file).
+
+    :raises tarfile.TarError: If the file isn't a readable tar.
+    """
+    digests = {}
+    tag_files = {}
+    manifest_names = ('manifest-{0}.txt'.format(algorithm),
+                      'tagmanifest-{0}.txt'.format(algorithm))
+    futures = []
+    byte_count = 0
+    stat = os.stat(path)
+    with open(path, 'rb') as f, \
+            ThreadPoolExecutor(max_workers=max(1, hash_workers)) as executor:
+        reader = _HashingReader(f, algorithm)
+        with tarfile.open(fileobj=reader, mode='r|*') as tar:
+            for member in tar:
+                if not member.isfile():
+                    continue
+                name = member.name
+                byte_count += member.size
+                data = tar.extractfile(member)
+                paths = _bag_paths(name)
+                if any(path in manifest_names for path in paths):
+                    # Manifests are always kept, however big they are.
+                    content = data.read()
+                    tag_files[name] = content
+                    checksum = util.new_checksum(algorithm)
+                    checksum.update(content)
+                    digests[name] = checksum.hexdigest()
+                    continue
+                if member.size >= large_file_size and any(
+                        path.startswith('data/') for path in paths):
+                    blocks = queue.Queue(DEFAULT_READ_AHEAD)
+                    futures.append((name, executor.submit(_hash_blocks, blocks, algorithm)))
+                    try:
+                        block = data.read(block_size)
+                        while block:
+                            blocks.put(block)
+                            block = data.read(block_size)
+                    finally:
+                        blocks.put(_END_OF_FILE)
+                    continue
+                checksum = util.new_checksum(algorithm)
+                block = data.read(block_size)
+                while block:
+                    checksum.update(block)
+                    block = data.read(block_size)
+                digests[name] = checksum.hexdigest()
+        tar_digest = reader.finish(block_size)
+        for name, future in futures:
+            digests[name] = future.result()
+    cache = fixity_cache.default_cache()
+    if cache is not None:
+        cache.put(os.path.abspath(path), algorithm, tar_digest, stat)
+    digests, tag_files = _relative_to_bag(digests, tag_files)
+    result = _check(digests, tag_files, manifest_names)
+    result.update(file_count=len(digests), byte_count=byte_count,
+                  tar_digest=tar_digest)
+    return result
+
+def _hash_blocks(blocks, algorithm):
+    checksum = util.new_checksum(algorithm)
+    while True:
+        block = blocks.get()
+        if block is _END_OF_FILE:
+            return checksum.hexdigest()
+        checksum.update(block)
+
+def _bag_paths(name):
+    """
+    Returns the paths name could have relative to the bag directory: as
+    is, and without its top-level directory. Which one is right is only
+    known once the whole tar has been read (see _relative_to_bag).
+    """
+    if '/' not in name:
+        return (name,)
+    return (name, name.split('/', 1)[1])
+
+def _relative_to_bag(digests, tag_files):
+    """
+    Strips the bag directory from the front of every path, if all the
+    files are in one top-level directory.
+    """
+    tops = set(name.split('/', 1)[0] for name in digests)
+    if len(tops) != 1 or not all('/' in name for name in digests):
+        return digests, tag_files
+    strip = len(tops.pop()) + 1
+    return (dict((name[strip:], digest) for name, digest in digests.items()),
+            dict((name[strip:], content) for name, content in tag_files.items()))
+
+def parse_manifest(content):
+    """
+    Returns a dict of digests keyed by path from the content (bytes) of
+    a BagIt manifest file.
+    """
+    entries = {}
+    for line in content.decode('utf-8').splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        digest, _, name = line.partition(' ')
+        name = name.strip().lstrip('*')
+        # BagIt 1.0 percent-encodes CR, LF and % in paths.
+        name = name.replace('%0D', '\r').replace('%0A', '\n').replace('%25', '%')
+        entries[name] = digest.lower()
+    return entries
+
+def _check(digests, tag_files, manifest_names):
+    missing = set()
+    extra = set()
+    mismatched = set()
+    payload_manifest = manifest_names[0]
+    if 'bagit.txt' not in digests:
+        missing.add('bagit.txt')
+    if payload_manifest not in tag_files:
+        missing.add(payload_manifest)
+    for manifest_name in manifest_names:
+        if manifest_name not in tag_files:
+            continue
+        expected = parse_manifest(tag_files[manifest_name])
+        for name, digest in expected.items():
+            if name not in digests:
+                missing.add(name)
+            elif digests[name] != digest:
+                mismatched.add(name)
+        if manifest_name == payload_manifest:
+            extra.update(name for name in digests
+                         if name.startswith('data/') and name not in expected)
+    return {
+        'valid': not (missing or extra or mismatched),
+        'missing': sorted(missing),
+        'extra': sorted(extra),
+        'mismatched': sorted(mismatched),
+    }
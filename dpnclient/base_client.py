@@ -1,7 +1,17 @@
 from . import const
-import json
+from . import jsoncodec
+from . import metrics
+from . import records
+from . import resilience
 import requests
-from requests.exceptions import RequestException
+import time
+from requests.adapters import HTTPAdapter
+from requests.exceptions import ConnectionError, RequestException, Timeout
+
+# Default number of per-host connection pools to cache, and the max
+# number of keep-alive connections each pool holds open to one host.
+DEFAULT_POOL_CONNECTIONS = 10
+DEFAULT_POOL_MAXSIZE = 10
 
 class BaseClient:
     """
@@ -14,6 +24,12 @@ class BaseClient:
     response.text        - Raw response text. May be HTML on status code 500.
     response.json()      - The response JSON (for non-500 responses).
 
+    jsoncodec.response_json(response) decodes the same JSON faster when
+    orjson is installed.
+
+    The create and update methods take either a dict or a records.Record
+    (Bag, Transfer, Restore).
+
     For more information about the requests library and its Response objects,
     see the requests documentation at:
 
@@ -22,13 +38,78 @@ class BaseClient:
     All methods that don't get the expected response from the server raise
     a RequestException, which the caller must handle. Check the response
     property of the RequestException for details (status_code, text, etc.).
+
+    The client keeps a pool of keep-alive connections to the server, so
+    repeated calls don't pay for a new TCP/TLS handshake each time. Call
+    close() when you're done with the client, or use it as a context
+    manager:
+
+        with BaseClient(url, token) as client:
+            client.node_list()
+
+    :param pool_connections: Number of per-host connection pools to cache.
+    :param pool_maxsize: Max number of connections kept open to each host.
+    Set this to at least the number of threads sharing the client.
+
+    :param response_cache: Optional response_cache.ResponseCache. If set,
+    node_get, bag_get, restore_get and transfer_get responses are cached
+    and revalidated with conditional GETs, and bag_update, restore_update
+    and transfer_update drop the cached copy of the object they change.
+
+    :param timeout: (connect, read) timeouts in seconds for every call.
+
+    :param retry_policy: resilience.RetryPolicy that decides when failed
+    idempotent calls are retried. Defaults to RetryPolicy(). Pass
+    RetryPolicy(max_retries=0) to turn retries off.
+
+    :param circuit_breaker: Optional resilience.CircuitBreaker. If set,
+    calls raise CircuitOpenError without touching the network while the
+    breaker is open.
+
+    :param namespace: Namespace of the node this client talks to. Only
+    used to label instrumentation records.
+
+    :param instrumentation: metrics.Instrumentation that records the
+    endpoint, status, latency, size and retry count of every call.
+    Defaults to one that records nothing. See metrics.InMemoryMetrics.
     """
-    def __init__(self, url, token):
+    def __init__(self, url, token, pool_connections=DEFAULT_POOL_CONNECTIONS,
+                 pool_maxsize=DEFAULT_POOL_MAXSIZE, response_cache=None,
+                 timeout=resilience.DEFAULT_TIMEOUT, retry_policy=None,
+                 circuit_breaker=None, namespace=None, instrumentation=None):
         while url.endswith('/'):
             url = url[:-1]
         self.url = url
         self.token = token
         self.verify_ssl = True  # TDR cert is not legit - FIX THIS!
+        self.response_cache = response_cache
+        self.timeout = timeout
+        if retry_policy is None:
+            retry_policy = resilience.RetryPolicy()
+        self.retry_policy = retry_policy
+        self.circuit_breaker = circuit_breaker
+        self.namespace = namespace
+        if instrumentation is None:
+            instrumentation = metrics.NULL_INSTRUMENTATION
+        self.instrumentation = instrumentation
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_connections,
+                              pool_maxsize=pool_maxsize)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+    def close(self):
+        """
+        Closes all pooled connections held by this client.
+        """
+        self.session.close()
 
     def headers(self):
         """
@@ -40,10 +121,108 @@ class BaseClient:
             'Authorization': 'token {0}'.format(self.token),
         }
 
+    def _request(self, endpoint, method, url, expected_status, headers=None, **kwargs):
+        """
+        Sends a request over the pooled session and returns the response.
+        Retries according to retry_policy, checks and updates the circuit
+        breaker, if there is one, and reports the call to instrumentation.
+
+        :param endpoint: Name of the calling method, for instrumentation.
+        :param expected_status: An HTTP status code, or a tuple of them.
+        :param headers: Headers to send in addition to the defaults.
+
+        :raises RequestException: If the status code of the response is
+        not expected_status. Connection errors and timeouts are raised as
+        the requests library's ConnectionError and Timeout, which are
+        subclasses of RequestException.
+
+        :raises CircuitOpenError: If the circuit breaker is open.
+        """
+        request_headers = self.headers()
+        if headers:
+            request_headers.update(headers)
+        if isinstance(expected_status, int):
+            expected_status = (expected_status,)
+        breaker = self.circuit_breaker
+        attempt = 0
+        response = None
+        started_at = time.time()
+        try:
+            while True:
+                if breaker is not None:
+                    breaker.before_call()
+                try:
+                    response = self.session.request(method, url, headers=request_headers,
+                                                    verify=self.verify_ssl,
+                                                    timeout=self.timeout, **kwargs)
+                except (ConnectionError, Timeout):
+                    if breaker is not None:
+                        breaker.record_failure()
+                    if not self.retry_policy.should_retry(method, attempt):
+                        raise
+                except Exception:
+                    # Not retried, but a half-open breaker must still
+                    # learn how its trial call went.
+                    if breaker is not None:
+                        breaker.record_failure()
+                    raise
+                else:
+                    if breaker is not None:
+                        if response.status_code >= 500:
+                            breaker.record_failure()
+                        else:
+                            breaker.record_success()
+                    if (response.status_code in expected_status or
+                            not self.retry_policy.should_retry(method, attempt, response)):
+                        break
+                response = None
+                time.sleep(self.retry_policy.delay(attempt))
+                attempt += 1
+        finally:
+            self.instrumentation.record(
+                endpoint, self.namespace,
+                None if response is None else response.status_code,
+                time.time() - started_at, len(kwargs.get('data') or ''),
+                _response_bytes(response, kwargs.get('stream')), attempt)
+        if response.status_code not in expected_status:
+            raise RequestException(response.text, response=response)
+        return response
+
+    def _cached_get(self, endpoint, url):
+        """
+        GETs a single object, using the response cache if there is one.
+        """
+        cache = self.response_cache
+        if cache is None:
+            return self._request(endpoint, 'GET', url, 200)
+        entry = cache.get(url)
+        if entry is not None and cache.is_fresh(entry):
+            return entry.response
+        validators = entry.validators() if entry is not None else {}
+        response = self._request(endpoint, 'GET', url,
+                                 (200, 304) if validators else 200,
+                                 headers=validators)
+        if response.status_code == 304:
+            # Not cached again if it was invalidated while we asked.
+            cache.revalidate(url, entry)
+            return entry.response
+        cache.put(url, response)
+        return response
+
+    def _update(self, endpoint, url, obj):
+        """
+        PUTs an updated object, and drops it from the response cache.
+        """
+        try:
+            return self._request(endpoint, 'PUT', url, 200, data=jsoncodec.dumps(obj))
+        finally:
+            if self.response_cache is not None:
+                self.response_cache.invalidate(url)
+
 # ------------------------------------------------------------------
 # Node methods
 # ------------------------------------------------------------------
-    def node_list(self, **kwargs):
+    def node_list(self, stream=False, **kwargs):
         """
         Returns a list of DPN nodes.
 
@@ -51,16 +230,16 @@ class BaseClient:
         :param replicate_from: Boolean value.
         :param page_size: Number of max results per page.
 
+        :param stream: Set to True to leave the body unread, so it can be
+        decoded incrementally with jsoncodec.StreamedPage.
+
         :returns: requests.Response
 
         :raises RequestException: Check the response property for details.
         """
         url = "{0}/api-v1/node/".format(self.url)
-        response = requests.get(url, headers=self.headers(), params=kwargs,
-                                verify=self.verify_ssl)
-        if response.status_code != 200:
-            raise RequestException(response.text, response=response)
-        return response
+        return self._request('node_list', 'GET', url, 200, params=kwargs,
+                             stream=stream)
 
     def node_get(self, namespace):
         """
@@ -73,16 +252,13 @@ class BaseClient:
         :raises RequestException: Check the response property for details.
         """
         url = "{0}/api-v1/node/{1}/".format(self.url, namespace)
-        response = requests.get(url, headers=self.headers(), verify=self.verify_ssl)
-        if response.status_code != 200:
-            raise RequestException(response.text, response=response)
-        return response
+        return self._cached_get('node_get', url)
 
 
 # ------------------------------------------------------------------
 # Bag methods
 # ------------------------------------------------------------------
-    def bag_list(self, **kwargs):
+    def bag_list(self, stream=False, **kwargs):
         """
         Returns a requests.Response object whose json contains a list of
         bag entries.
@@ -94,16 +270,16 @@ class BaseClient:
         :param ordering: ORDER return by (accepted values: last_modified_date)
         :param page_size: Number of max results per page.
 
+        :param stream: Set to True to leave the body unread, so it can be
+        decoded incrementally with jsoncodec.StreamedPage.
+
         :returns: requests.Response
 
         :raises RequestException: Check the response property for details.
         """
         url = "{0}/api-v1/bag/".format(self.url)
-        response = requests.get(url, headers=self.headers(), params=kwargs,
-                                verify=self.verify_ssl)
-        if response.status_code != 200:
-            raise RequestException(response.text, response=response)
-        return response
+        return self._request('bag_list', 'GET', url, 200, params=kwargs,
+                             stream=stream)
 
 
     def bag_get(self, obj_id):
@@ -118,10 +294,7 @@ class BaseClient:
         :raises RequestException: Check the response property for details.
         """
         url = "{0}/api-v1/bag/{1}/".format(self.url, obj_id)
-        response = requests.get(url, headers=self.headers(), verify=self.verify_ssl)
-        if response.status_code != 200:
-            raise RequestException(response.text, response=response)
-        return response
+        return self._cached_get('bag_get', url)
 
 
     def bag_create(self, obj):
@@ -135,12 +308,9 @@ class BaseClient:
 
         :raises RequestException: Check the response property for details.
         """
+        obj = records.as_dict(obj)
         url = "{0}/api-v1/bag/".format(self.url)
-        response = requests.post(url, headers=self.headers(), data=json.dumps(obj),
-                                 verify=self.verify_ssl)
-        if response.status_code != 201:
-            raise RequestException(response.text, response=response)
-        return response
+        return self._request('bag_create', 'POST', url, 201, data=jsoncodec.dumps(obj))
 
 
     def bag_update(self, obj):
@@ -154,18 +324,15 @@ class BaseClient:
 
         :raises RequestException: Check the response property for details.
         """
-        url = "{0}/api-v1/bag/{1}/".format(self.url, obj['dpn_object_id'])
-        response = requests.put(url, headers=self.headers(), data=json.dumps(obj),
-                                verify=self.verify_ssl)
-        if response.status_code != 200:
-            raise RequestException(response.text, response=response)
-        return response
+        obj = records.as_dict(obj)
+        url = "{0}/api-v1/bag/{1}/".format(self.url, obj.get('dpn_object_id') or obj['uuid'])
+        return self._update('bag_update', url, obj)
 
 
 # ------------------------------------------------------------------
 # Restoration methods
 # ------------------------------------------------------------------
-    def restore_list(self, **kwargs):
+    def restore_list(self, stream=False, **kwargs):
         """
         Returns a paged list of Restore requests.
 
@@ -176,16 +343,16 @@ class BaseClient:
         :param node: Filter by node namespace.
         :param ordered: Order by comma-separated list: 'created' and/or 'updated'
 
+        :param stream: Set to True to leave the body unread, so it can be
+        decoded incrementally with jsoncodec.StreamedPage.
+
         :returns: requests.Response
 
         :raises RequestException: Check the response property for details.
         """
         url = "{0}/api-v1/restore/".format(self.url)
-        response = requests.get(url, headers=self.headers(), params=kwargs,
-                                verify=self.verify_ssl)
-        if response.status_code != 200:
-            raise RequestException(response.text, response=response)
-        return response
+        return self._request('restore_list', 'GET', url, 200, params=kwargs,
+                             stream=stream)
 
 
     def restore_get(self, restore_id):
@@ -201,10 +368,7 @@ class BaseClient:
         :raises RequestException: Check the response property for details.
         """
         url = "{0}/api-v1/restore/{1}/".format(self.url, restore_id)
-        response = requests.get(url, headers=self.headers(), verify=self.verify_ssl)
-        if response.status_code != 200:
-            raise RequestException(response.text, response=response)
-        return response
+        return self._cached_get('restore_get', url)
 
 
     def restore_create(self, obj):
@@ -220,12 +384,9 @@ class BaseClient:
 
         :raises RequestException: Check the response property for details.
         """
+        obj = records.as_dict(obj)
         url = "{0}/api-v1/restore/".format(self.url)
-        response = requests.post(url, headers=self.headers(), data=json.dumps(obj),
-                                 verify=self.verify_ssl)
-        if response.status_code != 201:
-            raise RequestException(response.text, response=response)
-        return response
+        return self._request('restore_create', 'POST', url, 201, data=jsoncodec.dumps(obj))
 
 
     def restore_update(self, obj):
@@ -240,18 +401,15 @@ class BaseClient:
 
         :raises RequestException: Check the response property for details.
         """
+        obj = records.as_dict(obj)
         url = "{0}/api-v1/restore/{1}/".format(self.url, obj['restore_id'])
-        response = requests.put(url, headers=self.headers(), data=json.dumps(obj),
-                                verify=self.verify_ssl)
-        if response.status_code != 200:
-            raise RequestException(response.text, response=response)
-        return response
+        return self._update('restore_update', url, obj)
 
 
 # ------------------------------------------------------------------
 # Replication Transfer methods
 # ------------------------------------------------------------------
-    def transfer_list(self, **kwargs):
+    def transfer_list(self, stream=False, **kwargs):
         """
         Returns a list of transfer requests, where the server wants you
         to transfer bags to your repository.
@@ -266,16 +424,16 @@ class BaseClient:
         :param updated_on: Order result by last update. (prepend '-' to reverse order)
         :param page_size: Max number of results per page.
 
+        :param stream: Set to True to leave the body unread, so it can be
+        decoded incrementally with jsoncodec.StreamedPage.
+
         :returns: requests.Response
 
         :raises RequestException: Check the response property for details.
         """
         url = "{0}/api-v1/replicate/".format(self.url)
-        response = requests.get(url, headers=self.headers(), params=kwargs,
-                                verify=self.verify_ssl)
-        if response.status_code != 200:
-            raise RequestException(response.text, response=response)
-        return response
+        return self._request('transfer_list', 'GET', url, 200, params=kwargs,
+                             stream=stream)
 
 
     def transfer_get(self, replication_id):
@@ -289,10 +447,7 @@ class BaseClient:
         :raises RequestException: Check the response property for details.
         """
         url = "{0}/api-v1/replicate/{1}/".format(self.url, replication_id)
-        response = requests.get(url, headers=self.headers(), verify=self.verify_ssl)
-        if response.status_code != 200:
-            raise RequestException(response.text, response=response)
-        return response
+        return self._cached_get('transfer_get', url)
 
 
     def transfer_create(self, obj):
@@ -306,12 +461,9 @@ class BaseClient:
 
         :raises RequestException: Check the response property for details.
         """
+        obj = records.as_dict(obj)
         url = "{0}/api-v1/replicate/".format(self.url)
-        response = requests.post(url, headers=self.headers(), data=json.dumps(obj),
-                                 verify=self.verify_ssl)
-        if response.status_code != 201:
-            raise RequestException(response.text, response=response)
-        return response
+        return self._request('transfer_create', 'POST', url, 201, data=jsoncodec.dumps(obj))
 
 
     def transfer_update(self, obj):
@@ -326,14 +478,17 @@ class BaseClient:
 
         :raises RequestException: Check the response property for details.
         """
+        obj = records.as_dict(obj)
         url = "{0}/api-v1/replicate/{1}/".format(self.url, obj['replication_id'])
+        return self._update('transfer_update', url, obj)
 
-        print("transfer_update " + json.dumps(obj))
-        print("Headers: " + str(self.headers()))
-        print("URL: " + url)
 
-        response = requests.put(url, headers=self.headers(), data=json.dumps(obj),
-                                verify=self.verify_ssl)
-        if response.status_code != 200:
-            raise RequestException(response.text, response=response)
-        return response
+def _response_bytes(response, stream=False):
+    """
+    Returns the size of a response body without reading a streamed body.
+    """
+    if response is None:
+        return 0
+    if stream:
+        return int(response.headers.get('Content-Length') or 0)
+    return len(response.content or b'')
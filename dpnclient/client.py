@@ -1,9 +1,35 @@
 import json
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
 from . import const
+from . import fixity_cache
+from . import jsoncodec
+from . import mirror
+from . import packaging
+from . import paging
+from . import records
+from . import resilience
+from . import restore
+from . import update_queue
 from . import util
-from .base_client import BaseClient
+from . import watermarks
+from .base_client import BaseClient, DEFAULT_POOL_MAXSIZE
 from requests.exceptions import RequestException
-from datetime import datetime
+
+# Default number of seconds to wait for any one node when polling all
+# nodes for transfer requests.
+DEFAULT_POLL_TIMEOUT = 60
+
+# Default number of seconds before cached node info is refreshed.
+DEFAULT_NODE_CACHE_TTL = 3600
+
+# Default number of registry entries or transfer requests to create at
+# once in create_bag_entries and create_transfer_requests.
+DEFAULT_BATCH_WORKERS = 8
 
 class Client(BaseClient):
     """
@@ -20,43 +46,254 @@ class Client(BaseClient):
     information about how to connect to a DPN rest server. The
     dpn_rest_settings.py file may have dictionaries called TEST, DEV, and
     PRODUCTION, each with keys 'url', 'token', 'rsync_host' and 'max_xfer_size'.
+    If the settings file sets FIXITY_CACHE_DIR, the client turns on the
+    fixity cache, so util.digest skips re-hashing unchanged files.
+
+    :param pool_maxsize: Max number of keep-alive connections to hold open
+    to your own node and to each remote node.
+
+    :param response_cache: Optional response_cache.ResponseCache, shared
+    by this client and its clients for remote nodes. See BaseClient.
+
+    :param timeout: (connect, read) timeouts for every call. See BaseClient.
+
+    :param retry_policy: resilience.RetryPolicy for every call. See BaseClient.
+
+    :param failure_threshold: Number of failures in a row after which the
+    circuit breaker for a remote node opens. See resilience.CircuitBreaker.
+
+    :param reset_timeout: Number of seconds an open circuit breaker waits
+    before letting a trial call through to the remote node.
+
+    :param instrumentation: metrics.Instrumentation shared by this client
+    and its clients for remote nodes. See BaseClient.
+
+    The client keeps one pooled BaseClient per remote node, so call close()
+    (or use the client as a context manager) when you're done with it.
+
+    Information about nodes (my_node, all_nodes, replicate_to, etc.) is
+    loaded on first use, not when the client is created. If the settings
+    file sets NODE_CACHE_FILE, node info is cached in that file. A cache
+    older than NODE_CACHE_TTL seconds is still used, but is refreshed from
+    the server in the background.
+
+    If the settings file sets REGISTRY_MIRROR_PATH, sync_registry_mirror()
+    copies the registry into a local SQLite database, and find_bags(),
+    bags_held_by(), find_transfers() and find_restores() query that copy
+    instead of the network.
+
+    poll_transfer_changes() and poll_all_transfer_requests(incremental=True)
+    only fetch transfer requests updated since the last poll. The
+    watermarks they keep are saved in WATERMARK_FILE, if the settings
+    file sets it, and otherwise only last as long as the client.
     """
-    def __init__(self, settings, active_config):
-        super(Client, self).__init__(active_config['url'], active_config['token'])
+    def __init__(self, settings, active_config, pool_maxsize=DEFAULT_POOL_MAXSIZE,
+                 response_cache=None, timeout=resilience.DEFAULT_TIMEOUT,
+                 retry_policy=None,
+                 failure_threshold=resilience.DEFAULT_FAILURE_THRESHOLD,
+                 reset_timeout=resilience.DEFAULT_RESET_TIMEOUT,
+                 instrumentation=None):
+        super(Client, self).__init__(active_config['url'], active_config['token'],
+                                     pool_maxsize=pool_maxsize,
+                                     response_cache=response_cache,
+                                     timeout=timeout, retry_policy=retry_policy,
+                                     namespace=settings.MY_NODE,
+                                     instrumentation=instrumentation)
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.pool_maxsize = pool_maxsize
+        self._remote_clients = {}
+        self._remote_clients_lock = threading.Lock()
         self.rsync_host = active_config['rsync_host']
         self.max_xfer_size = active_config['max_xfer_size']
         self.settings = settings
-        self.my_node = None
-        self.all_nodes = []
-        self.replicate_to = []
-        self.replicate_from = []
-        self.restore_to = []
-        self.restore_from = []
-        self.nodes_by_namespace = {}
-        self._init_nodes()
-
-    def _init_nodes(self):
-        """
-        Initializes some information about all known nodes, including
-        which node is ours, which nodes we can replicate to and from,
-        and which nodes we can restore to and from.
-        """
-        response = self.node_list()
-        data = response.json()
-        self.all_nodes = data['results']
-        for node in self.all_nodes:
+        self.node_cache_file = getattr(settings, 'NODE_CACHE_FILE', None)
+        self.node_cache_ttl = getattr(settings, 'NODE_CACHE_TTL', DEFAULT_NODE_CACHE_TTL)
+        self._topology = None
+        self._topology_fetched_at = 0
+        self._topology_lock = threading.Lock()
+        self._topology_refreshing = False
+        self.watermarks = watermarks.WatermarkStore(
+            getattr(settings, 'WATERMARK_FILE', None) or ':memory:')
+        self.registry_mirror = None
+        mirror_path = getattr(settings, 'REGISTRY_MIRROR_PATH', None)
+        if mirror_path:
+            self.registry_mirror = mirror.RegistryMirror(mirror_path)
+        cache_dir = getattr(settings, 'FIXITY_CACHE_DIR', None)
+        if cache_dir:
+            fixity_cache.configure(cache_dir, getattr(
+                settings, 'FIXITY_CACHE_MAX_ENTRIES', fixity_cache.DEFAULT_MAX_ENTRIES))
+
+    def close(self):
+        """
+        Closes the pooled connections to your own node and to all remote
+        nodes this client has talked to.
+        """
+        with self._remote_clients_lock:
+            remote_clients = list(self._remote_clients.values())
+            self._remote_clients = {}
+        for client in remote_clients:
+            client.close()
+        if self.registry_mirror is not None:
+            self.registry_mirror.close()
+            self.registry_mirror = None
+        self.watermarks.close()
+        super(Client, self).close()
+
+    def remote_client(self, remote_node_namespace):
+        """
+        Returns the pooled BaseClient for the node with the specified
+        namespace, creating it on first use. The same client is reused
+        for all later calls to that node. Each remote client has its own
+        circuit breaker, so calls to a node that is down fail fast without
+        holding up calls to other nodes.
+
+        :param remote_node_namespace: The namespace of the node to connect to.
+
+        :returns: BaseClient
+        """
+        with self._remote_clients_lock:
+            client = self._remote_clients.get(remote_node_namespace)
+            if client is None:
+                other_node = self.nodes_by_namespace[remote_node_namespace]
+                api_key = self.settings.KEYS[remote_node_namespace]
+                breaker = resilience.CircuitBreaker(
+                    remote_node_namespace, self.failure_threshold, self.reset_timeout)
+                client = BaseClient(other_node['api_root'], api_key,
+                                    pool_maxsize=self.pool_maxsize,
+                                    response_cache=self.response_cache,
+                                    timeout=self.timeout,
+                                    retry_policy=self.retry_policy,
+                                    circuit_breaker=breaker,
+                                    namespace=remote_node_namespace,
+                                    instrumentation=self.instrumentation)
+                self._remote_clients[remote_node_namespace] = client
+            return client
+
+    @property
+    def my_node(self):
+        return self._nodes()['my_node']
+
+    @property
+    def all_nodes(self):
+        return self._nodes()['all_nodes']
+
+    @property
+    def replicate_to(self):
+        return self._nodes()['replicate_to']
+
+    @property
+    def replicate_from(self):
+        return self._nodes()['replicate_from']
+
+    @property
+    def restore_to(self):
+        return self._nodes()['restore_to']
+
+    @property
+    def restore_from(self):
+        return self._nodes()['restore_from']
+
+    @property
+    def nodes_by_namespace(self):
+        return self._nodes()['nodes_by_namespace']
+
+    def _nodes(self):
+        """
+        Returns node info, loading it from the node cache file or the
+        server on first use, and starting a background refresh if it's
+        older than node_cache_ttl.
+        """
+        with self._topology_lock:
+            if self._topology is None:
+                nodes, fetched_at = self._read_node_cache()
+                if nodes is None:
+                    nodes, fetched_at = paging.fetch_all(self.node_list), time.time()
+                    self._write_node_cache(nodes, fetched_at)
+                self._set_nodes(nodes, fetched_at)
+            stale = time.time() - self._topology_fetched_at > self.node_cache_ttl
+            if stale and not self._topology_refreshing:
+                self._topology_refreshing = True
+                thread = threading.Thread(target=self._refresh_nodes_in_background)
+                thread.daemon = True
+                thread.start()
+            return self._topology
+
+    def refresh_nodes(self):
+        """
+        Reloads information about all known nodes from the server,
+        including which node is ours, which nodes we can replicate to and
+        from, and which nodes we can restore to and from. Saves it to the
+        node cache file, if there is one.
+
+        :raises RequestException: Check the response property for details.
+        """
+        nodes, fetched_at = paging.fetch_all(self.node_list), time.time()
+        self._write_node_cache(nodes, fetched_at)
+        with self._topology_lock:
+            self._set_nodes(nodes, fetched_at)
+        return True
+
+    def _refresh_nodes_in_background(self):
+        try:
+            self.refresh_nodes()
+        except Exception:
+            # Keep using the old node info. We'll try again next time
+            # someone asks for it.
+            pass
+        finally:
+            with self._topology_lock:
+                self._topology_refreshing = False
+
+    def _set_nodes(self, nodes, fetched_at):
+        topology = {
+            'my_node': None,
+            'all_nodes': nodes,
+            'replicate_to': [],
+            'replicate_from': [],
+            'restore_to': [],
+            'restore_from': [],
+            'nodes_by_namespace': {},
+        }
+        for node in nodes:
             if node['namespace'] == self.settings.MY_NODE:
-                self.my_node = node
+                topology['my_node'] = node
             if node['replicate_from']:
-                self.replicate_from.append(node)
+                topology['replicate_from'].append(node)
             if node['replicate_to']:
-                self.replicate_to.append(node)
+                topology['replicate_to'].append(node)
             if node['restore_from']:
-                self.restore_from.append(node)
+                topology['restore_from'].append(node)
             if node['restore_to']:
-                self.restore_to.append(node)
-            self.nodes_by_namespace[node['namespace']] = node
-        return True
+                topology['restore_to'].append(node)
+            topology['nodes_by_namespace'][node['namespace']] = node
+        self._topology = topology
+        self._topology_fetched_at = fetched_at
+
+    def _read_node_cache(self):
+        """
+        Returns (nodes, fetched_at) from the node cache file, or
+        (None, None) if there is no usable cache for this client's url.
+        """
+        if not self.node_cache_file:
+            return None, None
+        try:
+            with open(self.node_cache_file) as f:
+                data = json.load(f)
+        except (IOError, OSError, ValueError):
+            return None, None
+        if data.get('url') != self.url:
+            return None, None
+        return data['nodes'], data['fetched_at']
+
+    def _write_node_cache(self, nodes, fetched_at):
+        if not self.node_cache_file:
+            return
+        data = {'url': self.url, 'fetched_at': fetched_at, 'nodes': nodes}
+        tmp_file = "{0}.{1}.tmp".format(self.node_cache_file, threading.get_ident())
+        with open(tmp_file, 'w') as f:
+            json.dump(data, f)
+        os.replace(tmp_file, self.node_cache_file)
 
     def create_bag_entry(self, obj_id, bag_size, bag_type, fixity, local_id):
         """
@@ -71,6 +308,16 @@ class Client(BaseClient):
 
         :raises RequestException: Check the response property for details.
         """
+        entry = self._bag_entry(obj_id, bag_size, bag_type, fixity, local_id)
+        response = self.bag_create(entry)
+        if response is not None:
+            return jsoncodec.response_json(response)
+        return None
+
+    def _bag_entry(self, obj_id, bag_size, bag_type, fixity, local_id):
+        """
+        Validates the params of a new registry entry and returns the entry.
+        """
         if not util.looks_like_uuid(obj_id):
             raise ValueError("obj_id '{0}' should be a uuid".format(obj_id))
         if not isinstance(bag_size, int):
@@ -78,7 +325,7 @@ class Client(BaseClient):
         if not util.bag_type_valid(bag_type):
             raise ValueError("bag_type '{0}' is not valid".format(bag_type))
         timestamp = util.now_str()
-        entry = {
+        return {
             "original_node": self.my_node['namespace'],
             "admin_node": self.my_node['namespace'],
             "uuid": obj_id,
@@ -90,10 +337,6 @@ class Client(BaseClient):
             "size": bag_size,
             "first_version": obj_id,
         }
-        response = self.bag_create(entry)
-        if response is not None:
-            return response.json()
-        return None
 
     def create_transfer_request(self, obj_id, bag_size, username, fixity):
         """
@@ -110,6 +353,17 @@ class Client(BaseClient):
 
         :raises RequestException: Check the response property for details.
         """
+        xfer_req = self._transfer_request(obj_id, bag_size, username, fixity)
+        response = self.transfer_create(xfer_req)
+        if response is not None:
+            return jsoncodec.response_json(response)
+        return None
+
+    def _transfer_request(self, obj_id, bag_size, username, fixity, path=None):
+        """
+        Validates the params of a new transfer request and returns the request.
+        The link points at path, or at /dpn/bags/<obj_id>.tar if path is None.
+        """
         if not util.looks_like_uuid(obj_id):
             raise ValueError("obj_id '{0}' should be a uuid".format(obj_id))
         if not isinstance(bag_size, int):
@@ -118,8 +372,10 @@ class Client(BaseClient):
             raise ValueError("username must be a non-empty string")
         if not isinstance(fixity, str) or fixity.strip() == "":
             raise ValueError("fixity must be a non-empty string")
-        link = "{0}@{1}:/dpn/bags/{2}".format(username, self.rsync_host, obj_id + ".tar")
-        xfer_req = {
+        if path is None:
+            path = "/dpn/bags/" + obj_id + ".tar"
+        link = "{0}@{1}:{2}".format(username, self.rsync_host, path)
+        return {
             "uuid": obj_id,
             "link": link,
             "from_node": self.my_node['namespace'],
@@ -128,42 +384,472 @@ class Client(BaseClient):
             "fixity_algorithm": "sha256",
             "fixity_value": fixity,
         }
-        response = self.transfer_create(xfer_req)
-        if response is not None:
-            return response.json()
-        return None
 
-    def get_transfer_requests(self, remote_node_namespace):
+    def create_bag_entries(self, batch, max_workers=DEFAULT_BATCH_WORKERS):
+        """
+        Creates many registry entries on your own node. The whole batch is
+        validated before anything is sent, and then the valid entries are
+        created concurrently. One failed item does not stop the others.
+
+        :param batch: A list of dicts, each with the keys obj_id, bag_size,
+        bag_type, fixity and local_id. See create_bag_entry.
+        :param max_workers: Max number of entries to create at once.
+
+        :returns: A list with one dict per item in batch, in the same order.
+        Each has the keys 'item' (the item from batch), 'result' (the newly
+        created registry entry, or None) and 'error' (None, or the exception
+        raised for that item).
+        """
+        jobs = []
+        for item in batch:
+            jobs.append(self._batch_job(item, self._bag_entry, self.bag_create))
+        return self._run_batch(jobs, max_workers)
+
+    def create_transfer_requests(self, batch, to_nodes,
+                                 max_workers=DEFAULT_BATCH_WORKERS):
+        """
+        Creates transfer requests on your own node asking each of to_nodes
+        to copy each bag in batch. The whole batch is validated before
+        anything is sent, and then the valid requests are created
+        concurrently. One failed request does not stop the others.
+
+        :param batch: A list of dicts, each with the keys obj_id, bag_size
+        and fixity. See create_transfer_request. An item may also have a
+        path key: the absolute path of the bag on your rsync host, for the
+        link. It defaults to /dpn/bags/<obj_id>.tar.
+        :param to_nodes: A list of namespaces of the nodes that should copy
+        the bags.
+        :param max_workers: Max number of requests to create at once.
+
+        :returns: A list with one dict per bag per node, ordered by bag
+        and then by node. Each has the keys 'item' (the item from batch),
+        'to_node', 'result' (the newly created transfer request, or None)
+        and 'error' (None, or the exception raised for that request).
+        """
+        jobs = []
+        for item in batch:
+            for to_node in to_nodes:
+                params = dict(item, username=to_node)
+                job = self._batch_job(params, self._transfer_request,
+                                      self.transfer_create)
+                job['item'] = item
+                job['to_node'] = to_node
+                jobs.append(job)
+        return self._run_batch(jobs, max_workers)
+
+    def package_and_register(self, bag_dir, local_id, obj_id=None,
+                             bag_type=const.BAGTYPE_DATA, to_nodes=None,
+                             max_workers=DEFAULT_BATCH_WORKERS):
+        """
+        Tars a bag into OUTBOUND_DIR, computing its size and SHA-256 digest
+        as it's written (see packaging.package_bag), then creates its
+        registry entry and transfer requests asking each of to_nodes to
+        copy it. The tar is never read back.
+
+        :param bag_dir: Path to the bag directory.
+        :param local_id: Your own ID for the bag.
+        :param obj_id: The bag's DPN UUID. A new one is made if it's None.
+        :param bag_type: The type of bag. See const.BAG_TYPES.
+        :param to_nodes: Namespaces of the nodes that should copy the bag.
+        Defaults to all of replicate_to.
+        :param max_workers: Max number of transfer requests to create at once.
+
+        :returns: A dict with keys 'path', 'size' and 'fixity' (of the tar),
+        'bag' (the new registry entry) and 'transfers' (the results of
+        create_transfer_requests, one per node).
+
+        :raises RequestException: If the registry entry can't be created.
+        Check the response property for details. Failed transfer requests
+        don't raise; check the 'error' of each item in 'transfers'.
+        """
+        if obj_id is None:
+            obj_id = str(uuid.uuid4())
+        if to_nodes is None:
+            to_nodes = [node['namespace'] for node in self.replicate_to]
+        # Validate before spending time on the tar.
+        self._bag_entry(obj_id, 0, bag_type, 'pending', local_id)
+        result = packaging.package_bag(bag_dir, self.settings.OUTBOUND_DIR, obj_id)
+        result['bag'] = self.create_bag_entry(obj_id, result['size'], bag_type,
+                                              result['fixity'], local_id)
+        result['transfers'] = self.create_transfer_requests(
+            [{'obj_id': obj_id, 'bag_size': result['size'], 'fixity': result['fixity'],
+              'path': os.path.abspath(result['path'])}],
+            to_nodes, max_workers=max_workers)
+        return result
+
+    def _batch_job(self, params, build, create):
+        """
+        Validates one batch item and returns a job dict for _run_batch.
+        """
+        job = {'item': params, 'result': None, 'error': None}
+        try:
+            obj = build(**params)
+        except Exception as err:
+            job['error'] = err
+            return job
+        job['create'] = lambda: jsoncodec.response_json(create(obj))
+        return job
+
+    def _run_batch(self, jobs, max_workers):
+        """
+        Runs the create functions of all valid jobs on a thread pool, and
+        records each job's result or error.
+        """
+        def run(job):
+            try:
+                job['result'] = job.pop('create')()
+            except Exception as err:
+                job['error'] = err
+        runnable = [job for job in jobs if 'create' in job]
+        if runnable:
+            with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+                list(executor.map(run, runnable))
+        return jobs
+
+    def get_transfer_requests(self, remote_node_namespace,
+                              page_size=paging.DEFAULT_PAGE_SIZE,
+                              max_workers=paging.DEFAULT_MAX_WORKERS,
+                              as_records=False):
         """
         Retrieves transfer requests from another node (specified by namespace)
-        that your node is supposed to fulfill.
+        that your node is supposed to fulfill. After the first page, the
+        remaining pages are fetched concurrently.
 
         :param remote_node_namespace: The namespace of the node to connect to.
+        :param page_size: Number of transfer requests to fetch per page.
+        :param max_workers: Max number of pages to fetch at once.
+        :param as_records: Return records.Transfer objects instead of dicts.
 
-        :returns: A list of transfer requests, each of which is a dict.
+        :returns: A list of transfer requests in the order the remote node
+        returns them.
 
         :raises RequestException: Check the response property for details.
         """
-        other_node = self.nodes_by_namespace[remote_node_namespace]
-        url = other_node['api_root']
-        api_key = self.settings.KEYS[remote_node_namespace]
-        client = BaseClient(url, api_key)
-        page_num = 0
-        xfer_requests = []
-
-        # Get transfer requests in batches
-        while True:
-            page_num += 1
-            response = client.transfer_list(status='Requested',
-                                            page_size=20,
-                                            to_node=self.settings.MY_NODE,
-                                            page=page_num)
-            data = response.json()
-            xfer_requests.extend(data['results'])
-            if len(xfer_requests) >= data['count']:
-                break
-
-        return xfer_requests
+        client = self.remote_client(remote_node_namespace)
+        record_type = records.Transfer if as_records else None
+        return paging.fetch_all(client.transfer_list,
+                                page_size=page_size,
+                                max_workers=max_workers,
+                                record_type=record_type,
+                                status=const.STATUS_REQUESTED,
+                                to_node=self.settings.MY_NODE)
+
+    def get_restore_requests(self, remote_node_namespace,
+                             page_size=paging.DEFAULT_PAGE_SIZE,
+                             max_workers=paging.DEFAULT_MAX_WORKERS,
+                             as_records=False):
+        """
+        Retrieves restore requests from another node (specified by namespace)
+        that your node is supposed to fulfill: those in Requested status
+        whose from_node (the node the bag is restored from) is yours. After
+        the first page, the remaining pages are fetched concurrently.
+
+        :param remote_node_namespace: The namespace of the node to connect to.
+        :param page_size: Number of restore requests to fetch per page.
+        :param max_workers: Max number of pages to fetch at once.
+        :param as_records: Return records.Restore objects instead of dicts.
+
+        :returns: A list of restore requests in the order the remote node
+        returns them.
+
+        :raises RequestException: Check the response property for details.
+        """
+        client = self.remote_client(remote_node_namespace)
+        found = paging.fetch_all(client.restore_list,
+                                 page_size=page_size,
+                                 max_workers=max_workers,
+                                 status=const.STATUS_REQUESTED,
+                                 from_node=self.settings.MY_NODE)
+        # from_node isn't a documented restore_list filter, so a node may
+        # ignore it and send every node's requests.
+        found = [restore for restore in found
+                 if restore.get('from_node') == self.settings.MY_NODE]
+        if as_records:
+            found = [records.Restore.from_dict(restore) for restore in found]
+        return found
+
+    def poll_transfer_changes(self, remote_node_namespace,
+                              page_size=paging.DEFAULT_PAGE_SIZE,
+                              as_records=False):
+        """
+        Retrieves the transfer requests from another node that your node
+        is supposed to fulfill and that are new or have changed since the
+        last call. Only records updated at or after the watermark (the
+        newest updated_at seen last time) are requested, so when nothing
+        has changed this costs one small request. The filter is inclusive
+        (after = one second before the watermark), so a record committed
+        late with the same updated_at as the watermark isn't missed. The
+        results are diffed against the snapshot of replication IDs and
+        updated_at values saved by earlier calls, so records already seen
+        aren't returned again. Once the node is seen to honor the filter,
+        snapshot entries older than the next filter are pruned, so the
+        snapshot stays small.
+
+        If the node ignores the after filter and sends every pending
+        request, that complete listing replaces the snapshot.
+
+        The first call for a node returns all of its pending requests.
+        Call self.watermarks.reset() to start over.
+
+        :param remote_node_namespace: The namespace of the node to connect to.
+        :param page_size: Number of transfer requests to fetch per page.
+        :param as_records: Return records.Transfer objects instead of dicts.
+
+        :returns: A list of new or changed transfer requests.
+
+        :raises RequestException: Check the response property for details.
+        The watermark is only moved when the call succeeds.
+        """
+        client = self.remote_client(remote_node_namespace)
+        endpoint = 'transfer_list'
+        watermark = self.watermarks.get(remote_node_namespace, endpoint)
+        filters = {'status': const.STATUS_REQUESTED, 'to_node': self.settings.MY_NODE}
+        after = None
+        if watermark is not None:
+            after = util.just_before(watermark)
+            filters['after'] = after
+        found = paging.fetch_all(client.transfer_list, page_size=page_size, **filters)
+        snapshot = dict((xfer['replication_id'], xfer.get('updated_at')) for xfer in found)
+        filtered = after is None or all(
+            (xfer.get('updated_at') or '') > after for xfer in found)
+        previous = self.watermarks.snapshot(remote_node_namespace, endpoint)
+        changes = [xfer for xfer in found
+                   if previous.get(xfer['replication_id']) != xfer.get('updated_at')]
+        newest = max([watermark or ''] + [updated_at or '' for updated_at in snapshot.values()])
+        # An unfiltered response is a complete listing, so it replaces the
+        # snapshot. A filtered one is merged in, and once the node is known
+        # to honor the filter, entries the next filter can't return again
+        # are dropped.
+        prune_before = None
+        if after is not None and filtered and newest:
+            prune_before = util.just_before(newest)
+        self.watermarks.save(remote_node_namespace, endpoint, newest or None,
+                             snapshot, replace=not filtered or watermark is None,
+                             prune_before=prune_before)
+        if as_records:
+            changes = [records.Transfer.from_dict(xfer) for xfer in changes]
+        return changes
+
+    def poll_all_transfer_requests(self, timeout=DEFAULT_POLL_TIMEOUT,
+                                   page_size=paging.DEFAULT_PAGE_SIZE,
+                                   incremental=False):
+        """
+        Retrieves transfer requests from every node in replicate_from at
+        the same time. A slow or dead node only costs its own timeout;
+        results from the other nodes come back as soon as they're ready.
+
+        :param timeout: Number of seconds to wait for each node.
+        :param page_size: Number of transfer requests to fetch per page.
+        :param incremental: Set to True to get only transfer requests that
+        are new or changed since the last poll. See poll_transfer_changes.
+
+        :returns: A dict keyed by node namespace. Each value is a dict with
+        keys 'transfers' (a list of transfer requests, or None if the node
+        failed), 'error' (None, or the exception raised for that node) and
+        'elapsed' (seconds spent on that node).
+        """
+        def poll(namespace):
+            result = {'transfers': None, 'error': None, 'elapsed': None}
+            start = time.time()
+            try:
+                if incremental:
+                    result['transfers'] = self.poll_transfer_changes(
+                        namespace, page_size=page_size)
+                else:
+                    result['transfers'] = self.get_transfer_requests(
+                        namespace, page_size=page_size)
+            except Exception as err:
+                result['error'] = err
+            result['elapsed'] = time.time() - start
+            return result
+
+        nodes = [node['namespace'] for node in self.replicate_from]
+        results = {}
+        if not nodes:
+            return results
+        executor = ThreadPoolExecutor(max_workers=len(nodes))
+        try:
+            futures = [(namespace, executor.submit(poll, namespace))
+                       for namespace in nodes]
+            deadline = time.time() + timeout
+            for namespace, future in futures:
+                try:
+                    results[namespace] = future.result(max(0, deadline - time.time()))
+                except FutureTimeoutError:
+                    future.cancel()
+                    results[namespace] = {
+                        'transfers': None,
+                        'error': FutureTimeoutError(
+                            "{0} did not respond within {1} seconds".format(
+                                namespace, timeout)),
+                        'elapsed': timeout,
+                    }
+        finally:
+            # Don't wait on nodes that timed out.
+            executor.shutdown(wait=False)
+        return results
+
+    def _list_client(self, remote_node_namespace):
+        if remote_node_namespace is None:
+            return self
+        return self.remote_client(remote_node_namespace)
+
+    def iter_nodes(self, page_size=paging.DEFAULT_PAGE_SIZE,
+                   as_records=False, **kwargs):
+        """
+        Yields node records from your own node one at a time, prefetching
+        the next page while you consume the current one.
+
+        :param page_size: Number of records to request per page.
+        :param as_records: Yield records.Node objects instead of dicts.
+        :param kwargs: Filters. See BaseClient.node_list, and the prefetch
+        and incremental options of paging.iter_records.
+
+        :returns: A generator of nodes.
+
+        :raises RequestException: Check the response property for details.
+        """
+        record_type = records.Node if as_records else None
+        return paging.iter_records(self.node_list, page_size=page_size,
+                                   record_type=record_type, **kwargs)
+
+    def iter_bags(self, page_size=paging.DEFAULT_PAGE_SIZE,
+                  as_records=False, **kwargs):
+        """
+        Yields bag entries from your own node one at a time, prefetching
+        the next page while you consume the current one.
+
+        :param page_size: Number of records to request per page.
+        :param as_records: Yield records.Bag objects instead of dicts.
+        :param kwargs: Filters. See BaseClient.bag_list, and the prefetch
+        and incremental options of paging.iter_records.
+
+        :returns: A generator of bag entries.
+
+        :raises RequestException: Check the response property for details.
+        """
+        record_type = records.Bag if as_records else None
+        return paging.iter_records(self.bag_list, page_size=page_size,
+                                   record_type=record_type, **kwargs)
+
+    def iter_transfers(self, remote_node_namespace=None,
+                       page_size=paging.DEFAULT_PAGE_SIZE,
+                       as_records=False, **kwargs):
+        """
+        Yields transfer requests one at a time, prefetching the next page
+        while you consume the current one.
+
+        :param remote_node_namespace: The namespace of the node to query.
+        Defaults to your own node.
+        :param page_size: Number of records to request per page.
+        :param as_records: Yield records.Transfer objects instead of dicts.
+        :param kwargs: Filters. See BaseClient.transfer_list, and the prefetch
+        and incremental options of paging.iter_records.
+
+        :returns: A generator of transfer requests.
+
+        :raises RequestException: Check the response property for details.
+        """
+        client = self._list_client(remote_node_namespace)
+        record_type = records.Transfer if as_records else None
+        return paging.iter_records(client.transfer_list, page_size=page_size,
+                                   record_type=record_type, **kwargs)
+
+    def iter_restores(self, remote_node_namespace=None,
+                      page_size=paging.DEFAULT_PAGE_SIZE,
+                      as_records=False, **kwargs):
+        """
+        Yields restore requests one at a time, prefetching the next page
+        while you consume the current one.
+
+        :param remote_node_namespace: The namespace of the node to query.
+        Defaults to your own node.
+        :param page_size: Number of records to request per page.
+        :param as_records: Yield records.Restore objects instead of dicts.
+        :param kwargs: Filters. See BaseClient.restore_list, and the prefetch
+        and incremental options of paging.iter_records.
+
+        :returns: A generator of restore requests.
+
+        :raises RequestException: Check the response property for details.
+        """
+        client = self._list_client(remote_node_namespace)
+        record_type = records.Restore if as_records else None
+        return paging.iter_records(client.restore_list, page_size=page_size,
+                                   record_type=record_type, **kwargs)
+
+    def sync_registry_mirror(self, remote_node_namespace=None,
+                             collections=('bag', 'transfer', 'restore'),
+                             page_size=mirror.DEFAULT_SYNC_PAGE_SIZE):
+        """
+        Copies new and updated bags, transfer requests and restore
+        requests into the local registry mirror. See RegistryMirror.sync.
+
+        :param remote_node_namespace: Namespace of the node whose registry
+        to copy. Defaults to your own node.
+        :param collections: Which of 'bag', 'transfer' and 'restore' to sync.
+        :param page_size: Number of records to request per page.
+
+        :returns: A dict with the number of records written per collection.
+
+        :raises ValueError: If REGISTRY_MIRROR_PATH is not set.
+        :raises RequestException: Check the response property for details.
+        """
+        client = self._list_client(remote_node_namespace)
+        return self._mirror().sync(client, collections=collections,
+                                   page_size=page_size,
+                                   source=remote_node_namespace or self.settings.MY_NODE)
+
+    def find_bags(self, as_records=False, **filters):
+        """
+        Returns bag entries from the local registry mirror that match all
+        filters, e.g. find_bags(local_id='my-bag') or
+        find_bags(admin_node='chron').
+
+        :param as_records: Return records.Bag objects instead of dicts.
+        :param filters: uuid, local_id, admin_node, original_node,
+        ingest_node, bag_type, size or updated_at.
+
+        :raises ValueError: If REGISTRY_MIRROR_PATH is not set, or a filter
+        can't be used.
+        """
+        return self._mirror().find('bag', as_records=as_records, **filters)
+
+    def bags_held_by(self, namespace, as_records=False):
+        """
+        Returns bag entries from the local registry mirror that list
+        namespace among their replicating nodes.
+
+        :raises ValueError: If REGISTRY_MIRROR_PATH is not set.
+        """
+        return self._mirror().bags_held_by(namespace, as_records=as_records)
+
+    def find_transfers(self, as_records=False, **filters):
+        """
+        Returns transfer requests from the local registry mirror that
+        match all filters (replication_id, uuid, from_node, to_node,
+        status or updated_at).
+
+        :raises ValueError: If REGISTRY_MIRROR_PATH is not set, or a filter
+        can't be used.
+        """
+        return self._mirror().find('transfer', as_records=as_records, **filters)
+
+    def find_restores(self, as_records=False, **filters):
+        """
+        Returns restore requests from the local registry mirror that
+        match all filters (restore_id, uuid, from_node, to_node, status
+        or updated_at).
+
+        :raises ValueError: If REGISTRY_MIRROR_PATH is not set, or a filter
+        can't be used.
+        """
+        return self._mirror().find('restore', as_records=as_records, **filters)
+
+    def _mirror(self):
+        if self.registry_mirror is None:
+            raise ValueError("REGISTRY_MIRROR_PATH is not set")
+        return self.registry_mirror
 
     def reject_transfer_request(self, remote_node_namespace, replication_id):
         """
@@ -177,7 +863,7 @@ class Client(BaseClient):
         :raises RequestException: Check the response property for details.
         """
         return self._update_transfer_request(
-            remote_node_namespace, replication_id, const.STATUS_REJECT, None)
+            remote_node_namespace, replication_id, const.STATUS_REJECTED, None)
 
     def set_transfer_fixity(self, remote_node_namespace, replication_id, fixity):
         """
@@ -196,18 +882,67 @@ class Client(BaseClient):
         return self._update_transfer_request(
             remote_node_namespace, replication_id, None, fixity)
 
+    def update_restore_request(self, remote_node_namespace, restore_id, status,
+                               link=None):
+        """
+        Tells a remote node the new status of one of its restore requests.
+
+        :param remote_node_namespace: The namespace of the node to connect to.
+        :param restore_id: The ID of the restore request.
+        :param status: The new status. See const.STATUSES.
+        :param link: Where the node can copy the restored bag from, if you
+        are setting it.
+
+        :returns: An updated restore request.
+
+        :raises RequestException: Check the response property for details.
+        """
+        client = self.remote_client(remote_node_namespace)
+        data = { "restore_id": restore_id, "status": status }
+        if link is not None:
+            data['link'] = link
+        return jsoncodec.response_json(client.restore_update(data))
+
+    def fulfill_restore_requests(self, namespaces=None, **kwargs):
+        """
+        Fulfills all pending restore requests from the specified nodes:
+        marks each one Accepted, stages its bag, then marks it Prepared
+        (with the link to copy it from) and Finished, with many restores
+        in flight at once. See restore.RestoreEngine.
+
+        :param namespaces: List of node namespaces to take restore requests
+        from. Defaults to all of restore_from.
+        :param kwargs: Passed through to restore.RestoreEngine (stager,
+        storage_dir, stage_workers, update_workers, finish, on_progress).
+
+        :returns: The engine's report, with the end-to-end time of each
+        restore. See restore.RestoreEngine.report.
+        """
+        return restore.RestoreEngine(self, **kwargs).run(namespaces)
+
+    def transfer_update_queue(self, **kwargs):
+        """
+        Returns a TransferUpdateQueue that batches set_transfer_fixity and
+        reject_transfer_request calls and sends them concurrently, using
+        settings.UPDATE_JOURNAL_FILE (if set) as its journal. Close the
+        queue to send whatever is still pending.
+
+        :param kwargs: Passed through to TransferUpdateQueue (max_pending,
+        max_delay, max_workers, on_error).
+
+        :returns: A TransferUpdateQueue.
+        """
+        kwargs.setdefault('journal_path', getattr(self.settings, 'UPDATE_JOURNAL_FILE', None))
+        return update_queue.TransferUpdateQueue(self, **kwargs)
+
     def _update_transfer_request(self, remote_node_namespace, replication_id, status, fixity):
-        other_node = self.nodes_by_namespace[remote_node_namespace]
-        url = other_node['api_root']
-        api_key = self.settings.KEYS[remote_node_namespace]
-        client = BaseClient(url, api_key)
+        client = self.remote_client(remote_node_namespace)
         data = { "replication_id": replication_id }
         if status is not None:
             data['status'] = status
         if fixity is not None:
             data['fixity_value'] = fixity
-        print(data)
         response = client.transfer_update(data)
         if response is not None:
-            return response.json()
+            return jsoncodec.response_json(response)
         return None
@@ -0,0 +1,242 @@
+import hashlib
+import json
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import parse_qsl, urlencode, urlparse
+from . import util
+
+# The field that identifies each kind of record, keyed by the name of
+# its collection in the API.
+ID_FIELDS = {
+    'node': 'namespace',
+    'bag': 'uuid',
+    'replicate': 'replication_id',
+    'restore': 'restore_id',
+}
+
+# Query params that control paging and ordering, not filtering.
+NON_FILTER_PARAMS = ('page', 'page_size', 'ordering', 'before', 'after')
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class FakeRegistry:
+    """
+    An in-process stand-in for a DPN node's REST API, for tests and
+    benchmarks. It serves /api-v1/node/, /bag/, /replicate/ and /restore/
+    with list (paged, filtered by exact field match and by updated_at
+    with before/after), get, create and update, from records kept in
+    memory.
+
+        with FakeRegistry(latency=0.01) as registry:
+            registry.add('bag', {'uuid': '...', ...})
+            client = BaseClient(registry.url, registry.token)
+
+    :param token: API token clients must send. None accepts any token.
+    :param latency: Seconds to wait before answering each request.
+    :param error_rate: Fraction of requests (0.0 - 1.0) answered with a 500.
+    :param seed: Seed for the random numbers behind error_rate.
+    """
+    def __init__(self, token='fake-token', latency=0, error_rate=0, seed=None):
+        self.token = token
+        self.latency = latency
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.records = dict((collection, {}) for collection in ID_FIELDS)
+        self.request_count = 0
+        self._lock = threading.Lock()
+        self._server = None
+        self._thread = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+        return False
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return "http://{0}:{1}".format(host, port)
+
+    def start(self):
+        """
+        Starts serving on a free port on 127.0.0.1.
+        """
+        registry = self
+        class Handler(_Handler):
+            pass
+        Handler.registry = registry
+        self._server = _ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self._thread = threading.Thread(target=self._server.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """
+        Stops the server.
+        """
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def add(self, collection, record):
+        """
+        Adds a record to a collection ('node', 'bag', 'replicate' or
+        'restore') without going through the API.
+        """
+        record = dict(record)
+        id_field = ID_FIELDS[collection]
+        if not record.get(id_field):
+            record[id_field] = str(uuid.uuid4())
+        record.setdefault('updated_at', util.now_str())
+        with self._lock:
+            self.records[collection][record[id_field]] = record
+        return record
+
+    def get(self, collection, record_id):
+        """
+        Returns a record, or None.
+        """
+        with self._lock:
+            return self.records[collection].get(record_id)
+
+    # Called by the request handler with the lock NOT held.
+
+    def _list(self, collection, params):
+        page = int(params.get('page', 1))
+        page_size = int(params.get('page_size', 20))
+        with self._lock:
+            results = [record for record in self.records[collection].values()
+                       if _matches(record, params)]
+        if params.get('ordering'):
+            field = params['ordering'].split(',')[0]
+            reverse = field.startswith('-')
+            field = field.lstrip('-')
+            results.sort(key=lambda record: str(record.get(field)), reverse=reverse)
+        count = len(results)
+        start = (page - 1) * page_size
+        if page < 1 or (start >= count and page > 1):
+            return 404, {'detail': 'Invalid page.'}
+        return 200, {
+            'count': count,
+            'next': _page_link(collection, params, page + 1) if start + page_size < count else None,
+            'previous': _page_link(collection, params, page - 1) if page > 1 else None,
+            'results': results[start:start + page_size],
+        }
+
+    def _create(self, collection, record):
+        id_field = ID_FIELDS[collection]
+        if not record.get(id_field):
+            record[id_field] = str(uuid.uuid4())
+        with self._lock:
+            if record[id_field] in self.records[collection]:
+                return 400, {id_field: ['already exists']}
+            record.setdefault('updated_at', util.now_str())
+            self.records[collection][record[id_field]] = record
+        return 201, record
+
+    def _update(self, collection, record_id, changes):
+        with self._lock:
+            record = self.records[collection].get(record_id)
+            if record is None:
+                return 404, {'detail': 'Not found.'}
+            record = dict(record, **changes)
+            record[ID_FIELDS[collection]] = record_id
+            record['updated_at'] = util.now_str()
+            self.records[collection][record_id] = record
+        return 200, record
+
+
+def _matches(record, params):
+    for name, value in params.items():
+        if name in NON_FILTER_PARAMS:
+            continue
+        if str(record.get(name)).lower() != value.lower():
+            return False
+    if 'after' in params and not record.get('updated_at', '') > params['after']:
+        return False
+    if 'before' in params and not record.get('updated_at', '') < params['before']:
+        return False
+    return True
+
+def _page_link(collection, params, page):
+    params = dict(params, page=page)
+    return "/api-v1/{0}/?{1}".format(collection, urlencode(sorted(params.items())))
+
+
+class _Handler(BaseHTTPRequestHandler):
+    registry = None
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        self._handle('GET')
+
+    def do_POST(self):
+        self._handle('POST')
+
+    def do_PUT(self):
+        self._handle('PUT')
+
+    def _handle(self, method):
+        registry = self.registry
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+        with registry._lock:
+            registry.request_count += 1
+            fail = registry.error_rate and registry.random.random() < registry.error_rate
+        if registry.latency:
+            time.sleep(registry.latency)
+        if fail:
+            return self._send(500, {'detail': 'Injected error.'})
+        if registry.token is not None and \
+                self.headers.get('Authorization') != 'token {0}'.format(registry.token):
+            return self._send(401, {'detail': 'Invalid token.'})
+        url = urlparse(self.path)
+        parts = [part for part in url.path.split('/') if part]
+        if len(parts) < 2 or parts[0] != 'api-v1' or parts[1] not in ID_FIELDS:
+            return self._send(404, {'detail': 'Not found.'})
+        collection = parts[1]
+        record_id = parts[2] if len(parts) > 2 else None
+        if method == 'GET' and record_id is None:
+            return self._send(*registry._list(collection, dict(parse_qsl(url.query))))
+        if method == 'GET':
+            record = registry.get(collection, record_id)
+            if record is None:
+                return self._send(404, {'detail': 'Not found.'})
+            return self._send(200, record, etag=True)
+        try:
+            data = json.loads(body.decode('utf-8'))
+        except ValueError:
+            return self._send(400, {'detail': 'Invalid JSON.'})
+        if method == 'POST' and record_id is None:
+            return self._send(*registry._create(collection, data))
+        if method == 'PUT' and record_id is not None:
+            return self._send(*registry._update(collection, record_id, data))
+        return self._send(405, {'detail': 'Method not allowed.'})
+
+    def _send(self, status, data, etag=False):
+        body = json.dumps(data).encode('utf-8')
+        headers = {'Content-Type': 'application/json'}
+        if etag:
+            headers['ETag'] = '"{0}"'.format(hashlib.sha1(body).hexdigest())
+            if self.headers.get('If-None-Match') == headers['ETag']:
+                status, body = 304, b''
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
@@ -0,0 +1,142 @@
+import os
+import sqlite3
+import threading
+import time
+
+# Name of the SQLite file the cache keeps in its cache directory.
+CACHE_FILE_NAME = 'fixity_cache.sqlite3'
+
+# Default max number of digests to keep before evicting the least
+# recently used ones.
+DEFAULT_MAX_ENTRIES = 100000
+
+class FixityCache:
+    """
+    On-disk cache of file checksums, so that re-validating or re-sending
+    an unchanged bag doesn't mean re-hashing it. Entries are keyed on
+    the file's path, inode, size and modification time (in nanoseconds)
+    plus the algorithm, so a file that has been replaced or modified
+    since it was hashed is never served from the cache.
+
+    util.digest consults the default cache (see configure()) automatically.
+
+    :param cache_dir: Directory in which to keep the cache database.
+    It will be created if it doesn't exist.
+
+    :param max_entries: Max number of digests to keep. When the cache
+    grows beyond this, the least recently used digests are evicted.
+    """
+    def __init__(self, cache_dir, max_entries=DEFAULT_MAX_ENTRIES):
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        self.path = os.path.join(cache_dir, CACHE_FILE_NAME)
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self.path, check_same_thread=False)
+        with self._db:
+            self._db.execute(
+                "create table if not exists fixity ("
+                "path text not null, algorithm text not null, "
+                "inode integer not null, size integer not null, "
+                "mtime_ns integer not null, digest text not null, "
+                "last_used real not null, "
+                "primary key (path, algorithm))")
+            self._db.execute(
+                "create index if not exists ix_fixity_last_used "
+                "on fixity (last_used)")
+
+    def close(self):
+        """
+        Closes the cache database.
+        """
+        with self._lock:
+            self._db.close()
+
+    def get(self, abs_path, algorithm, stat=None):
+        """
+        Returns the cached hex digest of a file, or None if the file has
+        not been hashed with this algorithm or has changed since.
+
+        :param abs_path: Absolute path to file.
+        :param algorithm: Either 'md5' or 'sha256'
+        :param stat: The file's os.stat result, if you already have it.
+        """
+        if stat is None:
+            stat = os.stat(abs_path)
+        with self._lock:
+            row = self._db.execute(
+                "select digest from fixity where path = ? and algorithm = ? "
+                "and inode = ? and size = ? and mtime_ns = ?",
+                (abs_path, algorithm, stat.st_ino, stat.st_size,
+                 stat.st_mtime_ns)).fetchone()
+            if row is None:
+                return None
+            with self._db:
+                self._db.execute(
+                    "update fixity set last_used = ? "
+                    "where path = ? and algorithm = ?",
+                    (time.time(), abs_path, algorithm))
+        return row[0]
+
+    def put(self, abs_path, algorithm, digest, stat=None):
+        """
+        Saves the hex digest of a file, evicting the least recently
+        used digests if the cache is full.
+
+        :param abs_path: Absolute path to file.
+        :param algorithm: Either 'md5' or 'sha256'
+        :param digest: The hex digest of the file.
+        :param stat: The file's os.stat result from before it was hashed.
+        """
+        if stat is None:
+            stat = os.stat(abs_path)
+        with self._lock, self._db:
+            self._db.execute(
+                "insert or replace into fixity (path, algorithm, inode, size, "
+                "mtime_ns, digest, last_used) values (?, ?, ?, ?, ?, ?, ?)",
+                (abs_path, algorithm, stat.st_ino, stat.st_size,
+                 stat.st_mtime_ns, digest, time.time()))
+            count = self._db.execute("select count(*) from fixity").fetchone()[0]
+            if count > self.max_entries:
+                self._db.execute(
+                    "delete from fixity where rowid in (select rowid from "
+                    "fixity order by last_used limit ?)",
+                    (count - self.max_entries,))
+
+    def invalidate(self, abs_path):
+        """
+        Removes all cached digests for a file.
+        """
+        with self._lock, self._db:
+            self._db.execute("delete from fixity where path = ?", (abs_path,))
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute("select count(*) from fixity").fetchone()[0]
+
+
+_default_cache = None
+
+def configure(cache_dir, max_entries=DEFAULT_MAX_ENTRIES):
+    """
+    Sets up the default cache that util.digest consults. Pass None for
+    cache_dir to turn the default cache off.
+
+    :returns: The new default FixityCache, or None.
+    """
+    global _default_cache
+    if _default_cache is not None:
+        if (cache_dir is not None and _default_cache.max_entries == max_entries
+                and _default_cache.path == os.path.join(cache_dir, CACHE_FILE_NAME)):
+            return _default_cache
+        _default_cache.close()
+    _default_cache = None
+    if cache_dir is not None:
+        _default_cache = FixityCache(cache_dir, max_entries)
+    return _default_cache
+
+def default_cache():
+    """
+    Returns the default FixityCache, or None if it is not configured.
+    """
+    return _default_cache
@@ -0,0 +1,144 @@
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Number of bytes to read from the network at a time when decoding a
+# page incrementally.
+DEFAULT_CHUNK_SIZE = 64 * 1024
+
+# Name of the JSON backend in use: 'orjson' or 'json'.
+BACKEND = 'orjson' if orjson is not None else 'json'
+
+def dumps(obj):
+    """
+    Returns obj serialized as JSON text, using orjson when it's installed
+    and the standard library json module otherwise.
+    """
+    if orjson is not None:
+        return orjson.dumps(obj).decode('utf-8')
+    return json.dumps(obj)
+
+def loads(data):
+    """
+    Returns the object encoded in data (bytes or str), using orjson when
+    it's installed and the standard library json module otherwise.
+    """
+    if orjson is not None:
+        return orjson.loads(data)
+    if isinstance(data, bytes):
+        data = data.decode('utf-8')
+    return json.loads(data)
+
+def response_json(response):
+    """
+    Returns the decoded body of a requests.Response. Same as
+    response.json(), but faster for big pages when orjson is installed.
+    """
+    return loads(response.content)
+
+
+class StreamedPage:
+    """
+    Decodes one page of a DPN list endpoint ({"count": ..., "next": ...,
+    "results": [...]}) incrementally from a stream of byte chunks. Iterate
+    over results to get records one at a time as their bytes arrive, so a
+    big page never has to be held in memory as one string or one list.
+    The page's other keys (count, next, previous) are in meta once the
+    parser has passed them; DRF sends them before results, so they're
+    normally available as soon as the first record is.
+
+        page = StreamedPage(response.iter_content(64 * 1024))
+        for record in page.results:
+            ...
+        total = page.meta['count']
+
+    :param chunks: An iterable of bytes, such as response.iter_content().
+    """
+    def __init__(self, chunks):
+        self.meta = {}
+        self._decoder = json.JSONDecoder()
+        self._buffer = ''
+        self._pos = 0
+        self._chunks = iter(chunks)
+        self._pending = b''
+        self.results = self._parse()
+
+    def _fill(self):
+        """
+        Reads the next chunk into the buffer. Returns False at end of stream.
+        """
+        for chunk in self._chunks:
+            data = self._pending + chunk
+            try:
+                text = data.decode('utf-8')
+                self._pending = b''
+            except UnicodeDecodeError as err:
+                # A multi-byte character is split across chunks.
+                text = data[:err.start].decode('utf-8')
+                self._pending = data[err.start:]
+            self._buffer = self._buffer[self._pos:] + text
+            self._pos = 0
+            return True
+        return False
+
+    def _skip_whitespace(self):
+        while True:
+            while self._pos < len(self._buffer) and self._buffer[self._pos] in ' \t\n\r':
+                self._pos += 1
+            if self._pos < len(self._buffer) or not self._fill():
+                return
+
+    def _expect(self, chars):
+        self._skip_whitespace()
+        if self._pos >= len(self._buffer) or self._buffer[self._pos] not in chars:
+            raise ValueError("Expected one of {0!r} at position {1}".format(
+                chars, self._pos))
+        char = self._buffer[self._pos]
+        self._pos += 1
+        return char
+
+    def _value(self):
+        """
+        Decodes the next complete JSON value, reading more chunks until
+        the buffer holds all of it.
+        """
+        self._skip_whitespace()
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self._buffer, self._pos)
+                # A number at the end of the buffer may be cut short.
+                if end < len(self._buffer) or not isinstance(value, (int, float)):
+                    self._pos = end
+                    return value
+            except ValueError:
+                pass
+            if not self._fill():
+                value, end = self._decoder.raw_decode(self._buffer, self._pos)
+                self._pos = end
+                return value
+
+    def _parse(self):
+        self._expect('{')
+        self._skip_whitespace()
+        if self._buffer[self._pos:self._pos + 1] == '}':
+            return
+        while True:
+            key = self._value()
+            self._expect(':')
+            if key == 'results':
+                self._expect('[')
+                self._skip_whitespace()
+                if self._buffer[self._pos:self._pos + 1] == ']':
+                    self._pos += 1
+                else:
+                    while True:
+                        yield self._value()
+                        if self._expect(',]') == ']':
+                            break
+            else:
+                self.meta[key] = self._value()
+            if self._expect(',}') == '}':
+                return
@@ -0,0 +1,146 @@
+import bisect
+import threading
+
+# Upper bounds, in seconds, of the latency histogram buckets.
+DEFAULT_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                           1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+class Instrumentation:
+    """
+    Receives one record for every call BaseClient makes to a DPN node.
+    This base class ignores everything, and is what BaseClient uses
+    unless you give it something else. Subclass it and override record()
+    to send the numbers wherever you like.
+    """
+    def record(self, endpoint, namespace, status, latency, request_bytes,
+               response_bytes, retries):
+        """
+        Records one call.
+
+        :param endpoint: Name of the BaseClient method, e.g. 'bag_get'.
+        :param namespace: Namespace of the node called, or None if unknown.
+        :param status: HTTP status code of the final response, or None if
+        the call failed without a response (connection error, timeout,
+        open circuit breaker).
+        :param latency: Seconds spent on the call, including retries.
+        :param request_bytes: Size of the request body.
+        :param response_bytes: Size of the response body.
+        :param retries: Number of retries made.
+        """
+        pass
+
+NULL_INSTRUMENTATION = Instrumentation()
+
+
+class Histogram:
+    """
+    Cumulative histogram in the style of Prometheus.
+    """
+    def __init__(self, buckets=DEFAULT_LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def cumulative_counts(self):
+        """
+        Returns a list of (upper_bound, count) pairs, ending with
+        ('+Inf', total count).
+        """
+        result = []
+        running = 0
+        for bound, count in zip(self.buckets + ('+Inf',), self.counts):
+            running += count
+            result.append((bound, running))
+        return result
+
+
+class EndpointStats:
+    """
+    Totals for one (endpoint, namespace, status) combination.
+    """
+    def __init__(self, buckets):
+        self.latency = Histogram(buckets)
+        self.request_bytes = 0
+        self.response_bytes = 0
+        self.retries = 0
+
+    @property
+    def calls(self):
+        return self.latency.count
+
+
+class InMemoryMetrics(Instrumentation):
+    """
+    Keeps latency histograms and byte and retry totals in memory, per
+    endpoint, namespace and status. Use stats() to read them, or
+    prometheus_text() to expose them to a Prometheus scraper.
+
+    :param buckets: Upper bounds, in seconds, of the latency buckets.
+    """
+    def __init__(self, buckets=DEFAULT_LATENCY_BUCKETS):
+        self.buckets = buckets
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def record(self, endpoint, namespace, status, latency, request_bytes,
+               response_bytes, retries):
+        key = (endpoint, namespace, status)
+        with self._lock:
+            stats = self._stats.get(key)
+            if stats is None:
+                stats = self._stats[key] = EndpointStats(self.buckets)
+            stats.latency.observe(latency)
+            stats.request_bytes += request_bytes
+            stats.response_bytes += response_bytes
+            stats.retries += retries
+
+    def stats(self):
+        """
+        Returns a dict of EndpointStats keyed by (endpoint, namespace, status).
+        """
+        with self._lock:
+            return dict(self._stats)
+
+    def prometheus_text(self, prefix='dpn_client'):
+        """
+        Returns all metrics in the Prometheus text exposition format.
+        """
+        lines = []
+        def add(name, kind, help_text):
+            lines.append("# HELP {0}_{1} {2}".format(prefix, name, help_text))
+            lines.append("# TYPE {0}_{1} {2}".format(prefix, name, kind))
+        with self._lock:
+            items = sorted(self._stats.items(), key=lambda item: str(item[0]))
+            add('request_duration_seconds', 'histogram',
+                'Latency of calls to DPN nodes, including retries.')
+            for key, stats in items:
+                labels = _labels(key)
+                for bound, count in stats.latency.cumulative_counts():
+                    lines.append('{0}_request_duration_seconds_bucket{{{1},le="{2}"}} {3}'.format(
+                        prefix, labels, bound, count))
+                lines.append('{0}_request_duration_seconds_sum{{{1}}} {2}'.format(
+                    prefix, labels, stats.latency.sum))
+                lines.append('{0}_request_duration_seconds_count{{{1}}} {2}'.format(
+                    prefix, labels, stats.latency.count))
+            for name, attr, help_text in (
+                    ('request_bytes_total', 'request_bytes', 'Bytes sent to DPN nodes.'),
+                    ('response_bytes_total', 'response_bytes', 'Bytes received from DPN nodes.'),
+                    ('retries_total', 'retries', 'Retries of calls to DPN nodes.')):
+                add(name, 'counter', help_text)
+                for key, stats in items:
+                    lines.append('{0}_{1}{{{2}}} {3}'.format(
+                        prefix, name, _labels(key), getattr(stats, attr)))
+        return "\n".join(lines) + "\n"
+
+
+def _labels(key):
+    endpoint, namespace, status = key
+    values = (('endpoint', endpoint), ('namespace', namespace or ''),
+              ('status', 'error' if status is None else status))
+    return ",".join('{0}="{1}"'.format(name, value) for name, value in values)
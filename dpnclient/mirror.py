@@ -0,0 +1,287 @@
+import sqlite3
+import threading
+from . import jsoncodec
+from . import paging
+from . import records
+from . import util
+
+# Default number of records to request per page when syncing.
+DEFAULT_SYNC_PAGE_SIZE = 500
+
+# For each collection: the table it's stored in, its ID field, and the
+# fields copied into indexed columns.
+COLLECTIONS = {
+    'bag': ('bags', 'uuid',
+            ('local_id', 'admin_node', 'original_node', 'ingest_node',
+             'bag_type', 'size', 'updated_at')),
+    'transfer': ('transfers', 'replication_id',
+                 ('uuid', 'from_node', 'to_node', 'status', 'updated_at')),
+    'restore': ('restores', 'restore_id',
+                ('uuid', 'from_node', 'to_node', 'status', 'updated_at')),
+}
+
+# Columns that get an index, per table. The ID column is the primary key.
+INDEXES = {
+    'bags': ('local_id', 'admin_node', 'original_node', 'updated_at'),
+    'transfers': ('uuid', 'from_node', 'to_node', 'status', 'updated_at'),
+    'restores': ('uuid', 'from_node', 'to_node', 'status', 'updated_at'),
+}
+
+# Record type for each collection, for queries with as_records=True.
+RECORD_TYPES = {
+    'bag': records.Bag,
+    'transfer': records.Transfer,
+    'restore': records.Restore,
+}
+
+class RegistryMirror:
+    """
+    Local SQLite copy of a DPN node's bag registry, transfer requests and
+    restore requests, so audits ("which bags does node X hold?", "which
+    bag has this local_id?") run against indexed local tables instead of
+    paging through the remote registry.
+
+    Each record is stored whole, as JSON, with the fields you're likely
+    to query on (uuid, local_id, admin_node, original_node, status,
+    updated_at, etc.) copied into indexed columns. The bag_nodes table
+    holds one row per (bag, replicating node).
+
+    Call sync() to bring the mirror up to date. The first sync from a
+    node copies everything; later syncs only ask for records updated
+    since the newest one that an earlier, completed sync got from that
+    same node. Watermarks are kept per node and collection in the
+    sync_state table, so syncing one node never hides another's records.
+
+        mirror = RegistryMirror('/var/dpn/registry.sqlite3')
+        mirror.sync(client)
+        mirror.bags_held_by('chron')
+
+    :param path: Path to the SQLite database. It will be created if it
+    doesn't exist.
+    """
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        with self._db:
+            for collection, (table, id_field, columns) in COLLECTIONS.items():
+                self._db.execute(
+                    "create table if not exists {0} ("
+                    "{1} text primary key, {2}, data text not null)".format(
+                        table, id_field, ", ".join(columns)))
+                for column in INDEXES[table]:
+                    self._db.execute(
+                        "create index if not exists ix_{0}_{1} on {0} ({1})".format(
+                            table, column))
+            self._db.execute(
+                "create table if not exists bag_nodes ("
+                "uuid text not null, namespace text not null, "
+                "primary key (uuid, namespace))")
+            self._db.execute(
+                "create index if not exists ix_bag_nodes_namespace "
+                "on bag_nodes (namespace)")
+            self._db.execute(
+                "create table if not exists sync_state ("
+                "source text not null, collection text not null, "
+                "updated_at text, primary key (source, collection))")
+
+    def close(self):
+        """
+        Closes the mirror database.
+        """
+        with self._lock:
+            self._db.close()
+
+    def sync(self, client, collections=('bag', 'transfer', 'restore'),
+             page_size=DEFAULT_SYNC_PAGE_SIZE, source=None):
+        """
+        Copies new and updated records from a node's registry into the
+        mirror. Records are requested oldest first (ordering=updated_at)
+        and written a page at a time as they arrive. The node's watermark
+        for a collection only moves once that whole collection has synced.
+
+        Rather than walk the pages by number, each page is asked for with
+        an after filter a second before the newest record so far. Records
+        updated during the sync move to the end of the ordering, where
+        they are picked up, instead of shifting unread records onto pages
+        already read. The same overlap means a record that turns up late
+        with the watermark's own updated_at isn't missed. Records read
+        twice, or unchanged since the last sync, aren't written again.
+
+        :param client: The BaseClient for the node to copy from.
+        :param collections: Which of 'bag', 'transfer' and 'restore' to sync.
+        :param page_size: Number of records to request per page.
+        :param source: Name under which to keep this node's watermarks,
+        usually its namespace. Defaults to the client's url.
+
+        :returns: A dict with the number of records written per collection.
+
+        :raises RequestException: Check the response property for details.
+        Records written before the error stay in the mirror, and the next
+        sync starts again from the last completed watermark, so nothing
+        is skipped.
+        """
+        if source is None:
+            source = client.url
+        list_methods = {'bag': client.bag_list,
+                        'transfer': client.transfer_list,
+                        'restore': client.restore_list}
+        counts = {}
+        for collection in collections:
+            watermark = self.last_updated_at(collection, source)
+            newest = watermark
+            after = None if watermark is None else util.just_before(watermark)
+            counts[collection] = 0
+            page_num = 1
+            while True:
+                filters = {'ordering': 'updated_at'}
+                if after is not None:
+                    filters['after'] = after
+                data = jsoncodec.response_json(list_methods[collection](
+                    page=page_num, page_size=page_size, **filters))
+                found = [records.as_dict(record) for record in data['results']]
+                counts[collection] += self.put(collection, self._changed(collection, found))
+                page_newest = max([record.get('updated_at') or '' for record in found] + [''])
+                if newest is None or page_newest > newest:
+                    newest = page_newest
+                if not paging.has_next_page(data, page_num, page_size):
+                    break
+                next_after = util.just_before(page_newest) if page_newest else None
+                if next_after is not None and (after is None or next_after > after):
+                    after = next_after
+                    page_num = 1
+                else:
+                    # A whole page updated in the same second; page through it.
+                    page_num += 1
+            if newest and newest != watermark:
+                with self._lock, self._db:
+                    self._db.execute(
+                        "insert or replace into sync_state (source, collection, "
+                        "updated_at) values (?, ?, ?)", (source, collection, newest))
+        return counts
+
+    def put(self, collection, items):
+        """
+        Inserts or replaces records in the mirror.
+
+        :param collection: 'bag', 'transfer' or 'restore'.
+        :param items: Records, as dicts or records.Record objects.
+
+        :returns: The number of records written.
+        """
+        table, id_field, columns = COLLECTIONS[collection]
+        sql = "insert or replace into {0} ({1}, {2}, data) values ({3})".format(
+            table, id_field, ", ".join(columns), ", ".join("?" * (len(columns) + 2)))
+        rows = []
+        bag_nodes = []
+        for item in items:
+            item = records.as_dict(item)
+            rows.append([item[id_field]] + [item.get(c) for c in columns] +
+                        [jsoncodec.dumps(item)])
+            if collection == 'bag':
+                bag_nodes.extend((item['uuid'], namespace)
+                                 for namespace in item.get('replicating_nodes') or ())
+        if not rows:
+            return 0
+        with self._lock, self._db:
+            self._db.executemany(sql, rows)
+            if collection == 'bag':
+                self._db.executemany("delete from bag_nodes where uuid = ?",
+                                     [(row[0],) for row in rows])
+                self._db.executemany("insert or ignore into bag_nodes "
+                                     "(uuid, namespace) values (?, ?)", bag_nodes)
+        return len(rows)
+
+    def _changed(self, collection, items):
+        """
+        Returns the records in items that aren't already in the mirror
+        with the same updated_at.
+        """
+        table, id_field, columns = COLLECTIONS[collection]
+        ids = [item[id_field] for item in items]
+        stored = {}
+        with self._lock:
+            # In chunks, to stay under SQLite's limit on query parameters.
+            for start in range(0, len(ids), DEFAULT_SYNC_PAGE_SIZE):
+                chunk = ids[start:start + DEFAULT_SYNC_PAGE_SIZE]
+                stored.update(self._db.execute(
+                    "select {0}, updated_at from {1} where {0} in ({2})".format(
+                        id_field, table, ", ".join("?" * len(chunk))), chunk))
+        return [item for item in items
+                if item.get('updated_at') is None
+                or stored.get(item[id_field]) != item['updated_at']]
+
+    def last_updated_at(self, collection, source):
+        """
+        Returns the watermark of a collection for one source node: the
+        newest updated_at seen by the last completed sync from it, or
+        None if it has never been synced.
+        """
+        with self._lock:
+            row = self._db.execute(
+                "select updated_at from sync_state where source = ? and collection = ?",
+                (source, collection)).fetchone()
+        return row[0] if row else None
+
+    def count(self, collection):
+        """
+        Returns the number of records mirrored for a collection.
+        """
+        table = COLLECTIONS[collection][0]
+        with self._lock:
+            return self._db.execute(
+                "select count(*) from {0}".format(table)).fetchone()[0]
+
+    def find(self, collection, as_records=False, **filters):
+        """
+        Returns mirrored records whose fields exactly match all filters,
+        ordered by updated_at.
+
+            mirror.find('transfer', to_node='chron', status='Requested')
+
+        :param collection: 'bag', 'transfer' or 'restore'.
+        :param as_records: Return records.Record objects instead of dicts.
+        :param filters: Field values to match. Only the ID field and the
+        indexed columns in COLLECTIONS can be used.
+
+        :raises ValueError: If a filter names a field that isn't a column.
+        """
+        table, id_field, columns = COLLECTIONS[collection]
+        where = []
+        params = []
+        for name, value in sorted(filters.items()):
+            if name != id_field and name not in columns:
+                raise ValueError("Can't filter {0} by '{1}'".format(collection, name))
+            where.append("{0} = ?".format(name))
+            params.append(value)
+        sql = "select data from {0}".format(table)
+        if where:
+            sql += " where " + " and ".join(where)
+        return self._query(collection, sql + " order by updated_at", params, as_records)
+
+    def get(self, collection, record_id, as_records=False):
+        """
+        Returns one mirrored record by ID, or None.
+        """
+        id_field = COLLECTIONS[collection][1]
+        found = self.find(collection, as_records=as_records, **{id_field: record_id})
+        return found[0] if found else None
+
+    def bags_held_by(self, namespace, as_records=False):
+        """
+        Returns the mirrored bags that list namespace in their
+        replicating_nodes, ordered by updated_at.
+        """
+        return self._query(
+            'bag', "select bags.data from bags join bag_nodes "
+            "on bag_nodes.uuid = bags.uuid where bag_nodes.namespace = ? "
+            "order by bags.updated_at", (namespace,), as_records)
+
+    def _query(self, collection, sql, params, as_records):
+        with self._lock:
+            rows = self._db.execute(sql, params).fetchall()
+        found = [jsoncodec.loads(row[0]) for row in rows]
+        if as_records:
+            record_type = RECORD_TYPES[collection]
+            found = [record_type.from_dict(data) for data in found]
+        return found
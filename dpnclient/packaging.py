@@ -0,0 +1,55 @@
+import os
+import tarfile
+from . import const
+from . import fixity_cache
+from . import util
+
+class _HashingWriter:
+    """
+    File wrapper that hashes and counts every byte written through it.
+    """
+    def __init__(self, f, algorithm):
+        self.f = f
+        self.checksum = util.new_checksum(algorithm)
+        self.size = 0
+
+    def write(self, data):
+        self.f.write(data)
+        self.checksum.update(data)
+        self.size += len(data)
+        return len(data)
+
+
+def package_bag(bag_dir, outbound_dir, obj_id, block_size=util.DEFAULT_BLOCK_SIZE):
+    """
+    Tars the bag in bag_dir into outbound_dir/<obj_id>.tar, with the bag
+    under a top-level directory named obj_id. The size and SHA-256 digest
+    of the tar are computed from the same bytes as they are written, so
+    the tar never has to be read back. It's written to a .partial file
+    and renamed when complete. If a fixity cache is configured, the
+    digest is saved to it.
+
+    :param bag_dir: Path to the bag directory.
+    :param outbound_dir: Directory in which to write the tar.
+    :param obj_id: The bag's DPN UUID.
+    :param block_size: Number of bytes to write at a time.
+
+    :returns: A dict with keys 'path', 'size' and 'fixity' (the SHA-256
+    hex digest of the tar).
+    """
+    if not os.path.isdir(bag_dir):
+        raise ValueError("bag_dir '{0}' is not a directory".format(bag_dir))
+    dst = os.path.join(outbound_dir, obj_id + '.tar')
+    partial = dst + '.partial'
+    with open(partial, 'wb') as f:
+        writer = _HashingWriter(f, const.FIXITY_SHA256)
+        # Stream mode, so tarfile only ever writes forward.
+        with tarfile.open(fileobj=writer, mode='w|', bufsize=block_size) as tar:
+            tar.add(bag_dir, arcname=obj_id)
+    stat = os.stat(partial)
+    os.replace(partial, dst)
+    digest = writer.checksum.hexdigest()
+    cache = fixity_cache.default_cache()
+    if cache is not None:
+        cache.put(os.path.abspath(dst), const.FIXITY_SHA256, digest, stat)
+    return {'path': dst, 'size': writer.size, 'fixity': digest}
@@ -0,0 +1,157 @@
+from . import jsoncodec
+from concurrent.futures import ThreadPoolExecutor
+
+# Default number of records to request per page.
+DEFAULT_PAGE_SIZE = 100
+
+# Default number of pages to fetch at once.
+DEFAULT_MAX_WORKERS = 8
+
+def page_count(count, page_size):
+    """
+    Returns the number of pages needed to hold count records.
+    """
+    return max(1, (count + page_size - 1) // page_size)
+
+def fetch_all(list_method, page_size=DEFAULT_PAGE_SIZE,
+              max_workers=DEFAULT_MAX_WORKERS, record_type=None, **kwargs):
+    """
+    Returns all records from a paged list endpoint. Fetches page 1 to
+    learn the total count and the page size the server actually honors,
+    then fetches the remaining pages concurrently.
+    Records come back in the same order the server pages them.
+
+    :param list_method: A BaseClient list method, such as client.bag_list,
+    client.transfer_list, client.restore_list or client.node_list.
+
+    :param page_size: Number of records to request per page.
+
+    :param max_workers: Max number of pages to fetch at once.
+
+    :param record_type: Optional records.Record subclass (Bag, Transfer,
+    etc.) to convert each record to. By default records are dicts.
+
+    :param kwargs: Filters to pass through to list_method.
+
+    :returns: A list of records.
+
+    :raises RequestException: If any page request fails.
+    """
+    def fetch_page(page_num):
+        data = jsoncodec.response_json(
+            list_method(page=page_num, page_size=page_size, **kwargs))
+        if record_type is not None:
+            data['results'] = [record_type.from_dict(r) for r in data['results']]
+        return data
+
+    data = fetch_page(1)
+    records = list(data['results'])
+    count = data['count']
+    # A server that caps page_size sends fewer records per page than we
+    # asked for, so count pages by what it actually sent.
+    if 0 < len(records) < min(page_size, count):
+        page_size = len(records)
+    pages = page_count(count, page_size)
+
+    if pages > 1:
+        with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+            for data in executor.map(fetch_page, range(2, pages + 1)):
+                records.extend(data['results'])
+    # Anything still missing (say, records added while we paged) is
+    # fetched one page at a time, until a page comes back short.
+    while len(records) < data['count'] and len(data['results']) >= page_size:
+        pages += 1
+        data = fetch_page(pages)
+        records.extend(data['results'])
+    return records
+
+def has_next_page(data, page_num, page_size):
+    """
+    Returns True if the page data says there are more pages after
+    page_num. Uses the 'next' link when the server provides one, and
+    the total count otherwise.
+    """
+    if not data['results']:
+        return False
+    if 'next' in data:
+        return data['next'] is not None
+    return page_num * page_size < data['count']
+
+def iter_records(list_method, page_size=DEFAULT_PAGE_SIZE, prefetch=True,
+                 record_type=None, incremental=False, **kwargs):
+    """
+    Yields records from a paged list endpoint one at a time, fetching
+    pages as they are needed, so memory use stays constant no matter how
+    many records the server has. While the caller consumes one page, the
+    next page is fetched in the background.
+
+    :param list_method: A BaseClient list method, such as client.bag_list.
+    :param page_size: Number of records to request per page.
+    :param prefetch: Set to False to fetch each page only when the
+    previous one has been consumed.
+    :param record_type: Optional records.Record subclass to convert each
+    record to. By default records are dicts.
+    :param incremental: Set to True to decode each page as its bytes
+    arrive (see jsoncodec.StreamedPage), so the first record is yielded
+    before the whole page has downloaded, and a page is never held in
+    memory all at once. Pages are not prefetched in this mode.
+    :param kwargs: Filters to pass through to list_method.
+
+    :returns: A generator of records.
+
+    :raises RequestException: If any page request fails. The exception is
+    raised when the iterator reaches the failed page.
+    """
+    if incremental:
+        return _iter_streamed_records(list_method, page_size, record_type, kwargs)
+    return _iter_records(list_method, page_size, prefetch, record_type, kwargs)
+
+def _iter_records(list_method, page_size, prefetch, record_type, kwargs):
+    def fetch_page(page_num):
+        return jsoncodec.response_json(
+            list_method(page=page_num, page_size=page_size, **kwargs))
+
+    executor = ThreadPoolExecutor(max_workers=1) if prefetch else None
+    try:
+        page_num = 1
+        data = fetch_page(page_num)
+        while True:
+            more = has_next_page(data, page_num, page_size)
+            next_page = None
+            if more and executor is not None:
+                next_page = executor.submit(fetch_page, page_num + 1)
+            for record in data['results']:
+                if record_type is not None:
+                    record = record_type.from_dict(record)
+                yield record
+            if not more:
+                return
+            page_num += 1
+            if next_page is not None:
+                data = next_page.result()
+            else:
+                data = fetch_page(page_num)
+    finally:
+        if executor is not None:
+            executor.shutdown(wait=False)
+
+def _iter_streamed_records(list_method, page_size, record_type, kwargs):
+    page_num = 1
+    while True:
+        response = list_method(page=page_num, page_size=page_size,
+                               stream=True, **kwargs)
+        try:
+            page = jsoncodec.StreamedPage(
+                response.iter_content(jsoncodec.DEFAULT_CHUNK_SIZE))
+            got_records = False
+            for record in page.results:
+                got_records = True
+                if record_type is not None:
+                    record = record_type.from_dict(record)
+                yield record
+        finally:
+            response.close()
+        data = dict(page.meta, results=[True] if got_records else [])
+        if not has_next_page(data, page_num, page_size):
+            return
+        page_num += 1
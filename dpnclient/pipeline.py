@@ -0,0 +1,141 @@
+import queue
+import threading
+import time
+
+# States every item starts and can end in. Engines add their own.
+STATE_QUEUED = 'queued'
+STATE_FAILED = 'failed'
+
+# Marks the end of a stage's input queue.
+_END_OF_QUEUE = object()
+
+class Progress:
+    """
+    Tracks one item as it moves through a Pipeline. Timings are in
+    seconds, keyed by state.
+    """
+    def __init__(self, namespace):
+        self.namespace = namespace
+        self.state = STATE_QUEUED
+        self.error = None
+        self.created_at = time.time()
+        self.state_started_at = self.created_at
+        self.finished_at = None
+        self.timings = {}
+
+    def as_dict(self):
+        return {
+            'namespace': self.namespace,
+            'state': self.state,
+            'error': None if self.error is None else str(self.error),
+            'elapsed': (self.finished_at or time.time()) - self.created_at,
+            'timings': dict(self.timings),
+        }
+
+
+class Pipeline:
+    """
+    Base class for engines that move items through a series of stages.
+    Each stage has its own pool of worker threads and the stages are
+    joined by bounded queues, so a slow stage holds back the stages
+    before it instead of piling up work. An item whose stage function
+    raises is marked failed and goes no further.
+
+    Subclasses track each item with a Progress, call _run_stages with
+    their stage functions, and build their report from _summary.
+
+    :param queue_size: Max number of items waiting between two stages.
+    :param on_progress: Optional function called with an item's Progress
+    each time it changes state.
+    """
+    # States in which an item has finished its trip through the pipeline.
+    final_states = (STATE_FAILED,)
+
+    def __init__(self, queue_size=8, on_progress=None):
+        self.queue_size = queue_size
+        self.on_progress = on_progress
+        self.progress = []
+        self.errors = {}
+        self._lock = threading.Lock()
+
+    def _track(self, progress):
+        with self._lock:
+            self.progress.append(progress)
+
+    def _set_state(self, progress, state, error=None):
+        now = time.time()
+        with self._lock:
+            progress.timings[progress.state] = now - progress.state_started_at
+            progress.state_started_at = now
+            progress.state = state
+            if error is not None:
+                progress.error = error
+            if state in self.final_states:
+                progress.finished_at = now
+        if self.on_progress is not None:
+            try:
+                self.on_progress(progress)
+            except Exception:
+                # A broken callback must not kill a worker: with bounded
+                # queues, the rest of the pipeline would wait on it forever.
+                pass
+
+    def _stage_worker(self, inbox, outbox, func):
+        while True:
+            progress = inbox.get()
+            if progress is _END_OF_QUEUE:
+                return
+            try:
+                func(progress)
+            except Exception as err:
+                self._set_state(progress, STATE_FAILED, err)
+                continue
+            if outbox is not None:
+                outbox.put(progress)
+
+    def _run_stages(self, stages, feed):
+        """
+        Starts the workers for each stage, calls feed with the first
+        stage's queue, and returns once every item fed in has been
+        through every stage (or failed).
+
+        :param stages: List of (func, workers) tuples, in order. func is
+        called with each item's Progress by one of workers threads.
+        :param feed: Function that puts Progress objects on the queue
+        it's called with.
+        """
+        started = []
+        inbox = queue.Queue(self.queue_size)
+        first_inbox = inbox
+        for i, (func, workers) in enumerate(stages):
+            outbox = queue.Queue(self.queue_size) if i < len(stages) - 1 else None
+            threads = []
+            for n in range(max(1, workers)):
+                thread = threading.Thread(target=self._stage_worker,
+                                          args=(inbox, outbox, func))
+                thread.daemon = True
+                thread.start()
+                threads.append(thread)
+            started.append((inbox, threads))
+            inbox = outbox
+        feed(first_inbox)
+        # Shut down each stage only after the stage before it has finished.
+        for stage_inbox, threads in started:
+            for thread in threads:
+                stage_inbox.put(_END_OF_QUEUE)
+            for thread in threads:
+                thread.join()
+
+    def _summary(self):
+        """
+        Returns (items, counts, node_errors): each item's as_dict(), the
+        number of items in each state, and the error message for each
+        node that couldn't be read from.
+        """
+        with self._lock:
+            items = [progress.as_dict() for progress in self.progress]
+        counts = {}
+        for item in items:
+            counts[item['state']] = counts.get(item['state'], 0) + 1
+        node_errors = dict((ns, str(err)) for ns, err in self.errors.items())
+        return items, counts, node_errors
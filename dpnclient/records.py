@@ -0,0 +1,184 @@
+import sys
+
+class Record:
+    """
+    Base class for compact, typed registry records. Records use __slots__,
+    so they have no per-instance dict, and node namespaces, statuses and
+    other short repeated strings are interned, so a few hundred thousand
+    records share one copy of each.
+
+    Fields the server didn't send read as None, and are left out of
+    to_dict(), so from_dict(data).to_dict() == data for any dict the
+    server returns. Fields this class doesn't know about are kept in
+    the extra dict.
+    """
+    __slots__ = ('extra',)
+
+    # Names of the fields each subclass stores in slots.
+    FIELDS = ()
+
+    # Fields whose string values are interned.
+    INTERNED_FIELDS = ()
+
+    # Field that holds the record's ID.
+    ID_FIELD = None
+
+    def __init__(self, **kwargs):
+        for name in self.FIELDS:
+            if name in kwargs:
+                setattr(self, name, self._decode(name, kwargs.pop(name)))
+        self.extra = kwargs or None
+
+    def __getattr__(self, name):
+        # Only called for fields the server didn't send.
+        if name in self.FIELDS:
+            return None
+        raise AttributeError(name)
+
+    def __eq__(self, other):
+        return type(self) is type(other) and self.to_dict() == other.to_dict()
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return "{0}({1}={2!r})".format(type(self).__name__, self.ID_FIELD,
+                                       getattr(self, self.ID_FIELD))
+
+    @property
+    def id(self):
+        return getattr(self, self.ID_FIELD)
+
+    @classmethod
+    def from_dict(cls, data):
+        """
+        Returns a new record built from a dict, as returned by the
+        server's JSON.
+        """
+        record = cls.__new__(cls)
+        extra = None
+        for name, value in data.items():
+            if name in cls._field_set:
+                object.__setattr__(record, name, cls._decode(name, value))
+            else:
+                if extra is None:
+                    extra = {}
+                extra[name] = value
+        record.extra = extra
+        return record
+
+    def to_dict(self):
+        """
+        Returns the record as a dict that can be sent to the server.
+        """
+        data = {}
+        for name in self.FIELDS:
+            try:
+                value = object.__getattribute__(self, name)
+            except AttributeError:
+                continue
+            data[name] = self._encode(name, value)
+        if self.extra:
+            data.update(self.extra)
+        return data
+
+    @classmethod
+    def _decode(cls, name, value):
+        if name in cls.INTERNED_FIELDS and isinstance(value, str):
+            return sys.intern(value)
+        return value
+
+    @classmethod
+    def _encode(cls, name, value):
+        return value
+
+
+class Node(Record):
+    """
+    A DPN node.
+    """
+    FIELDS = ('namespace', 'name', 'api_root', 'ssh_pubkey',
+              'replicate_from', 'replicate_to', 'restore_from', 'restore_to',
+              'protocols', 'fixity_algorithms', 'storage',
+              'created_at', 'updated_at')
+    INTERNED_FIELDS = ('namespace', 'name', 'api_root')
+    ID_FIELD = 'namespace'
+    __slots__ = FIELDS
+
+
+class Bag(Record):
+    """
+    A bag (registry) entry. fixities are stored as a tuple of
+    (algorithm, digest) pairs and replicating_nodes as a tuple of
+    namespaces; to_dict() turns them back into the server's lists.
+    """
+    FIELDS = ('uuid', 'local_id', 'size', 'first_version', 'version_number',
+              'ingest_node', 'original_node', 'admin_node', 'bag_type',
+              'rights', 'interpretive', 'replicating_nodes', 'fixities',
+              'created_at', 'updated_at')
+    INTERNED_FIELDS = ('ingest_node', 'original_node', 'admin_node', 'bag_type')
+    ID_FIELD = 'uuid'
+    __slots__ = FIELDS
+
+    @classmethod
+    def _decode(cls, name, value):
+        if name == 'fixities' and value is not None:
+            return tuple((sys.intern(f['algorithm']), f['digest']) for f in value)
+        if name == 'replicating_nodes' and value is not None:
+            return tuple(sys.intern(namespace) for namespace in value)
+        return super(Bag, cls)._decode(name, value)
+
+    @classmethod
+    def _encode(cls, name, value):
+        if name == 'fixities' and value is not None:
+            return [{'algorithm': algorithm, 'digest': digest}
+                    for algorithm, digest in value]
+        if name == 'replicating_nodes' and value is not None:
+            return list(value)
+        return value
+
+    def fixity(self, algorithm):
+        """
+        Returns the bag's digest for algorithm, or None.
+        """
+        for fixity_algorithm, digest in self.fixities or ():
+            if fixity_algorithm == algorithm:
+                return digest
+        return None
+
+
+class Transfer(Record):
+    """
+    A replication transfer request.
+    """
+    FIELDS = ('replication_id', 'uuid', 'link', 'from_node', 'to_node',
+              'size', 'protocol', 'fixity_algorithm', 'fixity_value',
+              'fixity_accept', 'bag_valid', 'status',
+              'created_at', 'updated_at')
+    INTERNED_FIELDS = ('from_node', 'to_node', 'protocol', 'fixity_algorithm',
+                       'status')
+    ID_FIELD = 'replication_id'
+    __slots__ = FIELDS
+
+
+class Restore(Record):
+    """
+    A restore request.
+    """
+    FIELDS = ('restore_id', 'uuid', 'link', 'from_node', 'to_node',
+              'protocol', 'status', 'created_at', 'updated_at')
+    INTERNED_FIELDS = ('from_node', 'to_node', 'protocol', 'status')
+    ID_FIELD = 'restore_id'
+    __slots__ = FIELDS
+
+
+for _record_type in (Node, Bag, Transfer, Restore):
+    _record_type._field_set = frozenset(_record_type.FIELDS)
+
+def as_dict(obj):
+    """
+    Returns obj as a dict, whether it's a Record or already a dict.
+    """
+    if isinstance(obj, Record):
+        return obj.to_dict()
+    return obj
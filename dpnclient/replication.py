@@ -0,0 +1,218 @@
+import functools
+import requests
+import time
+from . import bagit
+from . import const
+from . import pipeline
+from . import transfer
+from . import util
+
+# Bag states, in the order a bag moves through the engine.
+STATE_QUEUED = pipeline.STATE_QUEUED
+STATE_DOWNLOADING = 'downloading'
+STATE_HASHING = 'hashing'
+STATE_SENDING_RECEIPT = 'sending receipt'
+STATE_DONE = 'done'
+STATE_SKIPPED = 'skipped'
+STATE_FAILED = pipeline.STATE_FAILED
+
+# Max number of seconds to wait for a download to finish before asking
+# the scheduler again which bags to start.
+SCHEDULER_WAIT = 1.0
+
+class BagProgress(pipeline.Progress):
+    """
+    Tracks one transfer request as it moves through the replication
+    engine. Timings are in seconds, keyed by state.
+    """
+    def __init__(self, namespace, xfer_request):
+        super(BagProgress, self).__init__(namespace)
+        self.xfer_request = xfer_request
+        self.replication_id = xfer_request['replication_id']
+        self.uuid = xfer_request.get('uuid')
+        self.size = xfer_request.get('size') or 0
+        self.local_path = None
+        self.fixity = None
+
+    def as_dict(self):
+        data = super(BagProgress, self).as_dict()
+        data.update({
+            'replication_id': self.replication_id,
+            'uuid': self.uuid,
+            'size': self.size,
+            'local_path': self.local_path,
+            'fixity': self.fixity,
+        })
+        return data
+
+
+class ReplicationEngine(pipeline.Pipeline):
+    """
+    Replicates bags from other nodes by running downloads, fixity checks
+    and fixity receipts as a pipeline.Pipeline. Each stage has its own
+    pool of workers and the stages are joined by bounded queues, so the
+    network keeps downloading while earlier bags are being hashed, and a
+    slow stage holds back the stages before it instead of piling up work.
+
+    Bags larger than the client's max_xfer_size (from the active config;
+    0 means no limit) are skipped.
+
+    :param client: A Client.
+    :param inbound_dir: Directory in which to save downloaded bags.
+    :param download_workers: Max number of bags to download at once.
+    :param fixity_workers: Max number of bags to hash at once.
+    :param receipt_workers: Max number of fixity receipts to send at once.
+    :param queue_size: Max number of bags waiting between two stages.
+    :param downloader: Function that takes a transfer request and
+    inbound_dir and returns (local_path, fixity). Defaults to
+    transfer.download, which hashes https downloads as they arrive, so
+    those bags skip the fixity stage.
+    :param reject_oversize: If True, reject transfer requests for bags
+    larger than max_xfer_size instead of just skipping them.
+    :param on_progress: Optional function called with a BagProgress each
+    time a bag changes state.
+    :param validate_bags: If True, each downloaded .tar is checked against
+    its own BagIt manifests by bagit.validate_tar, which computes the
+    bag's fixity in the same pass. Invalid bags fail.
+    :param scheduler: Optional scheduler.TransferScheduler. Without one,
+    bags are downloaded in the order the nodes return them. With one, all
+    pending requests are collected first, and the scheduler decides which
+    to download and when (by size, age, free space, bandwidth budget and
+    per-partner caps). Bags too big for the free space in inbound_dir are
+    skipped.
+    """
+    final_states = (STATE_DONE, STATE_SKIPPED, STATE_FAILED)
+
+    def __init__(self, client, inbound_dir, download_workers=2, fixity_workers=2,
+                 receipt_workers=4, queue_size=8, downloader=None,
+                 reject_oversize=False, on_progress=None, scheduler=None,
+                 validate_bags=False):
+        super(ReplicationEngine, self).__init__(queue_size, on_progress)
+        self.client = client
+        self.inbound_dir = inbound_dir
+        self.download_workers = download_workers
+        self.fixity_workers = fixity_workers
+        self.receipt_workers = receipt_workers
+        if downloader is None:
+            self.session = requests.Session()
+            downloader = functools.partial(transfer.download, session=self.session)
+        self.downloader = downloader
+        self.reject_oversize = reject_oversize
+        self.scheduler = scheduler
+        self.validate_bags = validate_bags
+
+    def _too_big(self, progress):
+        max_xfer_size = self.client.max_xfer_size
+        return max_xfer_size and progress.size > max_xfer_size
+
+    def _download(self, progress):
+        self._set_state(progress, STATE_DOWNLOADING)
+        try:
+            progress.local_path, progress.fixity = self.downloader(
+                progress.xfer_request, self.inbound_dir)
+        finally:
+            if self.scheduler is not None:
+                self.scheduler.release(progress.namespace, progress.xfer_request)
+
+    def _hash(self, progress):
+        if self.validate_bags and progress.local_path.endswith('.tar'):
+            self._set_state(progress, STATE_HASHING)
+            result = bagit.validate_tar(progress.local_path)
+            if not result['valid']:
+                raise ValueError("bag is not valid: missing {0}, extra {1}, "
+                                 "mismatched {2}".format(result['missing'],
+                                                         result['extra'],
+                                                         result['mismatched']))
+            if progress.fixity is None:
+                progress.fixity = result['tar_digest']
+        elif progress.fixity is None:
+            self._set_state(progress, STATE_HASHING)
+            progress.fixity = util.digest(progress.local_path, const.FIXITY_SHA256)
+
+    def _send_receipt(self, progress):
+        self._set_state(progress, STATE_SENDING_RECEIPT)
+        self.client.set_transfer_fixity(progress.namespace, progress.replication_id,
+                                        progress.fixity)
+        self._set_state(progress, STATE_DONE)
+
+    def _feed(self, namespaces, inbox):
+        scheduled = {}
+        for namespace in namespaces:
+            try:
+                xfer_requests = self.client.get_transfer_requests(namespace)
+            except Exception as err:
+                self.errors[namespace] = err
+                continue
+            for xfer_request in xfer_requests:
+                progress = BagProgress(namespace, xfer_request)
+                self._track(progress)
+                if self._too_big(progress):
+                    error = ValueError("bag size {0} exceeds max_xfer_size {1}".format(
+                        progress.size, self.client.max_xfer_size))
+                    if self.reject_oversize:
+                        try:
+                            self.client.reject_transfer_request(
+                                namespace, progress.replication_id)
+                        except Exception as err:
+                            error = err
+                    self._set_state(progress, STATE_SKIPPED, error)
+                    continue
+                if self.scheduler is None:
+                    inbox.put(progress)
+                else:
+                    scheduled[(namespace, progress.replication_id)] = progress
+                    self.scheduler.add(namespace, xfer_request)
+        if self.scheduler is not None:
+            self._dispatch(scheduled, inbox)
+
+    def _dispatch(self, scheduled, inbox):
+        """
+        Sends bags to the download stage as the scheduler admits them.
+        """
+        scheduler = self.scheduler
+        while scheduler.pending_count():
+            admitted = scheduler.admit()
+            for namespace, xfer_request in admitted:
+                inbox.put(scheduled.pop((namespace, xfer_request['replication_id'])))
+            if admitted:
+                continue
+            for namespace, xfer_request in scheduler.unstartable():
+                progress = scheduled.pop((namespace, xfer_request['replication_id']))
+                self._set_state(progress, STATE_SKIPPED, ValueError(
+                    "bag size {0} exceeds free space in {1}".format(
+                        progress.size, self.inbound_dir)))
+            scheduler.wait(SCHEDULER_WAIT)
+
+    def run(self, namespaces=None):
+        """
+        Replicates all pending transfer requests from the specified nodes
+        and returns when every bag is done, skipped or failed.
+
+        :param namespaces: List of node namespaces to replicate from.
+        Defaults to all of the client's replicate_from nodes.
+
+        :returns: A report dict. See report().
+        """
+        if namespaces is None:
+            namespaces = [node['namespace'] for node in self.client.replicate_from]
+        started_at = time.time()
+        self._run_stages([(self._download, self.download_workers),
+                          (self._hash, self.fixity_workers),
+                          (self._send_receipt, self.receipt_workers)],
+                         lambda inbox: self._feed(namespaces, inbox))
+        return self.report(time.time() - started_at)
+
+    def report(self, elapsed=None):
+        """
+        Returns a summary of the bags this engine has handled: counts by
+        state, total bytes replicated, and the details of each bag.
+        """
+        bags, counts, node_errors = self._summary()
+        bytes_done = sum(bag['size'] for bag in bags if bag['state'] == STATE_DONE)
+        return {
+            'elapsed': elapsed,
+            'counts': counts,
+            'bytes_replicated': bytes_done,
+            'node_errors': node_errors,
+            'bags': bags,
+        }
@@ -0,0 +1,131 @@
+import random
+import threading
+import time
+from requests.exceptions import RequestException
+
+# Default (connect, read) timeouts, in seconds, for calls to a DPN node.
+DEFAULT_CONNECT_TIMEOUT = 10
+DEFAULT_READ_TIMEOUT = 60
+DEFAULT_TIMEOUT = (DEFAULT_CONNECT_TIMEOUT, DEFAULT_READ_TIMEOUT)
+
+# Defaults for RetryPolicy.
+DEFAULT_MAX_RETRIES = 3
+DEFAULT_BACKOFF = 0.5
+DEFAULT_MAX_BACKOFF = 30
+RETRY_STATUSES = (500, 502, 503, 504)
+IDEMPOTENT_METHODS = ('GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE')
+
+# Defaults for CircuitBreaker.
+DEFAULT_FAILURE_THRESHOLD = 5
+DEFAULT_RESET_TIMEOUT = 30
+
+# Circuit breaker states.
+STATE_CLOSED = 'closed'
+STATE_OPEN = 'open'
+STATE_HALF_OPEN = 'half-open'
+
+class RetryPolicy:
+    """
+    Decides whether a failed call should be retried, and how long to wait
+    first. Only idempotent methods are retried, and only after a
+    connection error, a timeout, or one of retry_statuses. The wait
+    before retry n is a random time between zero and
+    min(max_backoff, backoff * 2**n) seconds ("full jitter"), so many
+    clients retrying at once don't hit a recovering node in lockstep.
+
+    :param max_retries: Max number of retries after the first attempt.
+    :param backoff: Base wait, in seconds.
+    :param max_backoff: Max wait, in seconds.
+    :param retry_statuses: HTTP status codes worth retrying.
+    :param methods: HTTP methods that may be retried.
+    """
+    def __init__(self, max_retries=DEFAULT_MAX_RETRIES, backoff=DEFAULT_BACKOFF,
+                 max_backoff=DEFAULT_MAX_BACKOFF, retry_statuses=RETRY_STATUSES,
+                 methods=IDEMPOTENT_METHODS):
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.retry_statuses = retry_statuses
+        self.methods = methods
+
+    def should_retry(self, method, attempt, response=None):
+        """
+        Returns True if a call should be retried.
+
+        :param method: The HTTP method of the call.
+        :param attempt: Number of retries made so far.
+        :param response: The response, or None if the call raised a
+        connection error or timed out.
+        """
+        if attempt >= self.max_retries or method not in self.methods:
+            return False
+        return response is None or response.status_code in self.retry_statuses
+
+    def delay(self, attempt):
+        """
+        Returns the number of seconds to wait before retry number attempt.
+        """
+        return random.uniform(0, min(self.max_backoff, self.backoff * (2 ** attempt)))
+
+
+class CircuitOpenError(RequestException):
+    """
+    Raised instead of calling a node whose circuit breaker is open.
+    """
+
+
+class CircuitBreaker:
+    """
+    Stops calls to a node that keeps failing, so callers fail fast instead
+    of tying up workers waiting on a dead node. After failure_threshold
+    failures in a row, the breaker opens and every call raises
+    CircuitOpenError. After reset_timeout seconds it lets one trial call
+    through: if that succeeds the breaker closes, and if it fails the
+    breaker opens again.
+
+    5xx responses, and any exception raised while making the call
+    (connection errors, timeouts, etc.), count as failures.
+
+    :param name: Name of the node, for error messages.
+    :param failure_threshold: Number of failures in a row that opens the breaker.
+    :param reset_timeout: Number of seconds to wait before a trial call.
+    """
+    def __init__(self, name, failure_threshold=DEFAULT_FAILURE_THRESHOLD,
+                 reset_timeout=DEFAULT_RESET_TIMEOUT):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = STATE_CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self._lock = threading.Lock()
+
+    def before_call(self):
+        """
+        Raises CircuitOpenError if the call should not be made.
+        """
+        with self._lock:
+            if self.state == STATE_CLOSED:
+                return
+            # A trial call that never reported back doesn't block the
+            # node for good: after another reset_timeout, try again.
+            if time.time() - self.opened_at >= self.reset_timeout:
+                self.state = STATE_HALF_OPEN
+                self.opened_at = time.time()
+                return
+            raise CircuitOpenError(
+                "Circuit breaker for {0} is open after {1} failures".format(
+                    self.name, self.failures))
+
+    def record_success(self):
+        with self._lock:
+            self.state = STATE_CLOSED
+            self.failures = 0
+            self.opened_at = None
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == STATE_HALF_OPEN or self.failures >= self.failure_threshold:
+                self.state = STATE_OPEN
+                self.opened_at = time.time()
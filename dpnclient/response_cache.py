@@ -0,0 +1,192 @@
+import collections
+import requests
+import shelve
+import threading
+import time
+
+# Defaults for ResponseCache.
+DEFAULT_MAX_ENTRIES = 10000
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+DEFAULT_TTL = 300
+
+class CacheEntry:
+    """
+    A cached requests.Response and the time it was last known to be
+    current.
+    """
+    def __init__(self, response, stored_at=None):
+        self.response = response
+        self.stored_at = time.time() if stored_at is None else stored_at
+        self.size = len(response.content or b'')
+
+    def validators(self):
+        """
+        Returns headers for a conditional GET that asks the server
+        whether this response is still current, or an empty dict if
+        the server didn't send an ETag or Last-Modified header.
+        """
+        headers = {}
+        etag = self.response.headers.get('ETag')
+        if etag:
+            headers['If-None-Match'] = etag
+        last_modified = self.response.headers.get('Last-Modified')
+        if last_modified:
+            headers['If-Modified-Since'] = last_modified
+        return headers
+
+
+class ShelveStore:
+    """
+    Persistent store for ResponseCache, backed by a shelve file.
+    Any object with the same get/set/delete methods can be used instead.
+
+    Only each response's status, headers, content and URL are written,
+    never the request that fetched it, which carries the API token.
+
+    :param path: Path to the shelve file.
+    """
+    def __init__(self, path):
+        self._lock = threading.Lock()
+        self._shelf = shelve.open(path)
+
+    def get(self, key):
+        with self._lock:
+            data = self._shelf.get(key)
+        if data is None:
+            return None
+        response = requests.Response()
+        response.status_code = data['status_code']
+        response.headers.update(data['headers'])
+        response._content = data['content']
+        response.url = data['url']
+        response.encoding = data['encoding']
+        return CacheEntry(response, data['stored_at'])
+
+    def set(self, key, entry):
+        response = entry.response
+        data = {
+            'status_code': response.status_code,
+            'headers': dict(response.headers),
+            'content': response.content,
+            'url': response.url,
+            'encoding': response.encoding,
+            'stored_at': entry.stored_at,
+        }
+        with self._lock:
+            self._shelf[key] = data
+            self._shelf.sync()
+
+    def delete(self, key):
+        with self._lock:
+            if key in self._shelf:
+                del self._shelf[key]
+                self._shelf.sync()
+
+    def close(self):
+        with self._lock:
+            self._shelf.close()
+
+
+class ResponseCache:
+    """
+    Cache of GET responses for single registry objects, keyed by URL.
+    BaseClient uses it for node_get, bag_get, restore_get and transfer_get
+    when you pass one in as its response_cache.
+
+    Responses younger than ttl seconds are served without asking the
+    server. Older responses are revalidated with If-None-Match or
+    If-Modified-Since when the server sent an ETag or Last-Modified
+    header, so an unchanged object costs a 304 with no body. Responses
+    are evicted, least recently used first, when the cache holds more
+    than max_entries responses or max_bytes of response content.
+
+    :param max_entries: Max number of responses to keep in memory.
+    :param max_bytes: Max total size of response content to keep in memory.
+    :param ttl: Number of seconds a response is used without revalidation.
+    :param store: Optional persistent store with get(key), set(key, entry)
+    and delete(key) methods, such as ShelveStore. It's consulted when a
+    response isn't in memory, and written to whenever memory is.
+    """
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, max_bytes=DEFAULT_MAX_BYTES,
+                 ttl=DEFAULT_TTL, store=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.store = store
+        self.total_bytes = 0
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def is_fresh(self, entry):
+        """
+        Returns True if entry can be used without asking the server.
+        """
+        return time.time() - entry.stored_at < self.ttl
+
+    def get(self, key):
+        """
+        Returns the CacheEntry for key, or None. The entry may be stale;
+        check is_fresh().
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                return entry
+        if self.store is not None:
+            entry = self.store.get(key)
+            if entry is not None:
+                self._put_in_memory(key, entry)
+        return entry
+
+    def put(self, key, response):
+        """
+        Caches a response.
+        """
+        entry = CacheEntry(response)
+        self._put_in_memory(key, entry)
+        if self.store is not None:
+            self.store.set(key, entry)
+        return entry
+
+    def revalidate(self, key, entry):
+        """
+        Marks entry as current, after the server said it hasn't changed,
+        if it's still the response cached for key. An entry that was
+        invalidated, replaced or evicted in the meantime stays gone.
+
+        :returns: True if entry was marked current.
+        """
+        with self._lock:
+            if self._entries.get(key) is not entry:
+                return False
+            entry.stored_at = time.time()
+        if self.store is not None:
+            self.store.set(key, entry)
+        return True
+
+    def invalidate(self, key):
+        """
+        Removes the cached response for key, if there is one.
+        """
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self.total_bytes -= entry.size
+        if self.store is not None:
+            self.store.delete(key)
+
+    def _put_in_memory(self, key, entry):
+        with self._lock:
+            old_entry = self._entries.pop(key, None)
+            if old_entry is not None:
+                self.total_bytes -= old_entry.size
+            self._entries[key] = entry
+            self.total_bytes += entry.size
+            while self._entries and (len(self._entries) > self.max_entries
+                                     or self.total_bytes > self.max_bytes):
+                evicted_key, evicted = self._entries.popitem(last=False)
+                self.total_bytes -= evicted.size
@@ -0,0 +1,194 @@
+import os
+import shutil
+import time
+from concurrent.futures import ThreadPoolExecutor
+from . import const
+from . import pipeline
+from . import util
+
+# Restore states, in the order a restore moves through the engine.
+STATE_QUEUED = pipeline.STATE_QUEUED
+STATE_STAGING = 'staging'
+STATE_PREPARING = 'preparing'
+STATE_FINISHING = 'finishing'
+STATE_DONE = 'done'
+STATE_FAILED = pipeline.STATE_FAILED
+
+class RestoreProgress(pipeline.Progress):
+    """
+    Tracks one restore request as it moves through the restore engine.
+    Timings are in seconds, keyed by state.
+    """
+    def __init__(self, namespace, restore_request):
+        super(RestoreProgress, self).__init__(namespace)
+        self.restore_request = restore_request
+        self.restore_id = restore_request['restore_id']
+        self.uuid = restore_request.get('uuid')
+        self.link = None
+        self.accepted = None
+
+    def as_dict(self):
+        data = super(RestoreProgress, self).as_dict()
+        data.update({
+            'restore_id': self.restore_id,
+            'uuid': self.uuid,
+            'link': self.link,
+        })
+        return data
+
+
+def stage_bag(restore_request, storage_dir, outbound_dir, rsync_host):
+    """
+    Puts the tar of the bag in a restore request (storage_dir/<uuid>.tar)
+    into outbound_dir, where the requesting node can copy it. The tar is
+    hard linked when storage_dir and outbound_dir are on the same file
+    system, and copied otherwise. A tar already staged by an earlier run
+    is reused.
+
+    :param restore_request: The restore request.
+    :param storage_dir: Directory holding the tars of preserved bags.
+    :param outbound_dir: Directory other nodes copy bags from.
+    :param rsync_host: Host name other nodes rsync from.
+
+    :returns: The link the requesting node should copy the bag from, for
+    its dpn.<namespace> account (see util.rsync_link).
+
+    :raises ValueError: If the restore request has no to_node.
+    """
+    to_node = restore_request.get('to_node')
+    if not to_node:
+        raise ValueError("Restore request {0} has no to_node".format(
+            restore_request.get('restore_id')))
+    name = restore_request['uuid'] + '.tar'
+    src = os.path.join(storage_dir, name)
+    dst = os.path.join(outbound_dir, name)
+    size = os.path.getsize(src)
+    if not (os.path.exists(dst) and os.path.getsize(dst) == size):
+        partial = dst + '.partial'
+        if os.path.exists(partial):
+            os.remove(partial)
+        try:
+            os.link(src, partial)
+        except OSError:
+            shutil.copyfile(src, partial)
+        os.replace(partial, dst)
+    return util.rsync_link(to_node, rsync_host, os.path.abspath(outbound_dir), name)
+
+
+class RestoreEngine(pipeline.Pipeline):
+    """
+    Fulfills restore requests from other nodes as a pipeline.Pipeline. Each node's
+    pending requests are fetched (all pages at once) and handed to a pool
+    of staging workers, and the next node's are fetched while those are
+    staged. Each restore is marked Accepted as soon as it's read, and
+    staging starts while that update is still on the wire. Staged
+    restores then go to a pool of update workers, which mark them
+    Prepared (with the link to copy the bag from) and then Finished.
+
+    Every restore's end-to-end time, from being read to being Finished,
+    and the time spent in each state, are in report().
+
+    :param client: A Client.
+    :param stager: Function that takes a restore request and returns the
+    link the requesting node should copy the bag from, after making the
+    bag available there. Defaults to stage_bag with storage_dir, the
+    client's OUTBOUND_DIR and rsync_host.
+    :param storage_dir: Directory holding the tars of preserved bags, for
+    the default stager.
+    :param stage_workers: Max number of bags to stage at once.
+    :param update_workers: Max number of status updates to send at once.
+    :param queue_size: Max number of restores waiting between two stages.
+    :param finish: Set to False to leave restores at Prepared, for nodes
+    that mark them Finished themselves once they have the bag.
+    :param on_progress: Optional function called with a RestoreProgress
+    each time a restore changes state.
+    """
+    final_states = (STATE_DONE, STATE_FAILED)
+
+    def __init__(self, client, stager=None, storage_dir=None, stage_workers=4,
+                 update_workers=8, queue_size=8, finish=True, on_progress=None):
+        super(RestoreEngine, self).__init__(queue_size, on_progress)
+        self.client = client
+        if stager is None:
+            if storage_dir is None:
+                raise ValueError("Either stager or storage_dir is required")
+            outbound_dir = client.settings.OUTBOUND_DIR
+            rsync_host = client.rsync_host
+            stager = lambda restore_request: stage_bag(
+                restore_request, storage_dir, outbound_dir, rsync_host)
+        self.stager = stager
+        self.stage_workers = stage_workers
+        self.update_workers = update_workers
+        self.finish = finish
+        self._executor = None
+
+    def _update(self, progress, status, link=None):
+        self.client.update_restore_request(progress.namespace, progress.restore_id,
+                                           status, link)
+
+    def _stage(self, progress):
+        self._set_state(progress, STATE_STAGING)
+        progress.link = self.stager(progress.restore_request)
+        # Don't prepare a restore the node hasn't seen accepted.
+        progress.accepted.result()
+
+    def _prepare(self, progress):
+        self._set_state(progress, STATE_PREPARING)
+        self._update(progress, const.STATUS_PREPARED, progress.link)
+        if self.finish:
+            self._set_state(progress, STATE_FINISHING)
+            self._update(progress, const.STATUS_FINISHED)
+        self._set_state(progress, STATE_DONE)
+
+    def _feed(self, namespaces, inbox):
+        for namespace in namespaces:
+            try:
+                for restore_request in self.client.get_restore_requests(namespace):
+                    progress = RestoreProgress(namespace, restore_request)
+                    self._track(progress)
+                    if not restore_request.get('to_node'):
+                        # Nowhere to send the bag, so don't accept it.
+                        self._set_state(progress, STATE_FAILED, ValueError(
+                            "Restore request {0} has no to_node".format(
+                                progress.restore_id)))
+                        continue
+                    progress.accepted = self._executor.submit(
+                        self._update, progress, const.STATUS_ACCEPTED)
+                    inbox.put(progress)
+            except Exception as err:
+                self.errors[namespace] = err
+
+    def run(self, namespaces=None):
+        """
+        Fulfills all pending restore requests from the specified nodes
+        and returns when every restore is done or failed.
+
+        :param namespaces: List of node namespaces to take restore requests
+        from. Defaults to all of the client's restore_from nodes.
+
+        :returns: A report dict. See report().
+        """
+        if namespaces is None:
+            namespaces = [node['namespace'] for node in self.client.restore_from]
+        started_at = time.time()
+        with ThreadPoolExecutor(max_workers=max(1, self.update_workers)) as executor:
+            self._executor = executor
+            self._run_stages([(self._stage, self.stage_workers),
+                              (self._prepare, self.update_workers)],
+                             lambda inbox: self._feed(namespaces, inbox))
+        self._executor = None
+        return self.report(time.time() - started_at)
+
+    def report(self, elapsed=None):
+        """
+        Returns a summary of the restores this engine has handled: counts
+        by state, and the details of each restore, including its
+        end-to-end time ('elapsed').
+        """
+        restores, counts, node_errors = self._summary()
+        return {
+            'elapsed': elapsed,
+            'counts': counts,
+            'node_errors': node_errors,
+            'restores': restores,
+        }
@@ -0,0 +1,227 @@
+import shutil
+import threading
+import time
+from datetime import datetime
+
+# Default max number of transfers to run at once, and per partner.
+DEFAULT_MAX_ACTIVE = 4
+DEFAULT_PARTNER_LIMIT = 2
+
+# Bags at least this big are "large". At most max_large of them run at
+# once, so the other slots stay free for small bags.
+DEFAULT_LARGE_BAG_SIZE = 10 * 1024 ** 3
+DEFAULT_MAX_LARGE = 1
+
+# Default slowest rate, in bytes per second, worth giving a transfer
+# when splitting the bandwidth budget between transfers.
+DEFAULT_MIN_RATE = 10 * 1024 ** 2
+
+# Default number of seconds a request has to wait for its size to count
+# half as much when ordering requests.
+DEFAULT_AGING_PERIOD = 3600
+
+class TransferScheduler:
+    """
+    Decides which transfer requests to start, and when. Requests are
+    ordered smallest first, so many small bags aren't held up behind one
+    big one, but a request's size counts for less the longer it waits
+    (size / (1 + age / aging_period)), so big bags are never starved.
+
+    A request is only started if all of these allow it:
+
+    - max_active, and the bandwidth budget: bandwidth is split between
+      running transfers, and no more start than can each get min_rate.
+    - The partner's cap (partner_limits, or default_partner_limit).
+    - max_large: only that many bags of large_bag_size or more run at
+      once, so small bags are packed into the remaining slots.
+    - Free space in inbound_dir (shutil.disk_usage), less the size of
+      every running transfer and min_free_space.
+
+    A request that's too big for the disk even with nothing running is
+    never started; see unstartable(). The caps must all be at least 1, so
+    free space is the only thing that can keep a request from starting
+    once nothing else is running.
+
+    ReplicationEngine takes a scheduler, or you can drive one yourself:
+
+        scheduler.add(namespace, xfer_request)
+        for namespace, xfer_request in scheduler.admit():
+            ...start the download...
+        scheduler.release(namespace, xfer_request)  # when it's done
+
+    :param inbound_dir: Directory bags are downloaded into.
+    :param max_active: Max number of transfers to run at once.
+    :param partner_limits: Dict of max concurrent transfers keyed by node
+    namespace.
+    :param default_partner_limit: Max concurrent transfers for nodes not in
+    partner_limits.
+    :param bandwidth: Total bandwidth budget in bytes per second, or 0
+    for no budget.
+    :param min_rate: Slowest rate, in bytes per second, a transfer should
+    get out of the bandwidth budget.
+    :param large_bag_size: Size, in bytes, from which a bag counts as large.
+    :param max_large: Max number of large bags to transfer at once.
+    :param min_free_space: Bytes to always leave free in inbound_dir.
+    :param aging_period: Seconds after which a waiting request's size
+    counts half as much.
+
+    :raises ValueError: If max_active, a partner limit or max_large is
+    less than 1.
+    """
+    def __init__(self, inbound_dir, max_active=DEFAULT_MAX_ACTIVE,
+                 partner_limits=None, default_partner_limit=DEFAULT_PARTNER_LIMIT,
+                 bandwidth=0, min_rate=DEFAULT_MIN_RATE,
+                 large_bag_size=DEFAULT_LARGE_BAG_SIZE, max_large=DEFAULT_MAX_LARGE,
+                 min_free_space=0, aging_period=DEFAULT_AGING_PERIOD):
+        partner_limits = dict(partner_limits or {})
+        caps = [('max_active', max_active),
+                ('default_partner_limit', default_partner_limit),
+                ('max_large', max_large)]
+        caps.extend(("partner_limits['{0}']".format(namespace), limit)
+                    for namespace, limit in sorted(partner_limits.items()))
+        for name, value in caps:
+            if value < 1:
+                # No request it applies to could ever start.
+                raise ValueError("{0} must be at least 1, not {1}".format(name, value))
+        self.inbound_dir = inbound_dir
+        self.max_active = max_active
+        self.partner_limits = partner_limits
+        self.default_partner_limit = default_partner_limit
+        self.bandwidth = bandwidth
+        self.min_rate = min_rate
+        self.large_bag_size = large_bag_size
+        self.max_large = max_large
+        self.min_free_space = min_free_space
+        self.aging_period = aging_period
+        self._pending = []
+        self._active = {}
+        self._releases = 0
+        self._releases_seen = 0
+        self._condition = threading.Condition()
+
+    def free_space(self):
+        """
+        Returns the number of free bytes in inbound_dir.
+        """
+        return shutil.disk_usage(self.inbound_dir).free
+
+    @property
+    def slots(self):
+        """
+        Max number of transfers to run at once, given max_active and the
+        bandwidth budget.
+        """
+        if not self.bandwidth:
+            return self.max_active
+        return max(1, min(self.max_active, self.bandwidth // self.min_rate))
+
+    def add(self, namespace, xfer_request):
+        """
+        Queues a transfer request from the node with namespace.
+        """
+        with self._condition:
+            self._pending.append((namespace, xfer_request, _requested_at(xfer_request)))
+
+    def pending_count(self):
+        with self._condition:
+            return len(self._pending)
+
+    def active_count(self):
+        with self._condition:
+            return len(self._active)
+
+    def admit(self, now=None):
+        """
+        Returns a list of (namespace, xfer_request) pairs to start now,
+        best first, and counts them as running until they're released.
+        """
+        now = time.time() if now is None else now
+        with self._condition:
+            self._releases_seen = self._releases
+            admitted = []
+            free = self.free_space() - self.min_free_space - sum(
+                _size(xfer_request) for xfer_request in self._active.values())
+            for entry in sorted(self._pending, key=lambda entry: self._priority(entry, now)):
+                if len(self._active) >= self.slots:
+                    break
+                namespace, xfer_request, requested_at = entry
+                size = _size(xfer_request)
+                if self._running(namespace) >= self.partner_limits.get(
+                        namespace, self.default_partner_limit):
+                    continue
+                if size >= self.large_bag_size and self._running_large() >= self.max_large:
+                    continue
+                if size > free:
+                    continue
+                free -= size
+                self._pending.remove(entry)
+                self._active[_key(namespace, xfer_request)] = xfer_request
+                admitted.append((namespace, xfer_request))
+            return admitted
+
+    def release(self, namespace, xfer_request):
+        """
+        Marks a transfer as finished (or failed), freeing its slot.
+        """
+        with self._condition:
+            self._active.pop(_key(namespace, xfer_request), None)
+            self._releases += 1
+            self._condition.notify_all()
+
+    def wait(self, timeout=None):
+        """
+        Waits until a transfer is released, or timeout seconds pass.
+        Returns at once if one was released since the last admit().
+        """
+        with self._condition:
+            self._condition.wait_for(
+                lambda: self._releases != self._releases_seen, timeout)
+
+    def unstartable(self):
+        """
+        Removes and returns the (namespace, xfer_request) pairs that
+        can't start even with nothing else running, because they're
+        bigger than the free space in inbound_dir. Returns an empty list
+        while any transfer is running, since that may free space.
+        """
+        with self._condition:
+            if self._active:
+                return []
+            free = self.free_space() - self.min_free_space
+            stuck = [entry for entry in self._pending if _size(entry[1]) > free]
+            for entry in stuck:
+                self._pending.remove(entry)
+            return [(namespace, xfer_request) for namespace, xfer_request, _ in stuck]
+
+    def _priority(self, entry, now):
+        namespace, xfer_request, requested_at = entry
+        age = max(0, now - requested_at)
+        return _size(xfer_request) / (1.0 + age / self.aging_period), requested_at
+
+    def _running(self, namespace):
+        return sum(1 for key in self._active if key[0] == namespace)
+
+    def _running_large(self):
+        return sum(1 for xfer_request in self._active.values()
+                   if _size(xfer_request) >= self.large_bag_size)
+
+
+def _key(namespace, xfer_request):
+    return (namespace, xfer_request['replication_id'])
+
+def _size(xfer_request):
+    return xfer_request.get('size') or 0
+
+def _requested_at(xfer_request):
+    """
+    Returns the request's created_at as a Unix timestamp, or the current
+    time if it doesn't have one.
+    """
+    created_at = xfer_request.get('created_at')
+    if created_at:
+        try:
+            parsed = datetime.strptime(created_at[:19], "%Y-%m-%dT%H:%M:%S")
+            return (parsed - datetime(1970, 1, 1)).total_seconds()
+        except ValueError:
+            pass
+    return time.time()
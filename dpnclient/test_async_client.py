@@ -0,0 +1,81 @@
+import asyncio
+import threading
+from pytest import raises
+from requests.exceptions import RequestException
+from .async_client import AsyncBaseClient, AsyncClient
+from .test_client import ClientTestSettings, client_test_config, offline_client
+
+def test_async_base_client_calls_sync_client():
+    client = AsyncBaseClient("http://www.example.com", "API_TOKEN_1234", max_workers=4)
+    calls = []
+    def bag_get(obj_id):
+        calls.append(obj_id)
+        return obj_id.upper()
+    client.client.bag_get = bag_get
+    async def run():
+        return await asyncio.gather(*[client.bag_get(x) for x in ('a', 'b', 'c')])
+    assert asyncio.run(run()) == ['A', 'B', 'C']
+    assert sorted(calls) == ['a', 'b', 'c']
+    client.close()
+
+def test_async_base_client_raises_like_sync_client():
+    client = AsyncBaseClient("http://www.example.com", "API_TOKEN_1234", max_workers=1)
+    def node_get(namespace):
+        raise RequestException("not found")
+    client.client.node_get = node_get
+    with raises(RequestException):
+        asyncio.run(client.node_get('tdr'))
+    client.close()
+
+def test_async_context_manager_closes_without_blocking_loop():
+    client = AsyncBaseClient("http://www.example.com", "API_TOKEN_1234", max_workers=1)
+    release = threading.Event()
+    def bag_get(obj_id):
+        release.wait(5)
+        return obj_id
+    client.client.bag_get = bag_get
+    ticks = []
+    async def tick():
+        # Runs while __aexit__ waits for the slow call to finish.
+        for i in range(3):
+            ticks.append(i)
+            await asyncio.sleep(0.01)
+        release.set()
+    async def run():
+        async with client:
+            call = asyncio.ensure_future(client.bag_get('a'))
+            await asyncio.sleep(0)
+            asyncio.ensure_future(tick())
+        return await call
+    assert asyncio.run(run()) == 'a'
+    assert ticks == [0, 1, 2]
+
+def test_async_client_exposes_node_info(monkeypatch):
+    sync_client = offline_client(monkeypatch)
+    client = AsyncClient(ClientTestSettings(), client_test_config,
+                         max_workers=2, client=sync_client)
+    assert client.my_node['namespace'] == 'example'
+    assert [n['namespace'] for n in client.replicate_from] == ['remote']
+    with raises(AttributeError):
+        client.no_such_attribute
+    client.close()
+
+def test_async_client_loads_nodes_off_the_loop(monkeypatch):
+    sync_client = offline_client(monkeypatch)
+    node_list = sync_client.node_list
+    threads = []
+    def recording_node_list(**kwargs):
+        threads.append(threading.current_thread())
+        return node_list(**kwargs)
+    sync_client.node_list = recording_node_list
+    client = AsyncClient(ClientTestSettings(), client_test_config,
+                         max_workers=2, client=sync_client)
+    async def run():
+        await client.load_nodes()
+        return client.my_node['namespace']
+    assert asyncio.run(run()) == 'example'
+    assert len(threads) == 1
+    assert threads[0] is not threading.main_thread()
+    asyncio.run(client.refresh_nodes())
+    assert len(threads) == 2
+    client.close()
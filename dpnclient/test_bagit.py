@@ -0,0 +1,81 @@
+import hashlib
+import io
+import tarfile
+from . import bagit
+from . import util
+
+PAYLOAD = {
+    'data/hello.txt': b'hello world\n',
+    'data/sub/big.bin': b'0123456789' * 50000,
+}
+
+def sha256(content):
+    return hashlib.sha256(content).hexdigest()
+
+def make_bag_tar(path, payload=PAYLOAD, manifest=None, prefix='bag/'):
+    if manifest is None:
+        manifest = payload
+    files = {'bagit.txt': b'BagIt-Version: 0.97\nTag-File-Character-Encoding: UTF-8\n'}
+    files['manifest-sha256.txt'] = ''.join(
+        '{0}  {1}\n'.format(sha256(content), name)
+        for name, content in sorted(manifest.items())).encode('utf-8')
+    files['tagmanifest-sha256.txt'] = ''.join(
+        '{0}  {1}\n'.format(sha256(content), name)
+        for name, content in sorted(files.items())).encode('utf-8')
+    files.update(payload)
+    with tarfile.open(path, 'w') as tar:
+        # Payload first, so manifests are read after the files they list.
+        for name in sorted(files, key=lambda name: not name.startswith('data/')):
+            info = tarfile.TarInfo(prefix + name)
+            info.size = len(files[name])
+            tar.addfile(info, io.BytesIO(files[name]))
+    return path
+
+def test_valid_bag(tmpdir):
+    path = make_bag_tar(str(tmpdir.join('bag.tar')))
+    result = bagit.validate_tar(path, large_file_size=1000)
+    assert result['valid']
+    assert (result['missing'], result['extra'], result['mismatched']) == ([], [], [])
+    assert result['file_count'] == 5
+    assert result['tar_digest'] == util.digest(path, 'sha256', force=True)
+
+def test_manifest_over_large_file_size(tmpdir):
+    for prefix in ('bag/', ''):
+        path = make_bag_tar(str(tmpdir.join('bag{0}.tar'.format(len(prefix)))),
+                            prefix=prefix)
+        result = bagit.validate_tar(path, large_file_size=100)
+        assert result['valid'], result
+        assert result['file_count'] == 5
+
+def test_nested_manifest_is_payload(tmpdir):
+    payload = dict(PAYLOAD)
+    payload['data/x/manifest-sha256.txt'] = b'not the bag manifest\n'
+    path = make_bag_tar(str(tmpdir.join('bag.tar')), payload=payload)
+    result = bagit.validate_tar(path, large_file_size=1000)
+    assert result['valid'], result
+
+def test_missing_extra_and_mismatched(tmpdir):
+    payload = dict(PAYLOAD)
+    payload['data/extra.txt'] = b'not in the manifest'
+    manifest = dict(PAYLOAD)
+    manifest['data/gone.txt'] = b'never tarred'
+    manifest['data/sub/big.bin'] = b'different content'
+    path = make_bag_tar(str(tmpdir.join('bag.tar')), payload, manifest, prefix='')
+    result = bagit.validate_tar(path, large_file_size=1000)
+    assert not result['valid']
+    assert result['missing'] == ['data/gone.txt']
+    assert result['extra'] == ['data/extra.txt']
+    assert result['mismatched'] == ['data/sub/big.bin']
+
+def test_not_a_bag(tmpdir):
+    path = str(tmpdir.join('plain.tar'))
+    with tarfile.open(path, 'w') as tar:
+        info = tarfile.TarInfo('readme.txt')
+        tar.addfile(info, io.BytesIO(b''))
+    result = bagit.validate_tar(path)
+    assert result['missing'] == ['bagit.txt', 'manifest-sha256.txt']
+
+def test_parse_manifest():
+    content = b'ABC123  data/a%25b.txt\n\nff00 *data/c d.txt\n'
+    assert bagit.parse_manifest(content) == {'data/a%b.txt': 'abc123',
+                                             'data/c d.txt': 'ff00'}
@@ -1,4 +1,11 @@
+import requests
+from pytest import raises
+from requests.exceptions import RequestException
+from . import jsoncodec
 from .base_client import BaseClient
+from .metrics import InMemoryMetrics
+from .resilience import CircuitBreaker, CircuitOpenError, RetryPolicy
+from .response_cache import ResponseCache
 
 # TODO: Integration tests!
 
@@ -8,3 +15,199 @@ def test_headers():
     assert headers['Content-Type'] == 'application/json'
     assert headers['Accept'] == 'application/json'
     assert headers['Authorization'] == 'token API_TOKEN_1234'
+
+def test_connection_pool():
+    baseclient = BaseClient("http://www.example.com", "API_TOKEN_1234",
+                            pool_maxsize=25)
+    adapter = baseclient.session.get_adapter("https://www.example.com/api-v1/")
+    assert adapter._pool_maxsize == 25
+    assert baseclient.session.get_adapter("http://www.example.com/") is adapter
+
+def test_context_manager_closes_session():
+    closed = []
+    with BaseClient("http://www.example.com", "API_TOKEN_1234") as baseclient:
+        baseclient.session.close = lambda: closed.append(True)
+    assert closed == [True]
+
+class FakeSession:
+    """
+    Stands in for requests.Session, returning canned responses.
+    """
+    def __init__(self, responses):
+        self.responses = list(responses)
+        self.requests = []
+
+    def request(self, method, url, headers=None, **kwargs):
+        self.requests.append((method, url, headers))
+        return self.responses.pop(0)
+
+    def close(self):
+        pass
+
+def make_response(status_code, content=b'{}', headers=None):
+    response = requests.Response()
+    response.status_code = status_code
+    response._content = content
+    response.headers.update(headers or {})
+    return response
+
+def test_response_cache_revalidates_with_etag():
+    cache = ResponseCache(ttl=60)
+    baseclient = BaseClient("http://www.example.com", "API_TOKEN_1234",
+                            response_cache=cache)
+    first = make_response(200, b'{"uuid": "1"}', {'ETag': '"v1"'})
+    baseclient.session = FakeSession([first, make_response(304, b'')])
+    assert baseclient.bag_get('1') is first
+    # Fresh: served without a request.
+    assert baseclient.bag_get('1') is first
+    assert len(baseclient.session.requests) == 1
+    # Stale: revalidated with a conditional GET.
+    cache.get("http://www.example.com/api-v1/bag/1/").stored_at -= 61
+    assert baseclient.bag_get('1') is first
+    assert baseclient.session.requests[1][2]['If-None-Match'] == '"v1"'
+
+def test_response_cache_entry_invalidated_during_revalidation():
+    cache = ResponseCache(ttl=60)
+    baseclient = BaseClient("http://www.example.com", "API_TOKEN_1234",
+                            response_cache=cache)
+    url = "http://www.example.com/api-v1/bag/1/"
+    first = make_response(200, b'{"uuid": "1"}', {'ETag': '"v1"'})
+    baseclient.session = FakeSession([first])
+    baseclient.bag_get('1')
+    cache.get(url).stored_at -= 61
+    class InvalidatingSession(FakeSession):
+        def request(self, method, url, headers=None, **kwargs):
+            cache.invalidate(url)
+            return super(InvalidatingSession, self).request(method, url, headers, **kwargs)
+    baseclient.session = InvalidatingSession([make_response(304, b'')])
+    assert baseclient.bag_get('1') is first
+    # An invalidated entry isn't brought back.
+    assert cache.get(url) is None
+
+def test_update_invalidates_cached_response():
+    cache = ResponseCache()
+    baseclient = BaseClient("http://www.example.com", "API_TOKEN_1234",
+                            response_cache=cache,
+                            retry_policy=RetryPolicy(max_retries=0))
+    baseclient.session = FakeSession([make_response(200), make_response(500, b'error')])
+    baseclient.transfer_get('42')
+    assert cache.get("http://www.example.com/api-v1/replicate/42/") is not None
+    with raises(RequestException):
+        baseclient.transfer_update({'replication_id': '42'})
+    assert cache.get("http://www.example.com/api-v1/replicate/42/") is None
+
+class FailingSession(FakeSession):
+    """
+    Raises a ConnectionError for each None in responses, and raises each
+    exception in responses.
+    """
+    def request(self, method, url, headers=None, **kwargs):
+        self.requests.append((method, url, headers))
+        self.timeout = kwargs.get('timeout')
+        response = self.responses.pop(0)
+        if response is None:
+            raise requests.exceptions.ConnectionError("connection reset")
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+def test_timeout_is_sent():
+    baseclient = BaseClient("http://www.example.com", "API_TOKEN_1234", timeout=(1, 2))
+    baseclient.session = FailingSession([make_response(200)])
+    baseclient.node_get('tdr')
+    assert baseclient.session.timeout == (1, 2)
+
+def test_idempotent_calls_are_retried():
+    baseclient = BaseClient("http://www.example.com", "API_TOKEN_1234",
+                            retry_policy=RetryPolicy(max_retries=3, backoff=0))
+    baseclient.session = FailingSession([None, make_response(503), make_response(200)])
+    assert baseclient.bag_get('1').status_code == 200
+    assert len(baseclient.session.requests) == 3
+
+def test_retries_give_up():
+    baseclient = BaseClient("http://www.example.com", "API_TOKEN_1234",
+                            retry_policy=RetryPolicy(max_retries=1, backoff=0))
+    baseclient.session = FailingSession([None, None])
+    with raises(requests.exceptions.ConnectionError):
+        baseclient.bag_get('1')
+    assert len(baseclient.session.requests) == 2
+
+def test_create_is_not_retried():
+    baseclient = BaseClient("http://www.example.com", "API_TOKEN_1234",
+                            retry_policy=RetryPolicy(max_retries=3, backoff=0))
+    baseclient.session = FailingSession([make_response(503, b'busy')])
+    with raises(RequestException):
+        baseclient.bag_create({'uuid': '1'})
+    assert len(baseclient.session.requests) == 1
+
+def test_retry_delay_is_jittered_and_capped():
+    policy = RetryPolicy(backoff=1, max_backoff=5)
+    delays = [policy.delay(10) for i in range(100)]
+    assert all(0 <= delay <= 5 for delay in delays)
+    assert len(set(delays)) > 1
+
+def test_circuit_breaker_fails_fast():
+    breaker = CircuitBreaker('tdr', failure_threshold=2, reset_timeout=60)
+    baseclient = BaseClient("http://www.example.com", "API_TOKEN_1234",
+                            retry_policy=RetryPolicy(max_retries=0),
+                            circuit_breaker=breaker)
+    baseclient.session = FailingSession([None, None, make_response(200)])
+    for i in range(2):
+        with raises(requests.exceptions.ConnectionError):
+            baseclient.node_get('tdr')
+    with raises(CircuitOpenError):
+        baseclient.node_get('tdr')
+    assert len(baseclient.session.requests) == 2
+    # After reset_timeout, one trial call goes through and closes the breaker.
+    breaker.opened_at -= 61
+    assert baseclient.node_get('tdr').status_code == 200
+    assert breaker.state == 'closed'
+
+def test_circuit_breaker_trial_fails_with_other_error():
+    breaker = CircuitBreaker('tdr', failure_threshold=1, reset_timeout=60)
+    baseclient = BaseClient("http://www.example.com", "API_TOKEN_1234",
+                            retry_policy=RetryPolicy(max_retries=0),
+                            circuit_breaker=breaker)
+    baseclient.session = FailingSession([
+        None, requests.exceptions.ChunkedEncodingError("truncated"), make_response(200)])
+    with raises(requests.exceptions.ConnectionError):
+        baseclient.node_get('tdr')
+    breaker.opened_at -= 61
+    with raises(requests.exceptions.ChunkedEncodingError):
+        baseclient.node_get('tdr')
+    # The failed trial reopened the breaker instead of leaving it half-open.
+    assert breaker.state == 'open'
+    breaker.opened_at -= 61
+    assert baseclient.node_get('tdr').status_code == 200
+    assert breaker.state == 'closed'
+
+def test_circuit_breaker_half_open_expires():
+    breaker = CircuitBreaker('tdr', failure_threshold=1, reset_timeout=60)
+    breaker.record_failure()
+    breaker.opened_at -= 61
+    breaker.before_call()
+    assert breaker.state == 'half-open'
+    # The trial never reports back.
+    with raises(CircuitOpenError):
+        breaker.before_call()
+    breaker.opened_at -= 61
+    breaker.before_call()
+    assert breaker.state == 'half-open'
+
+def test_instrumentation_records_calls():
+    metrics = InMemoryMetrics()
+    baseclient = BaseClient("http://www.example.com", "API_TOKEN_1234",
+                            retry_policy=RetryPolicy(max_retries=2, backoff=0),
+                            namespace='tdr', instrumentation=metrics)
+    baseclient.session = FailingSession([None, make_response(200, b'{"ok": 1}'),
+                                         make_response(400, b'bad')])
+    baseclient.transfer_update({'replication_id': '42'})
+    with raises(RequestException):
+        baseclient.bag_create({'uuid': '1'})
+    stats = metrics.stats()
+    update = stats[('transfer_update', 'tdr', 200)]
+    assert update.calls == 1
+    assert update.retries == 1
+    assert update.request_bytes == len(jsoncodec.dumps({'replication_id': '42'}))
+    assert update.response_bytes == 9
+    assert stats[('bag_create', 'tdr', 400)].calls == 1
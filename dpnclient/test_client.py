@@ -1,17 +1,350 @@
+import json
+import tarfile
+import threading
+import time
 from pytest import raises
+from requests.exceptions import RequestException
+from . import const
+from . import util
 from .client import Client
+from .fake_registry import FakeRegistry
+from .records import Transfer
 
-# TODO: Integration tests. There is nothing testable
-# in client.py without a server to talk to.
+# TODO: Integration tests. Most of client.py needs a server
+# to talk to.
 
-# class ClientTestSettings:
-#     def __init__(self):
-#         self.MY_NODE = "dpn.example.com"
-#         self.KEYS = {"remote": "000000000000"}
+class ClientTestSettings:
+    def __init__(self):
+        self.MY_NODE = "example"
+        self.KEYS = {"remote": "000000000000"}
 
-# client_test_config = {
-#     'url': 'http://dpn.example.com/api/',
-#     'token': '1234567890',
-#     'rsync_host': 'dpn.example.com',
-#     'max_xfer_size': 0,
-# }
+client_test_config = {
+    'url': 'http://dpn.example.com/api/',
+    'token': '1234567890',
+    'rsync_host': 'dpn.example.com',
+    'max_xfer_size': 0,
+}
+
+client_test_nodes = [
+    {'namespace': 'example', 'api_root': 'http://dpn.example.com/api/',
+     'replicate_from': False, 'replicate_to': False,
+     'restore_from': False, 'restore_to': False},
+    {'namespace': 'remote', 'api_root': 'http://remote.example.com/api/',
+     'replicate_from': True, 'replicate_to': True,
+     'restore_from': True, 'restore_to': True},
+]
+
+class FakeResponse:
+    def __init__(self, data):
+        self.data = data
+        self.content = json.dumps(data).encode('utf-8')
+    def json(self):
+        return self.data
+
+def offline_client(monkeypatch, settings=None):
+    """
+    Returns a Client whose node list comes from client_test_nodes
+    instead of the server.
+    """
+    page = {'count': len(client_test_nodes), 'next': None,
+            'previous': None, 'results': client_test_nodes}
+    calls = []
+    def node_list(self, **kwargs):
+        calls.append(kwargs)
+        return FakeResponse(page)
+    monkeypatch.setattr(Client, 'node_list', node_list)
+    client = Client(settings or ClientTestSettings(), client_test_config)
+    client.node_list_calls = calls
+    return client
+
+def test_remote_client_is_reused(monkeypatch):
+    client = offline_client(monkeypatch)
+    remote = client.remote_client('remote')
+    assert remote.url == 'http://remote.example.com/api'
+    assert remote.token == '000000000000'
+    assert client.remote_client('remote') is remote
+    with raises(KeyError):
+        client.remote_client('unknown')
+
+def test_close_closes_remote_clients(monkeypatch):
+    client = offline_client(monkeypatch)
+    closed = []
+    remote = client.remote_client('remote')
+    remote.session.close = lambda: closed.append(True)
+    client.close()
+    assert closed == [True]
+    assert client.remote_client('remote') is not remote
+
+def test_poll_all_transfer_requests(monkeypatch):
+    client = offline_client(monkeypatch)
+    client.settings.KEYS['example'] = '1111'
+    monkeypatch.setattr(Client, 'replicate_from', property(lambda self: self.all_nodes))
+    def get_transfer_requests(namespace, page_size=None):
+        if namespace == 'example':
+            raise RequestException("node is down")
+        return [{'replication_id': '1'}]
+    client.get_transfer_requests = get_transfer_requests
+    results = client.poll_all_transfer_requests(timeout=5)
+    assert results['remote']['transfers'] == [{'replication_id': '1'}]
+    assert results['remote']['error'] is None
+    assert results['remote']['elapsed'] >= 0
+    assert results['example']['transfers'] is None
+    assert isinstance(results['example']['error'], RequestException)
+
+def test_poll_all_transfer_requests_times_out_slow_node(monkeypatch):
+    client = offline_client(monkeypatch)
+    release = threading.Event()
+    def get_transfer_requests(namespace, page_size=None):
+        release.wait(5)
+        return []
+    client.get_transfer_requests = get_transfer_requests
+    start = time.time()
+    results = client.poll_all_transfer_requests(timeout=0.1)
+    release.set()
+    assert time.time() - start < 2
+    assert results['remote']['transfers'] is None
+    assert 'did not respond' in str(results['remote']['error'])
+
+BAG_UUIDS = ["e084c014-9ba1-41a3-9eb3-6daef8097bc{0}".format(i) for i in range(5)]
+
+def test_create_bag_entries(monkeypatch):
+    client = offline_client(monkeypatch)
+    created = []
+    def bag_create(entry):
+        if entry['uuid'] == BAG_UUIDS[2]:
+            raise RequestException("server error")
+        created.append(entry['uuid'])
+        return FakeResponse(entry)
+    client.bag_create = bag_create
+    batch = [{'obj_id': uuid, 'bag_size': 100, 'bag_type': 'D',
+              'fixity': 'abc', 'local_id': 'bag{0}'.format(i)}
+             for i, uuid in enumerate(BAG_UUIDS)]
+    batch[3]['obj_id'] = 'not a uuid'
+    del batch[4]['bag_type']
+    results = client.create_bag_entries(batch, max_workers=3)
+    assert [r['item'] for r in results] == batch
+    assert sorted(created) == BAG_UUIDS[0:2]
+    assert results[0]['result']['admin_node'] == 'example'
+    assert results[0]['error'] is None
+    assert isinstance(results[2]['error'], RequestException)
+    assert isinstance(results[3]['error'], ValueError)
+    assert isinstance(results[4]['error'], TypeError)
+    assert results[3]['result'] is None
+
+def test_create_transfer_requests(monkeypatch):
+    client = offline_client(monkeypatch)
+    client.transfer_create = lambda xfer_req: FakeResponse(xfer_req)
+    batch = [{'obj_id': BAG_UUIDS[0], 'bag_size': 100, 'fixity': 'abc'},
+             {'obj_id': BAG_UUIDS[1], 'bag_size': 'big', 'fixity': 'abc'}]
+    results = client.create_transfer_requests(batch, ['tdr', 'sdr'])
+    assert [(r['item']['obj_id'], r['to_node']) for r in results] == [
+        (BAG_UUIDS[0], 'tdr'), (BAG_UUIDS[0], 'sdr'),
+        (BAG_UUIDS[1], 'tdr'), (BAG_UUIDS[1], 'sdr')]
+    assert results[1]['result']['to_node'] == 'sdr'
+    assert results[1]['result']['link'].startswith('sdr@dpn.example.com:')
+    assert isinstance(results[2]['error'], TypeError)
+    assert results[3]['result'] is None
+
+def test_nodes_load_lazily(monkeypatch):
+    client = offline_client(monkeypatch)
+    assert client.node_list_calls == []
+    assert client.my_node['namespace'] == 'example'
+    assert [n['namespace'] for n in client.replicate_to] == ['remote']
+    assert sorted(client.nodes_by_namespace) == ['example', 'remote']
+    assert len(client.node_list_calls) == 1
+
+def test_nodes_load_from_cache_file(monkeypatch, tmpdir):
+    settings = ClientTestSettings()
+    settings.NODE_CACHE_FILE = str(tmpdir.join('nodes.json'))
+    client = offline_client(monkeypatch, settings)
+    assert client.my_node['namespace'] == 'example'
+    assert len(client.node_list_calls) == 1
+    # A new client reads the cache instead of the server.
+    client = offline_client(monkeypatch, settings)
+    assert [n['namespace'] for n in client.all_nodes] == ['example', 'remote']
+    assert client.node_list_calls == []
+
+def test_stale_node_cache_refreshes_in_background(monkeypatch, tmpdir):
+    settings = ClientTestSettings()
+    settings.NODE_CACHE_FILE = str(tmpdir.join('nodes.json'))
+    stale_nodes = [dict(client_test_nodes[0], replicate_to=True)]
+    with open(settings.NODE_CACHE_FILE, 'w') as f:
+        json.dump({'url': 'http://dpn.example.com/api', 'fetched_at': 0,
+                   'nodes': stale_nodes}, f)
+    client = offline_client(monkeypatch, settings)
+    # The stale cache is served right away...
+    assert [n['namespace'] for n in client.all_nodes] == ['example']
+    # ...and replaced once the background refresh finishes.
+    for i in range(100):
+        if len(client.all_nodes) == 2:
+            break
+        time.sleep(0.01)
+    assert [n['namespace'] for n in client.replicate_to] == ['remote']
+    with open(settings.NODE_CACHE_FILE) as f:
+        assert len(json.load(f)['nodes']) == 2
+
+def test_remote_clients_have_their_own_circuit_breakers(monkeypatch):
+    settings = ClientTestSettings()
+    settings.KEYS['example'] = '1111'
+    client = offline_client(monkeypatch, settings)
+    remote = client.remote_client('remote')
+    assert remote.circuit_breaker.name == 'remote'
+    assert remote.timeout == client.timeout
+    assert client.remote_client('example').circuit_breaker is not remote.circuit_breaker
+
+def registry_client(registry, remote_registry, settings=None):
+    """
+    Returns a Client for registry, whose node list points 'remote'
+    at remote_registry.
+    """
+    registry.add('node', {'namespace': 'example', 'api_root': registry.url,
+                          'replicate_from': False, 'replicate_to': False,
+                          'restore_from': False, 'restore_to': False})
+    registry.add('node', {'namespace': 'remote', 'api_root': remote_registry.url,
+                          'replicate_from': True, 'replicate_to': True,
+                          'restore_from': True, 'restore_to': True})
+    settings = settings or ClientTestSettings()
+    settings.KEYS['remote'] = remote_registry.token
+    config = dict(client_test_config, url=registry.url, token=registry.token)
+    return Client(settings, config)
+
+def test_transfer_round_trip_against_fake_registry():
+    with FakeRegistry() as registry, FakeRegistry(token='remote-token') as remote:
+        for i in range(45):
+            remote.add('replicate', {'replication_id': str(i), 'status': 'Requested',
+                                     'to_node': 'example' if i != 3 else 'other'})
+        client = registry_client(registry, remote)
+        xfer_requests = client.get_transfer_requests('remote', page_size=10)
+        assert len(xfer_requests) == 44
+        assert [r['replication_id'] for r in xfer_requests][:4] == ['0', '1', '2', '4']
+        client.set_transfer_fixity('remote', '7', 'abc123')
+        assert remote.get('replicate', '7')['fixity_value'] == 'abc123'
+        entry = client.create_bag_entry(BAG_UUIDS[0], 100, 'D', 'abc', 'bag0')
+        assert registry.get('bag', BAG_UUIDS[0])['admin_node'] == entry['admin_node']
+        client.close()
+
+def test_records_against_fake_registry():
+    with FakeRegistry() as registry, FakeRegistry(token='remote-token') as remote:
+        remote.add('replicate', {'replication_id': '1', 'status': 'Requested',
+                                 'to_node': 'example'})
+        client = registry_client(registry, remote)
+        xfer_requests = client.get_transfer_requests('remote', as_records=True)
+        assert isinstance(xfer_requests[0], Transfer)
+        xfer = xfer_requests[0]
+        xfer.status = 'Received'
+        client.remote_client('remote').transfer_update(xfer)
+        assert remote.get('replicate', '1')['status'] == 'Received'
+        nodes = list(client.iter_nodes(as_records=True))
+        assert [node.namespace for node in nodes] == ['example', 'remote']
+        client.close()
+
+def test_registry_mirror_queries(tmpdir):
+    settings = ClientTestSettings()
+    settings.REGISTRY_MIRROR_PATH = str(tmpdir.join('mirror.sqlite3'))
+    with FakeRegistry() as registry, FakeRegistry(token='remote-token') as remote:
+        registry.add('bag', {'uuid': BAG_UUIDS[0], 'local_id': 'bag0',
+                             'admin_node': 'example', 'replicating_nodes': ['remote']})
+        remote.add('bag', {'uuid': BAG_UUIDS[1], 'local_id': 'bag1',
+                           'admin_node': 'remote', 'replicating_nodes': []})
+        client = registry_client(registry, remote, settings)
+        assert client.sync_registry_mirror()['bag'] == 1
+        assert client.sync_registry_mirror('remote')['bag'] == 1
+        assert [b['uuid'] for b in client.find_bags(local_id='bag0')] == [BAG_UUIDS[0]]
+        assert client.find_bags(admin_node='remote', as_records=True)[0].local_id == 'bag1'
+        assert [b['uuid'] for b in client.bags_held_by('remote')] == [BAG_UUIDS[0]]
+        client.close()
+
+def test_registry_mirror_not_configured(monkeypatch):
+    client = offline_client(monkeypatch)
+    with raises(ValueError):
+        client.find_bags(local_id='bag0')
+
+def add_requested_transfer(registry, replication_id, updated_at):
+    registry.add('replicate', {'replication_id': replication_id, 'status': 'Requested',
+                               'to_node': 'example', 'updated_at': updated_at})
+
+def test_poll_transfer_changes(tmpdir):
+    settings = ClientTestSettings()
+    settings.WATERMARK_FILE = str(tmpdir.join('watermarks.sqlite3'))
+    with FakeRegistry() as registry, FakeRegistry(token='remote-token') as remote:
+        for i in range(3):
+            add_requested_transfer(remote, str(i), '2015-01-01T00:00:0{0}Z'.format(i))
+        client = registry_client(registry, remote, settings)
+        assert len(client.poll_transfer_changes('remote')) == 3
+        assert client.poll_transfer_changes('remote') == []
+        add_requested_transfer(remote, '3', '2015-01-02T00:00:00Z')
+        changes = client.poll_transfer_changes('remote', as_records=True)
+        assert [xfer.replication_id for xfer in changes] == ['3']
+        # Committed late, with the same updated_at as the watermark.
+        add_requested_transfer(remote, '4', '2015-01-02T00:00:00Z')
+        assert [x['replication_id'] for x in client.poll_transfer_changes('remote')] == ['4']
+        assert client.poll_transfer_changes('remote') == []
+        # Entries older than the next filter have been pruned.
+        assert sorted(client.watermarks.snapshot('remote', 'transfer_list')) == ['3', '4']
+        client.close()
+        # The watermark survives a restart.
+        client = registry_client(registry, remote, settings)
+        requests_before = remote.request_count
+        assert client.poll_transfer_changes('remote') == []
+        assert remote.request_count == requests_before + 1
+        client.close()
+
+def test_poll_transfer_changes_without_server_filter(monkeypatch):
+    with FakeRegistry() as registry, FakeRegistry(token='remote-token') as remote:
+        # This node ignores the after filter.
+        list_records = remote._list
+        monkeypatch.setattr(remote, '_list', lambda collection, params: list_records(
+            collection, dict((k, v) for k, v in params.items() if k != 'after')))
+        for i in range(3):
+            add_requested_transfer(remote, str(i), '2015-01-01T00:00:0{0}Z'.format(i))
+        client = registry_client(registry, remote)
+        assert len(client.poll_transfer_changes('remote')) == 3
+        assert client.poll_transfer_changes('remote') == []
+        add_requested_transfer(remote, '1', '2015-01-03T00:00:00Z')
+        add_requested_transfer(remote, '4', '2015-01-02T00:00:00Z')
+        changes = client.poll_transfer_changes('remote')
+        assert sorted(xfer['replication_id'] for xfer in changes) == ['1', '4']
+        assert client.poll_transfer_changes('remote') == []
+        results = client.poll_all_transfer_requests(incremental=True)
+        assert results['remote']['transfers'] == []
+        client.close()
+
+def test_get_restore_requests_without_server_filter(monkeypatch):
+    with FakeRegistry() as registry, FakeRegistry(token='remote-token') as remote:
+        # This node ignores the from_node filter.
+        list_records = remote._list
+        monkeypatch.setattr(remote, '_list', lambda collection, params: list_records(
+            collection, dict((k, v) for k, v in params.items() if k != 'from_node')))
+        for i, from_node in enumerate(('example', 'other', 'example')):
+            remote.add('restore', {'restore_id': str(i), 'from_node': from_node,
+                                   'to_node': 'remote',
+                                   'status': const.STATUS_REQUESTED})
+        client = registry_client(registry, remote)
+        found = client.get_restore_requests('remote', as_records=True)
+        assert [restore.restore_id for restore in found] == ['0', '2']
+        client.close()
+
+def test_package_and_register(tmpdir):
+    bag_dir = tmpdir.mkdir('bag')
+    bag_dir.join('bagit.txt').write('BagIt-Version: 0.97\n')
+    bag_dir.mkdir('data').join('file.txt').write('contents')
+    settings = ClientTestSettings()
+    settings.OUTBOUND_DIR = str(tmpdir.mkdir('outbound'))
+    with FakeRegistry() as registry, FakeRegistry(token='remote-token') as remote:
+        client = registry_client(registry, remote, settings)
+        result = client.package_and_register(str(bag_dir), 'my-bag', obj_id=BAG_UUIDS[0])
+        client.close()
+        tar_path = tmpdir.join('outbound', BAG_UUIDS[0] + '.tar')
+        assert result['path'] == str(tar_path)
+        assert result['size'] == tar_path.size()
+        assert result['fixity'] == util.digest(str(tar_path), 'sha256', force=True)
+        with tarfile.open(str(tar_path)) as tar:
+            assert BAG_UUIDS[0] + '/data/file.txt' in tar.getnames()
+        entry = registry.get('bag', BAG_UUIDS[0])
+        assert entry['local_id'] == 'my-bag'
+        assert entry['fixities'] == [{'algorithm': 'sha256', 'digest': result['fixity']}]
+        assert [xfer['to_node'] for xfer in result['transfers']] == ['remote']
+        assert result['transfers'][0]['error'] is None
+        xfers = list(registry.records['replicate'].values())
+        assert [(x['uuid'], x['size']) for x in xfers] == [(BAG_UUIDS[0], result['size'])]
+        assert xfers[0]['link'] == 'remote@dpn.example.com:' + str(tar_path)
@@ -0,0 +1,46 @@
+from pytest import raises
+from requests.exceptions import RequestException
+from .base_client import BaseClient
+from .fake_registry import FakeRegistry
+from .resilience import RetryPolicy
+
+def test_list_paging_and_filters():
+    with FakeRegistry() as registry:
+        for i in range(25):
+            registry.add('replicate', {'replication_id': str(i),
+                                       'status': 'Requested' if i % 2 else 'Confirmed'})
+        client = BaseClient(registry.url, registry.token)
+        data = client.transfer_list(status='Requested', page_size=10).json()
+        assert data['count'] == 12
+        assert len(data['results']) == 10
+        assert data['next'] is not None
+        data = client.transfer_list(status='Requested', page_size=10, page=2).json()
+        assert [r['replication_id'] for r in data['results']] == ['21', '23']
+        assert data['next'] is None
+        with raises(RequestException):
+            client.transfer_list(page_size=10, page=4)
+        client.close()
+
+def test_create_get_update():
+    with FakeRegistry() as registry:
+        client = BaseClient(registry.url, registry.token)
+        client.restore_create({'restore_id': 'r1', 'status': 'Requested'})
+        with raises(RequestException):
+            client.restore_create({'restore_id': 'r1'})
+        client.restore_update({'restore_id': 'r1', 'status': 'Accepted'})
+        assert client.restore_get('r1').json()['status'] == 'Accepted'
+        assert registry.get('restore', 'r1')['status'] == 'Accepted'
+        client.close()
+
+def test_auth_and_error_injection():
+    with FakeRegistry(error_rate=1.0) as registry:
+        client = BaseClient(registry.url, registry.token,
+                            retry_policy=RetryPolicy(max_retries=0))
+        with raises(RequestException) as err:
+            client.node_list()
+        assert err.value.response.status_code == 500
+        registry.error_rate = 0
+        with raises(RequestException) as err:
+            BaseClient(registry.url, 'wrong token').node_list()
+        assert err.value.response.status_code == 401
+        client.close()
@@ -0,0 +1,55 @@
+import os
+from . import fixity_cache
+from . import util
+
+def write_file(tmpdir, name, content):
+    path = tmpdir.join(name)
+    path.write(content)
+    return str(path)
+
+def test_get_and_put(tmpdir):
+    cache = fixity_cache.FixityCache(str(tmpdir.join('cache')))
+    path = write_file(tmpdir, 'bag.tar', 'bag contents')
+    assert cache.get(path, 'sha256') is None
+    cache.put(path, 'sha256', 'abc123')
+    assert cache.get(path, 'sha256') == 'abc123'
+    assert cache.get(path, 'md5') is None
+    cache.invalidate(path)
+    assert cache.get(path, 'sha256') is None
+    cache.close()
+
+def test_changed_file_is_a_miss(tmpdir):
+    cache = fixity_cache.FixityCache(str(tmpdir.join('cache')))
+    path = write_file(tmpdir, 'bag.tar', 'bag contents')
+    cache.put(path, 'sha256', 'abc123')
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1000))
+    assert cache.get(path, 'sha256') is None
+    cache.close()
+
+def test_eviction(tmpdir):
+    cache = fixity_cache.FixityCache(str(tmpdir.join('cache')), max_entries=3)
+    paths = [write_file(tmpdir, 'file{0}'.format(i), str(i)) for i in range(5)]
+    for path in paths:
+        cache.put(path, 'sha256', 'digest')
+    assert len(cache) == 3
+    assert cache.get(paths[0], 'sha256') is None
+    assert cache.get(paths[4], 'sha256') == 'digest'
+    cache.close()
+
+def test_digest_uses_default_cache(tmpdir):
+    cache = fixity_cache.configure(str(tmpdir.join('cache')))
+    try:
+        path = write_file(tmpdir, 'bag.tar', 'bag contents')
+        real_digest = util.digest(path, 'sha256')
+        assert cache.get(path, 'sha256') == real_digest
+        # Plant a fake digest to prove the cache is consulted...
+        cache.put(path, 'sha256', 'cached')
+        assert util.digest(path, 'sha256') == 'cached'
+        assert util.digests(path, ['sha256', 'md5'])['sha256'] == 'cached'
+        # ...and that force re-hashes the file.
+        assert util.digest(path, 'sha256', force=True) == real_digest
+        assert cache.get(path, 'sha256') == real_digest
+    finally:
+        fixity_cache.configure(None)
+    assert fixity_cache.default_cache() is None
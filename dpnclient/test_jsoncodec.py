@@ -0,0 +1,55 @@
+import json
+from pytest import raises
+from . import jsoncodec
+
+PAGE = {
+    'count': 3,
+    'next': None,
+    'previous': None,
+    'results': [
+        {'uuid': 'a', 'size': 1024, 'fixities': [{'algorithm': 'sha256', 'digest': 'ff'}]},
+        {'uuid': 'b', 'local_id': 'café ☃', 'size': 1.5e3},
+        {'uuid': 'c', 'interpretive': [], 'rights': None, 'bag_valid': True},
+    ],
+}
+
+def chunked(data, size):
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+def test_dumps_and_loads():
+    text = jsoncodec.dumps(PAGE)
+    assert isinstance(text, str)
+    assert json.loads(text) == PAGE
+    assert jsoncodec.loads(text) == PAGE
+    assert jsoncodec.loads(text.encode('utf-8')) == PAGE
+
+def test_streamed_page_any_chunk_size():
+    # ensure_ascii=False puts multi-byte characters in the stream, so some
+    # chunk sizes split them.
+    data = json.dumps(PAGE, ensure_ascii=False).encode('utf-8')
+    for size in (1, 2, 3, 5, 64, len(data)):
+        page = jsoncodec.StreamedPage(chunked(data, size))
+        assert list(page.results) == PAGE['results']
+        assert page.meta == {'count': 3, 'next': None, 'previous': None}
+
+def test_streamed_page_meta_before_first_record():
+    data = json.dumps(PAGE).encode('utf-8')
+    page = jsoncodec.StreamedPage(chunked(data, 10))
+    assert next(page.results) == PAGE['results'][0]
+    assert page.meta['count'] == 3
+
+def test_streamed_page_meta_after_results():
+    data = b'{"results": [1, 22, 333], "count": 3}'
+    page = jsoncodec.StreamedPage(chunked(data, 4))
+    assert list(page.results) == [1, 22, 333]
+    assert page.meta == {'count': 3}
+
+def test_streamed_page_empty_results():
+    page = jsoncodec.StreamedPage([b'{"count": 0, "next": null, "results": [ ]}'])
+    assert list(page.results) == []
+    assert page.meta == {'count': 0, 'next': None}
+
+def test_streamed_page_bad_json():
+    page = jsoncodec.StreamedPage([b'{"count": 1, "results": [1 2]}'])
+    with raises(ValueError):
+        list(page.results)
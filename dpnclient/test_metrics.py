@@ -0,0 +1,32 @@
+from .metrics import Histogram, InMemoryMetrics
+
+def test_histogram():
+    histogram = Histogram(buckets=(0.1, 1.0))
+    for value in (0.05, 0.1, 0.5, 5.0):
+        histogram.observe(value)
+    assert histogram.count == 4
+    assert histogram.sum == 5.65
+    assert histogram.cumulative_counts() == [(0.1, 2), (1.0, 3), ('+Inf', 4)]
+
+def test_in_memory_metrics():
+    metrics = InMemoryMetrics()
+    metrics.record('bag_get', 'tdr', 200, 0.02, 0, 512, 0)
+    metrics.record('bag_get', 'tdr', 200, 0.04, 0, 256, 1)
+    metrics.record('bag_get', 'tdr', None, 10.0, 0, 0, 3)
+    stats = metrics.stats()
+    ok = stats[('bag_get', 'tdr', 200)]
+    assert ok.calls == 2
+    assert ok.response_bytes == 768
+    assert ok.retries == 1
+    assert stats[('bag_get', 'tdr', None)].retries == 3
+
+def test_prometheus_text():
+    metrics = InMemoryMetrics(buckets=(0.1,))
+    metrics.record('transfer_update', 'sdr', 200, 0.05, 100, 200, 0)
+    text = metrics.prometheus_text()
+    labels = 'endpoint="transfer_update",namespace="sdr",status="200"'
+    assert '# TYPE dpn_client_request_duration_seconds histogram' in text
+    assert 'dpn_client_request_duration_seconds_bucket{' + labels + ',le="0.1"} 1' in text
+    assert 'dpn_client_request_duration_seconds_count{' + labels + '} 1' in text
+    assert 'dpn_client_request_bytes_total{' + labels + '} 100' in text
+    assert 'dpn_client_response_bytes_total{' + labels + '} 200' in text
@@ -0,0 +1,130 @@
+from pytest import raises
+from .base_client import BaseClient
+from .fake_registry import FakeRegistry
+from .mirror import RegistryMirror
+from .records import Bag
+
+def make_bag(i, **fields):
+    bag = {'uuid': 'bag-{0}'.format(i), 'local_id': 'local-{0}'.format(i),
+           'admin_node': 'aptrust', 'original_node': 'aptrust',
+           'replicating_nodes': ['chron'] if i % 2 else ['chron', 'sdr'],
+           'updated_at': '2015-01-01T00:00:{0:02d}Z'.format(i)}
+    bag.update(fields)
+    return bag
+
+def test_sync_and_query(tmpdir):
+    mirror = RegistryMirror(str(tmpdir.join('mirror.sqlite3')))
+    with FakeRegistry() as registry:
+        for i in range(25):
+            registry.add('bag', make_bag(i))
+        registry.add('replicate', {'replication_id': 'x1', 'uuid': 'bag-1',
+                                   'to_node': 'sdr', 'status': 'Requested'})
+        client = BaseClient(registry.url, registry.token)
+        counts = mirror.sync(client, page_size=10)
+        client.close()
+    assert counts == {'bag': 25, 'transfer': 1, 'restore': 0}
+    assert mirror.count('bag') == 25
+    assert mirror.find('bag', local_id='local-7') == [make_bag(7)]
+    assert len(mirror.bags_held_by('chron')) == 25
+    assert [b['uuid'] for b in mirror.bags_held_by('sdr')][:2] == ['bag-0', 'bag-2']
+    assert mirror.find('transfer', to_node='sdr', status='Requested')[0]['uuid'] == 'bag-1'
+    assert isinstance(mirror.get('bag', 'bag-3', as_records=True), Bag)
+    assert mirror.get('bag', 'nope') is None
+    with raises(ValueError):
+        mirror.find('bag', rights='x')
+    mirror.close()
+
+def test_sync_is_incremental(tmpdir):
+    mirror = RegistryMirror(str(tmpdir.join('mirror.sqlite3')))
+    with FakeRegistry() as registry:
+        for i in range(5):
+            registry.add('bag', make_bag(i))
+        client = BaseClient(registry.url, registry.token)
+        mirror.sync(client, collections=('bag',))
+        # An update moves bag-2 off sdr; a new bag arrives.
+        registry.add('bag', make_bag(2, replicating_nodes=['chron'],
+                                     updated_at='2015-01-02T00:00:00Z'))
+        registry.add('bag', make_bag(9, updated_at='2015-01-02T00:00:01Z'))
+        assert mirror.sync(client, collections=('bag',)) == {'bag': 2}
+        assert mirror.last_updated_at('bag', registry.url) == '2015-01-02T00:00:01Z'
+        client.close()
+    assert mirror.count('bag') == 6
+    assert [b['uuid'] for b in mirror.bags_held_by('sdr')] == ['bag-0', 'bag-4']
+    mirror.close()
+
+def test_watermarks_are_per_source(tmpdir):
+    mirror = RegistryMirror(str(tmpdir.join('mirror.sqlite3')))
+    with FakeRegistry() as local, FakeRegistry() as remote:
+        local.add('bag', make_bag(1, updated_at='2016-01-01T00:00:00Z'))
+        remote.add('bag', make_bag(2, updated_at='2015-01-01T00:00:00Z'))
+        local_client = BaseClient(local.url, local.token)
+        remote_client = BaseClient(remote.url, remote.token)
+        assert mirror.sync(local_client, collections=('bag',), source='local') == {'bag': 1}
+        assert mirror.sync(remote_client, collections=('bag',), source='remote') == {'bag': 1}
+        assert mirror.sync(remote_client, collections=('bag',), source='remote') == {'bag': 0}
+        local_client.close()
+        remote_client.close()
+    assert mirror.count('bag') == 2
+    assert mirror.last_updated_at('bag', 'local') == '2016-01-01T00:00:00Z'
+    assert mirror.last_updated_at('bag', 'remote') == '2015-01-01T00:00:00Z'
+    mirror.close()
+
+def test_interrupted_sync_keeps_watermark(tmpdir):
+    mirror = RegistryMirror(str(tmpdir.join('mirror.sqlite3')))
+    with FakeRegistry() as registry:
+        for i in range(25):
+            registry.add('bag', make_bag(i))
+        client = BaseClient(registry.url, registry.token)
+        list_page = client.bag_list
+        calls = []
+        def failing_bag_list(**kwargs):
+            calls.append(kwargs)
+            if len(calls) > 1:
+                raise IOError("connection reset")
+            return list_page(**kwargs)
+        client.bag_list = failing_bag_list
+        with raises(IOError):
+            mirror.sync(client, collections=('bag',), page_size=10)
+        assert mirror.last_updated_at('bag', registry.url) is None
+        client.bag_list = list_page
+        # The page written before the error isn't written again.
+        assert mirror.sync(client, collections=('bag',), page_size=10) == {'bag': 15}
+        client.close()
+    assert mirror.count('bag') == 25
+    mirror.close()
+
+def test_sync_gets_late_records_with_the_watermark_timestamp(tmpdir):
+    mirror = RegistryMirror(str(tmpdir.join('mirror.sqlite3')))
+    with FakeRegistry() as registry:
+        for i in range(5):
+            registry.add('bag', make_bag(i))
+        client = BaseClient(registry.url, registry.token)
+        mirror.sync(client, collections=('bag',))
+        # Committed late, with the same updated_at as the newest bag synced.
+        registry.add('bag', make_bag(4, uuid='bag-late'))
+        assert mirror.sync(client, collections=('bag',)) == {'bag': 1}
+        assert mirror.sync(client, collections=('bag',)) == {'bag': 0}
+        client.close()
+    assert mirror.get('bag', 'bag-late') is not None
+    mirror.close()
+
+def test_sync_gets_records_shifted_by_updates(tmpdir):
+    mirror = RegistryMirror(str(tmpdir.join('mirror.sqlite3')))
+    with FakeRegistry() as registry:
+        for i in range(25):
+            registry.add('bag', make_bag(i))
+        client = BaseClient(registry.url, registry.token)
+        list_page = client.bag_list
+        def updating_bag_list(**kwargs):
+            response = list_page(**kwargs)
+            # bag-0 is updated after the first page is read, which moves
+            # it to the end and every other bag up one place.
+            registry.add('bag', make_bag(0, updated_at='2015-01-02T00:00:00Z'))
+            return response
+        client.bag_list = updating_bag_list
+        mirror.sync(client, collections=('bag',), page_size=10)
+        client.close()
+        assert mirror.last_updated_at('bag', registry.url) == '2015-01-02T00:00:00Z'
+    assert mirror.count('bag') == 25
+    assert mirror.get('bag', 'bag-0')['updated_at'] == '2015-01-02T00:00:00Z'
+    mirror.close()
@@ -0,0 +1,118 @@
+import json
+import threading
+from pytest import raises
+from requests.exceptions import RequestException
+from . import paging
+
+class FakeResponse:
+    def __init__(self, data):
+        self.data = data
+        self.content = json.dumps(data).encode('utf-8')
+    def json(self):
+        return self.data
+    def iter_content(self, chunk_size=1):
+        # Tiny chunks, to exercise the incremental decoder.
+        for i in range(0, len(self.content), 7):
+            yield self.content[i:i + 7]
+    def close(self):
+        pass
+
+class FakeListEndpoint:
+    """
+    Serves records 0..count-1 in pages, like a DPN list endpoint.
+    """
+    def __init__(self, count, fail_on_page=None, max_page_size=None):
+        self.count = count
+        self.fail_on_page = fail_on_page
+        self.max_page_size = max_page_size
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def __call__(self, page=1, page_size=20, **kwargs):
+        with self.lock:
+            self.calls.append((page, page_size, kwargs))
+        if page == self.fail_on_page:
+            raise RequestException("page {0} failed".format(page))
+        if self.max_page_size is not None:
+            page_size = min(page_size, self.max_page_size)
+        start = (page - 1) * page_size
+        results = list(range(start, min(start + page_size, self.count)))
+        return FakeResponse({'count': self.count, 'results': results})
+
+def test_page_count():
+    assert paging.page_count(0, 10) == 1
+    assert paging.page_count(10, 10) == 1
+    assert paging.page_count(11, 10) == 2
+
+def test_fetch_all_returns_records_in_order():
+    endpoint = FakeListEndpoint(95)
+    records = paging.fetch_all(endpoint, page_size=10, max_workers=4,
+                               status='Requested')
+    assert records == list(range(95))
+    assert sorted(call[0] for call in endpoint.calls) == list(range(1, 11))
+    assert all(call[1] == 10 for call in endpoint.calls)
+    assert all(call[2] == {'status': 'Requested'} for call in endpoint.calls)
+
+def test_fetch_all_single_page():
+    endpoint = FakeListEndpoint(3)
+    assert paging.fetch_all(endpoint, page_size=10) == [0, 1, 2]
+    assert len(endpoint.calls) == 1
+
+def test_fetch_all_with_capped_page_size():
+    endpoint = FakeListEndpoint(95, max_page_size=10)
+    assert paging.fetch_all(endpoint, page_size=50, max_workers=4) == list(range(95))
+    assert len(endpoint.calls) == 10
+
+def test_fetch_all_picks_up_records_added_while_paging():
+    endpoint = FakeListEndpoint(25)
+    def list_method(page=1, page_size=20, **kwargs):
+        response = endpoint(page, page_size, **kwargs)
+        endpoint.count = 45
+        return response
+    assert paging.fetch_all(list_method, page_size=10, max_workers=1) == list(range(45))
+
+def test_fetch_all_raises_on_failed_page():
+    endpoint = FakeListEndpoint(50, fail_on_page=3)
+    with raises(RequestException):
+        paging.fetch_all(endpoint, page_size=10)
+
+def test_iter_records_yields_all_records_in_order():
+    endpoint = FakeListEndpoint(95)
+    records = paging.iter_records(endpoint, page_size=10, status='Requested')
+    assert list(records) == list(range(95))
+    assert sorted(call[0] for call in endpoint.calls) == list(range(1, 11))
+
+def test_iter_records_without_prefetch():
+    endpoint = FakeListEndpoint(25)
+    assert list(paging.iter_records(endpoint, page_size=10, prefetch=False)) == list(range(25))
+    assert [call[0] for call in endpoint.calls] == [1, 2, 3]
+
+def test_iter_records_is_lazy():
+    endpoint = FakeListEndpoint(1000)
+    records = paging.iter_records(endpoint, page_size=10, prefetch=False)
+    assert endpoint.calls == []
+    assert next(records) == 0
+    assert len(endpoint.calls) == 1
+    records.close()
+
+def test_iter_records_uses_next_link():
+    def list_method(page=1, page_size=10, **kwargs):
+        # Server reports a stale count, but no next page.
+        return FakeResponse({'count': 500, 'next': None, 'results': [1, 2]})
+    assert list(paging.iter_records(list_method)) == [1, 2]
+
+def test_iter_records_raises_on_failed_page():
+    endpoint = FakeListEndpoint(50, fail_on_page=2)
+    records = paging.iter_records(endpoint, page_size=10)
+    assert [next(records) for i in range(10)] == list(range(10))
+    with raises(RequestException):
+        next(records)
+
+def test_iter_records_incremental():
+    endpoint = FakeListEndpoint(25)
+    records = paging.iter_records(endpoint, page_size=10, incremental=True,
+                                  status='Requested')
+    assert list(records) == list(range(25))
+    assert [call[0] for call in endpoint.calls] == [1, 2, 3]
+    assert all(call[2] == {'status': 'Requested', 'stream': True}
+               for call in endpoint.calls)
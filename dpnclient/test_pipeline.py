@@ -0,0 +1,47 @@
+from .pipeline import Pipeline, Progress, STATE_FAILED, STATE_QUEUED
+
+class CountingPipeline(Pipeline):
+    final_states = ('done', STATE_FAILED)
+
+    def _add(self, progress):
+        progress.value += 1
+
+    def _check(self, progress):
+        if progress.value % 3 == 0:
+            raise ValueError("divisible by 3")
+        self._set_state(progress, 'done')
+
+    def run(self, count):
+        def feed(inbox):
+            for i in range(count):
+                progress = Progress('node')
+                progress.value = i
+                self._track(progress)
+                inbox.put(progress)
+        self._run_stages([(self._add, 2), (self._check, 2)], feed)
+        return self._summary()
+
+    def _summary(self):
+        items, counts, node_errors = super(CountingPipeline, self)._summary()
+        for item, progress in zip(items, self.progress):
+            item['value'] = progress.value
+        return items, counts, node_errors
+
+def test_items_go_through_every_stage():
+    pipeline = CountingPipeline(queue_size=1)
+    items, counts, node_errors = pipeline.run(9)
+    assert counts == {'done': 6, STATE_FAILED: 3}
+    assert node_errors == {}
+    for item in items:
+        assert item['elapsed'] >= 0
+        if item['state'] == STATE_FAILED:
+            assert item['error'] == "divisible by 3"
+            assert item['value'] % 3 == 0
+        else:
+            assert STATE_QUEUED in item['timings']
+
+def test_failing_callback_does_not_stop_the_pipeline():
+    def on_progress(progress):
+        raise RuntimeError("callback bug")
+    pipeline = CountingPipeline(queue_size=1, on_progress=on_progress)
+    assert pipeline.run(20)[1] == {'done': 14, STATE_FAILED: 6}
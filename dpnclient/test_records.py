@@ -0,0 +1,46 @@
+from .records import Bag, Node, Restore, Transfer, as_dict
+
+BAG = {
+    'uuid': 'e084c014-9ba1-41a3-9eb3-6daef8097bc5',
+    'local_id': 'my-bag',
+    'size': 1000,
+    'admin_node': 'aptrust',
+    'original_node': 'aptrust',
+    'replicating_nodes': ['tdr', 'sdr'],
+    'fixities': [{'algorithm': 'sha256', 'digest': 'abc'}],
+    'created_at': '2015-01-01T00:00:00Z',
+    'some_new_field': 'kept',
+}
+
+def test_bag_round_trip():
+    bag = Bag.from_dict(BAG)
+    assert bag.uuid == BAG['uuid']
+    assert bag.id == BAG['uuid']
+    assert bag.replicating_nodes == ('tdr', 'sdr')
+    assert bag.fixity('sha256') == 'abc'
+    assert bag.fixity('md5') is None
+    assert bag.extra == {'some_new_field': 'kept'}
+    assert bag.to_dict() == BAG
+
+def test_missing_fields_read_as_none():
+    transfer = Transfer.from_dict({'replication_id': '1'})
+    assert transfer.status is None
+    assert transfer.to_dict() == {'replication_id': '1'}
+    try:
+        transfer.not_a_field
+        assert False, "Expected AttributeError"
+    except AttributeError:
+        pass
+
+def test_records_are_slotted_and_interned():
+    one = Transfer.from_dict({'replication_id': '1', 'status': ''.join(['Req', 'uested'])})
+    two = Transfer.from_dict({'replication_id': '2', 'status': ''.join(['Requ', 'ested'])})
+    assert one.status is two.status
+    assert not hasattr(one, '__dict__')
+
+def test_constructor_and_as_dict():
+    restore = Restore(restore_id='r1', status='Requested', custom=1)
+    assert as_dict(restore) == {'restore_id': 'r1', 'status': 'Requested', 'custom': 1}
+    assert as_dict({'a': 1}) == {'a': 1}
+    assert Node(namespace='tdr') == Node.from_dict({'namespace': 'tdr'})
+    assert Node(namespace='tdr') != Node(namespace='sdr')
@@ -0,0 +1,119 @@
+import threading
+from requests.exceptions import RequestException
+from . import replication
+from . import scheduler
+from . import util
+from .test_bagit import PAYLOAD, make_bag_tar
+
+class FakeClient:
+    def __init__(self, xfer_requests, max_xfer_size=0):
+        self.xfer_requests = xfer_requests
+        self.max_xfer_size = max_xfer_size
+        self.replicate_from = [{'namespace': ns} for ns in xfer_requests]
+        self.receipts = []
+        self.rejected = []
+        self.lock = threading.Lock()
+
+    def get_transfer_requests(self, namespace):
+        if self.xfer_requests[namespace] is None:
+            raise RequestException("node is down")
+        return self.xfer_requests[namespace]
+
+    def set_transfer_fixity(self, namespace, replication_id, fixity):
+        with self.lock:
+            self.receipts.append((namespace, replication_id, fixity))
+
+    def reject_transfer_request(self, namespace, replication_id):
+        with self.lock:
+            self.rejected.append((namespace, replication_id))
+
+def xfer_request(replication_id, size=10):
+    return {'replication_id': replication_id, 'uuid': replication_id,
+            'size': size, 'link': 'dpn.test@example.com:outbound/{0}.tar'.format(replication_id)}
+
+def fake_downloader(tmpdir):
+    def download(xfer_request, inbound_dir):
+        if xfer_request['replication_id'] == 'broken':
+            raise IOError("download failed")
+        path = tmpdir.join(xfer_request['replication_id'] + '.tar')
+        path.write(xfer_request['replication_id'])
+        return str(path), None
+    return download
+
+def test_engine_replicates_all_bags(tmpdir):
+    client = FakeClient({'tdr': [xfer_request('a'), xfer_request('b')],
+                         'sdr': [xfer_request('c')]})
+    states = []
+    engine = replication.ReplicationEngine(
+        client, str(tmpdir), download_workers=2, fixity_workers=1,
+        receipt_workers=2, queue_size=1, downloader=fake_downloader(tmpdir),
+        on_progress=lambda progress: states.append(progress.state))
+    report = engine.run()
+    assert report['counts'] == {replication.STATE_DONE: 3}
+    assert report['bytes_replicated'] == 30
+    expected = sorted((ns, rid, util.digest(str(tmpdir.join(rid + '.tar')), 'sha256'))
+                      for ns, rid in (('tdr', 'a'), ('tdr', 'b'), ('sdr', 'c')))
+    assert sorted(client.receipts) == expected
+    assert states.count(replication.STATE_DONE) == 3
+    assert replication.STATE_HASHING in states
+
+def test_engine_reports_failures_and_skips(tmpdir):
+    client = FakeClient({'tdr': [xfer_request('ok'), xfer_request('broken'),
+                                 xfer_request('huge', size=1000)],
+                         'sdr': None},
+                        max_xfer_size=100)
+    engine = replication.ReplicationEngine(client, str(tmpdir),
+                                           downloader=fake_downloader(tmpdir),
+                                           reject_oversize=True)
+    report = engine.run()
+    assert report['counts'] == {replication.STATE_DONE: 1,
+                                replication.STATE_FAILED: 1,
+                                replication.STATE_SKIPPED: 1}
+    assert [r[1] for r in client.receipts] == ['ok']
+    assert client.rejected == [('tdr', 'huge')]
+    assert 'sdr' in report['node_errors']
+    bags = dict((bag['replication_id'], bag) for bag in report['bags'])
+    assert 'download failed' in bags['broken']['error']
+
+def test_engine_with_scheduler(tmpdir):
+    client = FakeClient({'tdr': [xfer_request('big', size=5000), xfer_request('a'),
+                                 xfer_request('toobig', size=10 ** 18)],
+                         'sdr': [xfer_request('b'), xfer_request('c')]})
+    started = []
+    def downloader(xfer_request, inbound_dir):
+        started.append(xfer_request['replication_id'])
+        return fake_downloader(tmpdir)(xfer_request, inbound_dir)
+    engine = replication.ReplicationEngine(
+        client, str(tmpdir), download_workers=1, downloader=downloader,
+        scheduler=scheduler.TransferScheduler(str(tmpdir), max_active=1))
+    report = engine.run()
+    assert report['counts'] == {replication.STATE_DONE: 4, replication.STATE_SKIPPED: 1}
+    assert started[-1] == 'big'
+    assert 'free space' in [bag for bag in report['bags']
+                            if bag['replication_id'] == 'toobig'][0]['error']
+
+def test_engine_validates_bags(tmpdir):
+    inbound = tmpdir.mkdir('inbound')
+    good = make_bag_tar(str(inbound.join('good.tar')))
+    bad = make_bag_tar(str(inbound.join('bad.tar')), manifest=dict(
+        PAYLOAD, **{'data/hello.txt': b'tampered'}))
+    paths = {'good': good, 'bad': bad}
+    client = FakeClient({'tdr': [xfer_request('good'), xfer_request('bad')]})
+    engine = replication.ReplicationEngine(
+        client, str(inbound), validate_bags=True,
+        downloader=lambda xfer_request, inbound_dir: (paths[xfer_request['replication_id']], None))
+    report = engine.run()
+    assert report['counts'] == {replication.STATE_DONE: 1, replication.STATE_FAILED: 1}
+    assert client.receipts == [('tdr', 'good', util.digest(good, 'sha256'))]
+
+def test_engine_survives_failing_callback(tmpdir):
+    client = FakeClient({'tdr': [xfer_request(str(i)) for i in range(6)] +
+                                [xfer_request('broken')]})
+    def on_progress(progress):
+        raise RuntimeError("callback bug")
+    engine = replication.ReplicationEngine(
+        client, str(tmpdir), download_workers=1, fixity_workers=1,
+        receipt_workers=1, queue_size=1, downloader=fake_downloader(tmpdir),
+        on_progress=on_progress)
+    report = engine.run()
+    assert report['counts'] == {replication.STATE_DONE: 6, replication.STATE_FAILED: 1}
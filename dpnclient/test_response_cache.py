@@ -0,0 +1,82 @@
+import glob
+import requests
+from .response_cache import ResponseCache, ShelveStore
+
+def make_response(content=b'{}', headers=None):
+    response = requests.Response()
+    response.status_code = 200
+    response._content = content
+    response.headers.update(headers or {})
+    return response
+
+def test_get_put_invalidate():
+    cache = ResponseCache()
+    assert cache.get('a') is None
+    response = make_response()
+    cache.put('a', response)
+    entry = cache.get('a')
+    assert entry.response is response
+    assert cache.is_fresh(entry)
+    cache.invalidate('a')
+    assert cache.get('a') is None
+    assert cache.total_bytes == 0
+
+def test_ttl():
+    cache = ResponseCache(ttl=60)
+    entry = cache.put('a', make_response())
+    entry.stored_at -= 61
+    assert not cache.is_fresh(cache.get('a'))
+    assert cache.revalidate('a', entry)
+    assert cache.is_fresh(cache.get('a'))
+    cache.invalidate('a')
+    assert not cache.revalidate('a', entry)
+    assert cache.get('a') is None
+
+def test_lru_eviction_by_count_and_size():
+    cache = ResponseCache(max_entries=2, max_bytes=10)
+    cache.put('a', make_response(b'1234'))
+    cache.put('b', make_response(b'1234'))
+    cache.get('a')
+    cache.put('c', make_response(b'1234'))
+    assert cache.get('b') is None
+    assert cache.get('a') is not None
+    cache.put('d', make_response(b'123456789'))
+    assert len(cache) == 1
+    assert cache.total_bytes == 9
+
+def test_validators():
+    cache = ResponseCache()
+    entry = cache.put('a', make_response(headers={'ETag': '"v1"',
+                                                  'Last-Modified': 'yesterday'}))
+    assert entry.validators() == {'If-None-Match': '"v1"',
+                                  'If-Modified-Since': 'yesterday'}
+    assert cache.put('b', make_response()).validators() == {}
+
+def test_persistent_store(tmpdir):
+    path = str(tmpdir.join('responses'))
+    store = ShelveStore(path)
+    ResponseCache(store=store).put('a', make_response(b'{"uuid": "1"}'))
+    store.close()
+    store = ShelveStore(path)
+    entry = ResponseCache(store=store).get('a')
+    assert entry.response.json() == {'uuid': '1'}
+    store.close()
+
+def test_persistent_store_leaves_out_the_request(tmpdir):
+    path = str(tmpdir.join('responses'))
+    store = ShelveStore(path)
+    response = make_response(b'{"uuid": "1"}', {'ETag': '"v1"'})
+    response.url = 'https://dpn.example.com/api-v1/bag/1/'
+    response.request = requests.Request(
+        'GET', response.url, headers={'Authorization': 'token secret-token'}).prepare()
+    ResponseCache(store=store).put('a', response)
+    store.close()
+    for name in glob.glob(path + '*'):
+        with open(name, 'rb') as f:
+            assert b'secret-token' not in f.read()
+    store = ShelveStore(path)
+    entry = store.get('a')
+    assert entry.response.url == response.url
+    assert entry.response.headers['ETag'] == '"v1"'
+    assert entry.validators() == {'If-None-Match': '"v1"'}
+    store.close()
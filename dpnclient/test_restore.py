@@ -0,0 +1,132 @@
+import os
+from pytest import raises
+from . import const
+from .fake_registry import FakeRegistry
+from .restore import RestoreEngine, stage_bag, STATE_DONE, STATE_FAILED
+from .test_client import ClientTestSettings, registry_client
+
+BAG_UUID = '6b5b8ed4-0e37-4b2c-9d4f-bb5d0a8e2a10'
+
+def test_stage_bag(tmpdir):
+    storage = tmpdir.mkdir('storage')
+    outbound = tmpdir.mkdir('outbound')
+    storage.join(BAG_UUID + '.tar').write_binary(b'x' * 1000)
+    restore_request = {'restore_id': '1', 'uuid': BAG_UUID, 'to_node': 'chron'}
+    link = stage_bag(restore_request, str(storage), str(outbound), 'dpn.example.com')
+    dst = os.path.join(str(outbound), BAG_UUID + '.tar')
+    assert link == 'dpn.chron@dpn.example.com:' + dst
+    assert open(dst, 'rb').read() == b'x' * 1000
+    # Staging again reuses the staged tar.
+    assert stage_bag(restore_request, str(storage), str(outbound),
+                     'dpn.example.com') == link
+    assert not os.path.exists(dst + '.partial')
+
+def test_stage_bag_requires_to_node(tmpdir):
+    storage = tmpdir.mkdir('storage')
+    storage.join(BAG_UUID + '.tar').write_binary(b'x')
+    restore_request = {'restore_id': '1', 'uuid': BAG_UUID, 'to_node': None}
+    with raises(ValueError):
+        stage_bag(restore_request, str(storage), str(tmpdir.mkdir('outbound')),
+                  'dpn.example.com')
+
+def test_engine_requires_a_stager():
+    with raises(ValueError):
+        RestoreEngine(object())
+
+def test_fulfill_restore_requests(tmpdir):
+    storage = tmpdir.mkdir('storage')
+    settings = ClientTestSettings()
+    settings.OUTBOUND_DIR = str(tmpdir.mkdir('outbound'))
+    with FakeRegistry() as registry, FakeRegistry(token='remote-token') as remote:
+        for i in range(12):
+            obj_id = '{0}-{1}'.format(BAG_UUID[:-3], 100 + i)
+            storage.join(obj_id + '.tar').write_binary(b'bag')
+            remote.add('restore', {'restore_id': str(i), 'uuid': obj_id,
+                                   'from_node': 'example' if i != 5 else 'other',
+                                   'to_node': 'remote',
+                                   'status': const.STATUS_REQUESTED})
+        # Not in storage, so staging fails.
+        remote.add('restore', {'restore_id': 'missing', 'uuid': BAG_UUID,
+                               'from_node': 'example', 'to_node': 'remote',
+                               'status': const.STATUS_REQUESTED})
+        # No node to send the bag to, so it's never accepted.
+        remote.add('restore', {'restore_id': 'nowhere', 'uuid': BAG_UUID,
+                               'from_node': 'example', 'to_node': None,
+                               'status': const.STATUS_REQUESTED})
+        client = registry_client(registry, remote, settings)
+        seen = []
+        report = client.fulfill_restore_requests(
+            storage_dir=str(storage), stage_workers=3, update_workers=3,
+            on_progress=lambda progress: seen.append(progress.state))
+        assert report['counts'] == {STATE_DONE: 11, STATE_FAILED: 2}
+        assert report['node_errors'] == {}
+        for restore in report['restores']:
+            assert restore['elapsed'] >= 0
+            if restore['restore_id'] == 'nowhere':
+                assert 'to_node' in restore['error']
+                assert remote.get('restore', 'nowhere')['status'] == const.STATUS_REQUESTED
+                continue
+            if restore['restore_id'] == 'missing':
+                assert restore['error']
+                # Accepted before staging failed.
+                assert remote.get('restore', 'missing')['status'] == const.STATUS_ACCEPTED
+                continue
+            record = remote.get('restore', restore['restore_id'])
+            assert record['status'] == const.STATUS_FINISHED
+            assert record['link'] == restore['link']
+            assert record['link'].startswith('dpn.remote@dpn.example.com:')
+            assert 'staging' in restore['timings']
+        assert remote.get('restore', '5')['status'] == const.STATUS_REQUESTED
+        assert 'finishing' in seen
+        client.close()
+
+def test_finish_false_leaves_restores_prepared():
+    class FakeClient:
+        restore_from = [{'namespace': 'remote'}]
+        def __init__(self):
+            self.updates = []
+        def get_restore_requests(self, namespace):
+            return [{'restore_id': str(i), 'uuid': str(i), 'to_node': 'remote'}
+                    for i in range(3)]
+        def update_restore_request(self, namespace, restore_id, status, link=None):
+            self.updates.append((restore_id, status, link))
+    client = FakeClient()
+    engine = RestoreEngine(client, stager=lambda r: 'link-' + r['uuid'], finish=False)
+    report = engine.run()
+    assert report['counts'] == {STATE_DONE: 3}
+    for i in range(3):
+        assert [update for update in client.updates if update[0] == str(i)] == [
+            (str(i), const.STATUS_ACCEPTED, None),
+            (str(i), const.STATUS_PREPARED, 'link-' + str(i)),
+        ]
+
+def test_failed_accept_is_not_prepared():
+    class FakeClient:
+        def __init__(self):
+            self.updates = []
+        def get_restore_requests(self, namespace):
+            if namespace == 'down':
+                raise IOError("connection refused")
+            return [{'restore_id': '1', 'uuid': 'a', 'to_node': 'remote'}]
+        def update_restore_request(self, namespace, restore_id, status, link=None):
+            if status == const.STATUS_ACCEPTED:
+                raise IOError("409 Conflict")
+            self.updates.append((restore_id, status))
+    client = FakeClient()
+    report = RestoreEngine(client, stager=lambda r: 'link').run(['down', 'remote'])
+    assert report['counts'] == {STATE_FAILED: 1}
+    assert report['node_errors'] == {'down': 'connection refused'}
+    assert client.updates == []
+
+def test_engine_survives_failing_callback():
+    class FakeClient:
+        def get_restore_requests(self, namespace):
+            return [{'restore_id': str(i), 'uuid': str(i), 'to_node': 'remote'}
+                    for i in range(6)]
+        def update_restore_request(self, namespace, restore_id, status, link=None):
+            pass
+    def on_progress(progress):
+        raise RuntimeError("callback bug")
+    engine = RestoreEngine(FakeClient(), stager=lambda r: 'link', stage_workers=1,
+                           update_workers=1, queue_size=1, on_progress=on_progress)
+    assert engine.run(['remote'])['counts'] == {STATE_DONE: 6}
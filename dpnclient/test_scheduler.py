@@ -0,0 +1,70 @@
+from pytest import raises
+from .scheduler import TransferScheduler
+
+GB = 1024 ** 3
+
+def xfer(replication_id, size, created_at='2015-01-01T00:00:00Z'):
+    return {'replication_id': replication_id, 'size': size, 'created_at': created_at}
+
+def make_scheduler(tmpdir, free=100 * GB, **kwargs):
+    scheduler = TransferScheduler(str(tmpdir), **kwargs)
+    scheduler.free_space = lambda: free
+    return scheduler
+
+def ids(admitted):
+    return [xfer_request['replication_id'] for namespace, xfer_request in admitted]
+
+def test_small_bags_packed_around_large_one(tmpdir):
+    scheduler = make_scheduler(tmpdir, max_active=3, default_partner_limit=3,
+                               large_bag_size=10 * GB, max_large=1)
+    for name, size in (('huge1', 50 * GB), ('huge2', 40 * GB),
+                       ('small1', GB), ('small2', 2 * GB), ('small3', 3 * GB)):
+        scheduler.add('tdr', xfer(name, size))
+    now = 1420070400  # 2015-01-01, so no request has aged.
+    assert ids(scheduler.admit(now)) == ['small1', 'small2', 'small3']
+    scheduler.release('tdr', xfer('small1', GB))
+    # Only one large bag at a time, and the smaller one first.
+    assert ids(scheduler.admit(now)) == ['huge2']
+    scheduler.release('tdr', xfer('small2', 2 * GB))
+    assert scheduler.admit(now) == []
+    scheduler.release('tdr', xfer('huge2', 40 * GB))
+    assert ids(scheduler.admit(now)) == ['huge1']
+
+def test_aging_moves_old_requests_forward(tmpdir):
+    scheduler = make_scheduler(tmpdir, max_active=1, aging_period=60)
+    scheduler.add('tdr', xfer('new-small', GB, '2015-01-01T10:00:00Z'))
+    scheduler.add('tdr', xfer('old-big', 5 * GB, '2015-01-01T00:00:00Z'))
+    assert ids(scheduler.admit(1420106400)) == ['old-big']
+
+def test_partner_limits(tmpdir):
+    scheduler = make_scheduler(tmpdir, max_active=10, default_partner_limit=1,
+                               partner_limits={'sdr': 2})
+    for i in range(3):
+        scheduler.add('tdr', xfer('tdr{0}'.format(i), GB))
+        scheduler.add('sdr', xfer('sdr{0}'.format(i), GB))
+    admitted = scheduler.admit()
+    assert sorted(ids(admitted)) == ['sdr0', 'sdr1', 'tdr0']
+    assert scheduler.active_count() == 3
+    assert scheduler.pending_count() == 3
+
+def test_caps_must_allow_a_transfer(tmpdir):
+    for kwargs in ({'max_active': 0}, {'default_partner_limit': 0},
+                   {'max_large': 0}, {'partner_limits': {'tdr': 2, 'sdr': 0}}):
+        with raises(ValueError):
+            TransferScheduler(str(tmpdir), **kwargs)
+
+def test_free_space_and_bandwidth(tmpdir):
+    scheduler = make_scheduler(tmpdir, free=10 * GB, max_active=10,
+                               default_partner_limit=10, min_free_space=GB,
+                               bandwidth=100, min_rate=50, large_bag_size=100 * GB)
+    assert scheduler.slots == 2
+    for name, size in (('a', 4 * GB), ('b', 4 * GB), ('c', 20 * GB)):
+        scheduler.add('tdr', xfer(name, size))
+    # 9 GB usable: a and b fit, but together they leave no room for more.
+    assert ids(scheduler.admit()) == ['a', 'b']
+    assert scheduler.unstartable() == []
+    scheduler.release('tdr', xfer('a', 4 * GB))
+    scheduler.release('tdr', xfer('b', 4 * GB))
+    assert scheduler.admit() == []
+    assert ids(scheduler.unstartable()) == ['c']
+    assert scheduler.pending_count() == 0
@@ -0,0 +1,168 @@
+import hashlib
+import threading
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from pytest import raises
+from requests.exceptions import RequestException
+from . import transfer
+
+BAG_CONTENT = b"0123456789abcdef" * 100000
+
+class BagHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path != '/outbound/bag.tar':
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(BAG_CONTENT)))
+        self.end_headers()
+        self.wfile.write(BAG_CONTENT)
+
+    def log_message(self, *args):
+        pass
+
+class RangeHandler(BaseHTTPRequestHandler):
+    """
+    Serves BAG_CONTENT with Range support, dropping the connection after
+    cut_after bytes of body if that's set.
+    """
+    ranges = []
+    if_ranges = []
+    cut_after = None
+    honor_range = True
+    # Added to the start of the range actually sent, to fake a bad server.
+    range_error = 0
+    last_modified = None
+
+    def do_GET(self):
+        start = 0
+        header = self.headers.get('Range')
+        self.ranges.append(header)
+        self.if_ranges.append(self.headers.get('If-Range'))
+        if header and self.honor_range:
+            start = int(header.split('=')[1].rstrip('-')) + self.range_error
+            self.send_response(206)
+            self.send_header('Content-Range', 'bytes {0}-{1}/{2}'.format(
+                start, len(BAG_CONTENT) - 1, len(BAG_CONTENT)))
+        else:
+            self.send_response(200)
+        body = BAG_CONTENT[start:]
+        self.send_header('Content-Length', str(len(body)))
+        if self.last_modified:
+            self.send_header('Last-Modified', self.last_modified)
+        self.end_headers()
+        if self.cut_after is not None:
+            body = body[:self.cut_after]
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+def serve(handler=BagHandler):
+    server = HTTPServer(('127.0.0.1', 0), handler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server, "http://127.0.0.1:{0}".format(server.server_address[1])
+
+def test_local_path():
+    assert transfer.local_path("dpn.tdr@example.com:outbound/1234.tar", "/in") == "/in/1234.tar"
+    assert transfer.local_path("https://example.com/outbound/1234.tar?x=1", "/in") == "/in/1234.tar"
+
+def test_https_copy_hashes_while_downloading(tmpdir):
+    server, root = serve()
+    try:
+        dst = str(tmpdir.join('bag.tar'))
+        digest = transfer.https_copy(root + '/outbound/bag.tar', dst, chunk_size=4096)
+        assert digest == hashlib.sha256(BAG_CONTENT).hexdigest()
+        assert open(dst, 'rb').read() == BAG_CONTENT
+        assert not tmpdir.join('bag.tar.partial').exists()
+        with raises(RequestException):
+            transfer.https_copy(root + '/outbound/missing.tar', dst)
+    finally:
+        server.shutdown()
+
+def test_download_uses_https_for_http_links(tmpdir):
+    server, root = serve()
+    try:
+        xfer_request = {'link': root + '/outbound/bag.tar', 'protocol': 'H'}
+        path, fixity = transfer.download(xfer_request, str(tmpdir))
+        assert path == str(tmpdir.join('bag.tar'))
+        assert fixity == hashlib.sha256(BAG_CONTENT).hexdigest()
+    finally:
+        server.shutdown()
+
+def test_https_copy_resumes_after_last_good_chunk(tmpdir):
+    class Handler(RangeHandler):
+        ranges = []
+        cut_after = 250000
+    server, root = serve(Handler)
+    url = root + '/outbound/bag.tar'
+    dst = str(tmpdir.join('bag.tar'))
+    partial = tmpdir.join('bag.tar.partial')
+    expected = hashlib.sha256(BAG_CONTENT).hexdigest()
+    try:
+        with raises(RequestException):
+            transfer.https_copy(url, dst, chunk_size=4096, manifest_chunk_size=100000)
+        manifest = transfer.ChunkManifest.load(str(partial) + '.manifest')
+        assert len(manifest.digests) == 2
+        Handler.cut_after = None
+        assert transfer.https_copy(url, dst, chunk_size=4096, manifest_chunk_size=100000) == expected
+        assert Handler.ranges == [None, 'bytes=200000-']
+        assert open(dst, 'rb').read() == BAG_CONTENT
+        assert not partial.exists()
+        assert not tmpdir.join('bag.tar.partial.manifest').exists()
+
+        # A corrupt chunk is downloaded again.
+        Handler.cut_after = 350000
+        with raises(RequestException):
+            transfer.https_copy(url, dst, chunk_size=4096, manifest_chunk_size=100000)
+        data = bytearray(partial.read_binary())
+        data[150000] ^= 0xff
+        partial.write_binary(bytes(data))
+        Handler.cut_after = None
+        assert transfer.https_copy(url, dst, chunk_size=4096, manifest_chunk_size=100000) == expected
+        assert Handler.ranges[-1] == 'bytes=100000-'
+    finally:
+        server.shutdown()
+
+def test_https_copy_starts_over_without_range_support(tmpdir):
+    class Handler(RangeHandler):
+        ranges = []
+        cut_after = 250000
+        honor_range = False
+    server, root = serve(Handler)
+    url = root + '/outbound/bag.tar'
+    dst = str(tmpdir.join('bag.tar'))
+    try:
+        with raises(RequestException):
+            transfer.https_copy(url, dst, chunk_size=4096, manifest_chunk_size=100000)
+        Handler.cut_after = None
+        digest = transfer.https_copy(url, dst, chunk_size=4096, manifest_chunk_size=100000)
+        assert digest == hashlib.sha256(BAG_CONTENT).hexdigest()
+        assert Handler.ranges == [None, 'bytes=200000-']
+        assert open(dst, 'rb').read() == BAG_CONTENT
+    finally:
+        server.shutdown()
+
+def test_https_copy_checks_content_range(tmpdir):
+    class Handler(RangeHandler):
+        ranges = []
+        if_ranges = []
+        cut_after = 250000
+        range_error = -1000
+        last_modified = 'Wed, 21 Oct 2015 07:28:00 GMT'
+    server, root = serve(Handler)
+    url = root + '/outbound/bag.tar'
+    dst = str(tmpdir.join('bag.tar'))
+    try:
+        with raises(RequestException):
+            transfer.https_copy(url, dst, chunk_size=4096, manifest_chunk_size=100000)
+        Handler.cut_after = None
+        digest = transfer.https_copy(url, dst, chunk_size=4096, manifest_chunk_size=100000)
+        assert digest == hashlib.sha256(BAG_CONTENT).hexdigest()
+        # The misplaced range was thrown away and the file fetched whole.
+        assert Handler.ranges == [None, 'bytes=200000-', None]
+        assert Handler.if_ranges[1] == Handler.last_modified
+        assert open(dst, 'rb').read() == BAG_CONTENT
+    finally:
+        server.shutdown()
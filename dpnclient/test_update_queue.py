@@ -0,0 +1,192 @@
+import json
+import os
+import threading
+import requests
+import time
+from pytest import raises
+from requests.exceptions import RequestException
+from . import const
+from .update_queue import TransferUpdateQueue
+
+class FakeResponse:
+    def __init__(self, data, status_code=200):
+        self.data = data
+        self.status_code = status_code
+        self.content = json.dumps(data).encode('utf-8')
+    def json(self):
+        return self.data
+
+class FakeRemote:
+    def __init__(self, namespace, sent, fail=None, attempts=None):
+        self.namespace = namespace
+        self.sent = sent
+        self.fail = fail
+        self.attempts = attempts if attempts is not None else []
+    def transfer_update(self, data):
+        self.attempts.append(data['replication_id'])
+        if self.fail is not None:
+            raise self.fail
+        self.sent.append((self.namespace, data))
+        return FakeResponse(data)
+
+class FakeClient:
+    def __init__(self):
+        self.sent = []
+        self.fail = {}
+        self.attempts = []
+    def remote_client(self, namespace):
+        return FakeRemote(namespace, self.sent, self.fail.get(namespace), self.attempts)
+
+def http_error(status_code):
+    err = RequestException("HTTP {0}".format(status_code))
+    err.response = FakeResponse({}, status_code)
+    return err
+
+def test_updates_are_merged():
+    client = FakeClient()
+    queue = TransferUpdateQueue(client, max_delay=60)
+    queue.set_transfer_fixity('aptrust', 'r1', 'aaa')
+    queue.set_transfer_fixity('aptrust', 'r1', 'bbb')
+    queue.reject_transfer_request('aptrust', 'r1')
+    queue.set_transfer_fixity('chron', 'r1', 'ccc')
+    assert len(queue) == 2
+    results = queue.flush()
+    assert len(results) == 2
+    assert all(result['error'] is None for result in results)
+    assert sorted(client.sent) == [
+        ('aptrust', {'replication_id': 'r1', 'fixity_value': 'bbb',
+                     'status': const.STATUS_REJECTED}),
+        ('chron', {'replication_id': 'r1', 'fixity_value': 'ccc'}),
+    ]
+    queue.close()
+
+def test_size_trigger():
+    client = FakeClient()
+    queue = TransferUpdateQueue(client, max_pending=3, max_delay=60)
+    for i in range(3):
+        queue.set_transfer_fixity('aptrust', 'r{0}'.format(i), 'abc')
+    deadline = time.time() + 5
+    while len(client.sent) < 3 and time.time() < deadline:
+        time.sleep(0.01)
+    assert len(client.sent) == 3
+    queue.close()
+
+def test_time_trigger():
+    client = FakeClient()
+    queue = TransferUpdateQueue(client, max_delay=0.05)
+    queue.set_transfer_fixity('aptrust', 'r1', 'abc')
+    deadline = time.time() + 5
+    while not client.sent and time.time() < deadline:
+        time.sleep(0.01)
+    assert client.sent == [('aptrust', {'replication_id': 'r1', 'fixity_value': 'abc'})]
+    queue.close()
+
+def test_close_flushes():
+    client = FakeClient()
+    with TransferUpdateQueue(client, max_delay=60) as queue:
+        queue.reject_transfer_request('aptrust', 'r1')
+        assert client.sent == []
+    assert client.sent == [('aptrust', {'replication_id': 'r1',
+                                        'status': const.STATUS_REJECTED})]
+
+def test_failed_updates_are_retried():
+    client = FakeClient()
+    client.fail['aptrust'] = http_error(503)
+    client.fail['chron'] = http_error(400)
+    queue = TransferUpdateQueue(client, max_delay=60)
+    queue.set_transfer_fixity('aptrust', 'r1', 'abc')
+    queue.set_transfer_fixity('chron', 'r2', 'abc')
+    results = queue.flush()
+    assert all(result['error'] is not None for result in results)
+    # The 503 is kept; the 400 is dropped.
+    assert len(queue) == 1
+    del client.fail['aptrust']
+    queue.close()
+    assert client.sent == [('aptrust', {'replication_id': 'r1', 'fixity_value': 'abc'})]
+
+def test_retries_back_off_while_node_is_down():
+    client = FakeClient()
+    client.fail['aptrust'] = requests.exceptions.ConnectionError("down")
+    queue = TransferUpdateQueue(client, max_pending=3, max_delay=0.2)
+    for i in range(3):
+        queue.set_transfer_fixity('aptrust', 'r{0}'.format(i), 'abc')
+    time.sleep(0.5)
+    # One attempt per update per max_delay, not a tight loop.
+    assert 3 <= len(client.attempts) <= 12
+    del client.fail['aptrust']
+    queue.close()
+    assert len(client.sent) == 3
+
+def test_other_errors_are_final():
+    client = FakeClient()
+    client.fail['aptrust'] = TypeError("bad data")
+    client.fail['chron'] = RequestException("no response")
+    queue = TransferUpdateQueue(client, max_delay=60)
+    queue.set_transfer_fixity('aptrust', 'r1', 'abc')
+    queue.set_transfer_fixity('chron', 'r2', 'abc')
+    results = queue.flush()
+    assert all(result['error'] is not None for result in results)
+    assert len(queue) == 0
+    queue.close()
+
+def test_background_failures_are_reported():
+    client = FakeClient()
+    client.fail['aptrust'] = http_error(400)
+    errors = []
+    queue = TransferUpdateQueue(client, max_delay=0.01, on_error=errors.append)
+    queue.set_transfer_fixity('aptrust', 'r1', 'abc')
+    deadline = time.time() + 5
+    while not errors and time.time() < deadline:
+        time.sleep(0.01)
+    queue.close()
+    assert [(job['replication_id'], job['error'].response.status_code)
+            for job in errors] == [('r1', 400)]
+
+    queue = TransferUpdateQueue(client, max_delay=0.01)
+    queue.set_transfer_fixity('aptrust', 'r2', 'abc')
+    queue.close()
+    assert [job['replication_id'] for job in queue.failed] == ['r2']
+
+def test_put_after_close_fails():
+    queue = TransferUpdateQueue(FakeClient())
+    queue.close()
+    with raises(ValueError):
+        queue.set_transfer_fixity('aptrust', 'r1', 'abc')
+
+def test_journal_is_replayed(tmpdir):
+    path = str(tmpdir.join('updates.jsonl'))
+    client = FakeClient()
+    client.fail['aptrust'] = ConnectionError("down")
+    queue = TransferUpdateQueue(client, journal_path=path, max_delay=60)
+    queue.set_transfer_fixity('aptrust', 'r1', 'abc')
+    queue.reject_transfer_request('aptrust', 'r1')
+    queue.close()
+    assert client.sent == []
+    assert os.path.exists(path)
+
+    # A half-written line, as if the process died mid-write.
+    with open(path, 'a') as f:
+        f.write('{"namespace": "apt')
+
+    client = FakeClient()
+    queue = TransferUpdateQueue(client, journal_path=path, max_delay=60)
+    assert len(queue) == 1
+    queue.close()
+    assert client.sent == [('aptrust', {'replication_id': 'r1', 'fixity_value': 'abc',
+                                        'status': const.STATUS_REJECTED})]
+    with open(path) as f:
+        assert f.read() == ''
+
+def test_concurrent_puts():
+    client = FakeClient()
+    queue = TransferUpdateQueue(client, max_pending=10, max_delay=0.01)
+    def worker(n):
+        for i in range(50):
+            queue.set_transfer_fixity('aptrust', '{0}-{1}'.format(n, i), 'abc')
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    queue.close()
+    assert len(client.sent) == 200
@@ -49,3 +49,29 @@ def test_digest():
     # Should raise exception if we don't implement the requested algorithm.
     with raises(ValueError):
         util.digest(filepath, 'md6')
+
+def test_digests():
+    filepath = os.path.abspath(os.path.join(__file__, '..', 'testdata', 'checksum.txt'))
+    expected = {
+        'md5': '772bdaf5340fd975bb294806d340f6d9',
+        'sha256': 'c8843be4c9d672ae91542f5539e770c6eadc5465161e4ffa5389ecef460f553f',
+    }
+    assert util.digests(filepath, ['md5', 'sha256']) == expected
+    # Small blocks should give the same result as one big read.
+    assert util.digests(filepath, ['md5', 'sha256'], block_size=7) == expected
+    with raises(ValueError):
+        util.digests(filepath, ['sha256', 'md6'])
+
+def test_digest_files(tmpdir):
+    paths = []
+    for i in range(5):
+        path = tmpdir.join("file{0}.txt".format(i))
+        path.write("file number {0}".format(i) * 1000)
+        paths.append(str(path))
+    results = util.digest_files(paths, ['md5', 'sha256'], max_workers=3)
+    assert sorted(results.keys()) == sorted(paths)
+    for path in paths:
+        assert results[path]['sha256'] == util.digest(path, 'sha256')
+        assert results[path]['md5'] == util.digest(path, 'md5')
+    with raises(ValueError):
+        util.digest_files(paths, ['md6'])
@@ -0,0 +1,39 @@
+from .watermarks import WatermarkStore
+
+def test_get_save_and_reload(tmpdir):
+    path = str(tmpdir.join('watermarks.sqlite3'))
+    store = WatermarkStore(path)
+    assert store.get('chron', 'transfer_list') is None
+    assert store.snapshot('chron', 'transfer_list') == {}
+    store.save('chron', 'transfer_list', '2015-01-01T00:00:00Z', {'a': '2015-01-01T00:00:00Z'})
+    store.save('chron', 'transfer_list', None, {'b': '2014-12-31T00:00:00Z'})
+    store.close()
+    store = WatermarkStore(path)
+    assert store.get('chron', 'transfer_list') == '2015-01-01T00:00:00Z'
+    assert store.snapshot('chron', 'transfer_list') == {
+        'a': '2015-01-01T00:00:00Z', 'b': '2014-12-31T00:00:00Z'}
+    assert store.get('sdr', 'transfer_list') is None
+    store.close()
+
+def test_replace_snapshot_and_reset():
+    store = WatermarkStore(':memory:')
+    store.save('chron', 'transfer_list', 'w1', {'a': '1', 'b': '1'})
+    store.save('sdr', 'transfer_list', 'w2', {'c': '1'})
+    store.save('chron', 'transfer_list', 'w3', {'b': '2'}, replace=True)
+    assert store.snapshot('chron', 'transfer_list') == {'b': '2'}
+    store.reset('chron')
+    assert store.get('chron', 'transfer_list') is None
+    assert store.snapshot('chron', 'transfer_list') == {}
+    assert store.get('sdr', 'transfer_list') == 'w2'
+    store.reset()
+    assert store.get('sdr', 'transfer_list') is None
+
+def test_prune_before():
+    store = WatermarkStore(':memory:')
+    store.save('chron', 'transfer_list', '2015-01-03T00:00:00Z',
+               {'a': '2015-01-01T00:00:00Z', 'b': '2015-01-03T00:00:00Z'})
+    store.save('chron', 'transfer_list', None, {'c': '2015-01-02T00:00:00Z'},
+               prune_before='2015-01-02T00:00:00Z')
+    assert store.snapshot('chron', 'transfer_list') == {
+        'b': '2015-01-03T00:00:00Z', 'c': '2015-01-02T00:00:00Z'}
+    store.close()
@@ -0,0 +1,320 @@
+import json
+import os
+import requests
+import subprocess
+from urllib.parse import urlparse
+from . import const
+from . import fixity_cache
+from . import resilience
+from . import util
+
+# Number of bytes to read from the network at a time.
+DEFAULT_CHUNK_SIZE = 1024 * 1024
+
+# Size of the chunks whose digests are recorded in the manifest of a
+# partial download. An interrupted download resumes from the end of the
+# last complete chunk.
+DEFAULT_MANIFEST_CHUNK_SIZE = 64 * 1024 * 1024
+
+def local_path(link, inbound_dir):
+    """
+    Returns the path in inbound_dir where the file at link should be
+    saved. E.g. "dpn.tdr@example.com:outbound/1234.tar" => inbound_dir/1234.tar
+    """
+    if is_http_link(link):
+        location = urlparse(link).path
+    else:
+        location = link.split(":", 1)[1] if ":" in link else link
+    return os.path.join(inbound_dir, os.path.basename(location))
+
+def is_http_link(link):
+    """
+    Returns True if link is an http or https URL.
+    """
+    return link.startswith('https://') or link.startswith('http://')
+
+def rsync_copy(link, dst, resume=True):
+    """
+    Copies the file at link to dst using rsync.
+
+    :param link: An rsync location, like user@host:dir/file.tar
+    :param dst: Absolute path to which the file should be copied.
+    :param resume: If True, rsync keeps a partly copied file when it's
+    interrupted (--partial), and the next copy appends to it instead of
+    starting over, checking the whole file against the source once it's
+    done (--append-verify).
+
+    :returns str: dst
+
+    :raises subprocess.CalledProcessError: If rsync fails.
+    """
+    command = ["rsync", "-Lav", "--compress", "--compress-level=0", "--quiet"]
+    if resume:
+        command.extend(["--partial", "--append-verify"])
+    command.extend([link, dst])
+    subprocess.check_call(command)
+    return dst
+
+
+class ChunkManifest:
+    """
+    SHA-256 digests of the fixed-size chunks of a partial download, kept
+    in a JSON file beside it. After a crash, https_copy re-checks the
+    recorded chunks and resumes the download from the end of the last
+    good one, instead of from byte zero.
+
+    :param path: Path of the manifest file.
+    :param source: URL the partial file is being downloaded from.
+    :param chunk_size: Number of bytes covered by each digest.
+    :param etag: ETag of the file being downloaded, if the server sent one.
+    :param digests: Hex digests of the chunks written so far.
+    :param last_modified: Last-Modified of the file being downloaded, if
+    the server sent one.
+    """
+    def __init__(self, path, source, chunk_size, etag=None, digests=None,
+                 last_modified=None):
+        self.path = path
+        self.source = source
+        self.chunk_size = chunk_size
+        self.etag = etag
+        self.digests = list(digests or [])
+        self.last_modified = last_modified
+
+    @classmethod
+    def load(cls, path):
+        """
+        Returns the manifest saved at path, or None if there isn't a
+        readable one.
+        """
+        try:
+            with open(path) as f:
+                data = json.load(f)
+            return cls(path, data['source'], data['chunk_size'],
+                       data.get('etag'), data['digests'], data.get('last_modified'))
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+
+    @property
+    def verified_bytes(self):
+        return len(self.digests) * self.chunk_size
+
+    def save(self):
+        """
+        Writes the manifest to disk, replacing the old one atomically.
+        """
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump({'source': self.source, 'chunk_size': self.chunk_size,
+                       'etag': self.etag, 'last_modified': self.last_modified,
+                       'digests': self.digests}, f)
+        os.replace(tmp, self.path)
+
+    def remove(self):
+        """
+        Deletes the manifest file.
+        """
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+def https_copy(url, dst, session=None, chunk_size=DEFAULT_CHUNK_SIZE,
+               timeout=resilience.DEFAULT_TIMEOUT, resume=True,
+               manifest_chunk_size=DEFAULT_MANIFEST_CHUNK_SIZE):
+    """
+    Downloads the file at url to dst, calculating its SHA-256 digest
+    from the same bytes as they are written, so the digest is ready as
+    soon as the download finishes and the file never has to be re-read.
+    The file is written to dst + '.partial' and renamed to dst when it's
+    complete. If a fixity cache is configured, the digest is saved to it.
+
+    While the download runs, the digest of every manifest_chunk_size
+    bytes is recorded in a ChunkManifest at dst + '.partial.manifest'.
+    If a download is interrupted, the next call re-reads the recorded
+    chunks once, checking each against the manifest and feeding it to
+    the whole-file digest, then asks the server for the rest with a
+    Range request. Anything after the last good chunk is downloaded
+    again. The request carries If-Range with the file's ETag (or its
+    Last-Modified, if it had no ETag). The download starts over if the
+    server ignores the Range header, if the file has changed, or if the
+    range the server sends (Content-Range) doesn't start where the partial
+    file ends.
+
+    :param url: The https URL of the file.
+    :param dst: Absolute path to which the file should be copied.
+    :param session: A requests.Session to download with. Pass one in to
+    reuse pooled connections across downloads.
+    :param chunk_size: Number of bytes to read at a time.
+    :param timeout: (connect, read) timeouts in seconds. The read timeout
+    applies to each chunk, not to the whole download.
+    :param resume: Set to False to ignore any partial download and start
+    from byte zero.
+    :param manifest_chunk_size: Number of bytes covered by each digest in
+    the manifest.
+
+    :returns str: The SHA-256 hex digest of the file.
+
+    :raises RequestException: If the download fails.
+    """
+    if session is None:
+        session = requests.Session()
+    partial = dst + '.partial'
+    manifest = None
+    if resume and os.path.exists(partial):
+        manifest = ChunkManifest.load(partial + '.manifest')
+    if (manifest is None or manifest.source != url
+            or manifest.chunk_size != manifest_chunk_size):
+        manifest = ChunkManifest(partial + '.manifest', url, manifest_chunk_size)
+        checksum = util.new_checksum(const.FIXITY_SHA256)
+    else:
+        checksum = _verify_partial(partial, manifest)
+    offset = manifest.verified_bytes
+    start_over = False
+    headers = {}
+    if offset:
+        headers['Range'] = 'bytes={0}-'.format(offset)
+        if manifest.etag or manifest.last_modified:
+            headers['If-Range'] = manifest.etag or manifest.last_modified
+    with session.get(url, stream=True, timeout=timeout, headers=headers) as response:
+        if offset and response.status_code == 416 and \
+                _content_length(response) == offset:
+            # The partial file was complete; only the rename was missed.
+            with open(partial, 'r+b') as f:
+                f.truncate(offset)
+        else:
+            response.raise_for_status()
+            if response.status_code == 206 and not _resumes_at(response, offset, manifest):
+                start_over = True
+            elif response.status_code != 206:
+                # Full content: start over.
+                offset = 0
+                checksum = util.new_checksum(const.FIXITY_SHA256)
+                manifest.etag = response.headers.get('ETag')
+                manifest.last_modified = response.headers.get('Last-Modified')
+                manifest.digests = []
+                open(partial, 'wb').close()
+            if not start_over:
+                manifest.save()
+                with open(partial, 'r+b') as f:
+                    f.seek(offset)
+                    f.truncate()
+                    _write_chunks(f, response.iter_content(chunk_size),
+                                  checksum, manifest)
+    if start_over:
+        # Nothing was written, and the next request has no Range header.
+        return https_copy(url, dst, session=session, chunk_size=chunk_size,
+                          timeout=timeout, resume=False,
+                          manifest_chunk_size=manifest_chunk_size)
+    os.replace(partial, dst)
+    manifest.remove()
+    digest = checksum.hexdigest()
+    cache = fixity_cache.default_cache()
+    if cache is not None:
+        cache.put(os.path.abspath(dst), const.FIXITY_SHA256, digest)
+    return digest
+
+def _resumes_at(response, offset, manifest):
+    """
+    Returns True if a 206 response continues the partial file: its
+    Content-Range starts at offset, and its ETag and Last-Modified (where
+    both sides have one) match the ones the partial file was started with.
+    """
+    content_range = response.headers.get('Content-Range', '')
+    try:
+        unit, _, spec = content_range.partition(' ')
+        start = int(spec.split('-', 1)[0])
+    except ValueError:
+        return False
+    if unit != 'bytes' or start != offset:
+        return False
+    for header, expected in (('ETag', manifest.etag),
+                             ('Last-Modified', manifest.last_modified)):
+        value = response.headers.get(header)
+        if expected and value and value != expected:
+            return False
+    return True
+
+def _verify_partial(partial, manifest):
+    """
+    Re-reads the chunks recorded in manifest, dropping the first one that
+    doesn't match (and everything after it) from the manifest. Returns
+    the whole-file checksum of the good chunks.
+    """
+    checksum = util.new_checksum(const.FIXITY_SHA256)
+    good = 0
+    with open(partial, 'rb') as f:
+        for expected in manifest.digests:
+            chunk_checksum = util.new_checksum(const.FIXITY_SHA256)
+            before = checksum.copy()
+            remaining = manifest.chunk_size
+            while remaining:
+                data = f.read(min(remaining, util.DEFAULT_BLOCK_SIZE))
+                if not data:
+                    break
+                chunk_checksum.update(data)
+                checksum.update(data)
+                remaining -= len(data)
+            if remaining or chunk_checksum.hexdigest() != expected:
+                checksum = before
+                break
+            good += 1
+    del manifest.digests[good:]
+    return checksum
+
+def _write_chunks(f, chunks, checksum, manifest):
+    """
+    Writes chunks to f, updating checksum, and records the digest of
+    every complete manifest chunk in manifest.
+    """
+    chunk_checksum = util.new_checksum(const.FIXITY_SHA256)
+    in_chunk = 0
+    for data in chunks:
+        f.write(data)
+        checksum.update(data)
+        view = memoryview(data)
+        while view:
+            take = min(len(view), manifest.chunk_size - in_chunk)
+            chunk_checksum.update(view[:take])
+            in_chunk += take
+            view = view[take:]
+            if in_chunk == manifest.chunk_size:
+                # Flush before recording the chunk. Resuming re-checks
+                # recorded chunks anyway, so there's no need to fsync.
+                f.flush()
+                manifest.digests.append(chunk_checksum.hexdigest())
+                manifest.save()
+                chunk_checksum = util.new_checksum(const.FIXITY_SHA256)
+                in_chunk = 0
+
+def _content_length(response):
+    """
+    Returns the full length of the file from the Content-Range header of
+    a 416 response ("bytes */12345"), or None.
+    """
+    content_range = response.headers.get('Content-Range', '')
+    try:
+        return int(content_range.rsplit('/', 1)[1])
+    except (IndexError, ValueError):
+        return None
+
+def download(xfer_request, inbound_dir, session=None):
+    """
+    Downloads the bag in a transfer request into inbound_dir. Uses https
+    when the request's protocol is const.PROTOCOL_HTTPS or its link is an
+    http(s) URL, and rsync otherwise.
+
+    :param xfer_request: A transfer request dict, as returned by
+    Client.get_transfer_requests.
+
+    :param inbound_dir: Directory in which to save the bag.
+
+    :param session: A requests.Session for https downloads.
+
+    :returns: A tuple of (local_path, fixity). fixity is the SHA-256
+    digest of the bag if it was calculated during the download, or None
+    if the caller still has to calculate it.
+    """
+    link = xfer_request['link']
+    dst = local_path(link, inbound_dir)
+    if (xfer_request.get('protocol') == const.PROTOCOL_HTTPS
+            or is_http_link(link)):
+        return dst, https_copy(link, dst, session)
+    return rsync_copy(link, dst), None
@@ -0,0 +1,276 @@
+import json
+import os
+import requests
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from . import const
+from . import jsoncodec
+from . import resilience
+
+# Default number of pending updates that triggers a flush.
+DEFAULT_MAX_PENDING = 50
+
+# Default max number of seconds an update waits before it's sent.
+DEFAULT_MAX_DELAY = 5.0
+
+# Default max number of updates to send at once.
+DEFAULT_FLUSH_WORKERS = 8
+
+class TransferUpdateQueue:
+    """
+    Collects transfer request updates (fixity receipts and rejections)
+    and sends them in batches, instead of one PUT at a time as each bag
+    finishes. Updates for the same node and replication_id are merged
+    into one, with later values winning. A batch is sent when
+    max_pending updates are waiting or the oldest has waited max_delay
+    seconds, whichever comes first, and its updates are sent concurrently
+    over the client's pooled connection to each node.
+
+    If journal_path is set, every update is appended to that file (and
+    fsynced) before set_transfer_fixity or reject_transfer_request
+    returns, and the file is rewritten to hold only unsent updates after
+    each flush. A new queue with the same journal_path sends whatever a
+    crashed one didn't.
+
+    Updates that fail with a connection error, a timeout, an open circuit
+    breaker or a 5xx status are kept and retried on the next flush, which
+    the background flusher holds off for max_delay seconds. Other
+    failures are final: they are reported by flush(), and also passed to
+    on_error, so failures in the background flushes aren't lost. Without
+    on_error, they are kept in the failed list for you to collect.
+
+        with TransferUpdateQueue(client, journal_path='/var/dpn/updates.jsonl') as updates:
+            updates.set_transfer_fixity('chron', replication_id, digest)
+        # Everything has been sent when the with block exits.
+
+    :param client: A Client.
+    :param journal_path: Optional path of the journal file.
+    :param max_pending: Number of pending updates that triggers a flush.
+    :param max_delay: Max number of seconds an update waits to be sent.
+    :param max_workers: Max number of updates to send at once.
+    :param on_error: Optional function called with the job dict (see
+    flush) of each update that failed for good.
+    """
+    def __init__(self, client, journal_path=None, max_pending=DEFAULT_MAX_PENDING,
+                 max_delay=DEFAULT_MAX_DELAY, max_workers=DEFAULT_FLUSH_WORKERS,
+                 on_error=None):
+        self.client = client
+        self.journal_path = journal_path
+        self.max_pending = max_pending
+        self.max_delay = max_delay
+        self.max_workers = max_workers
+        self.on_error = on_error
+        self.failed = []
+        self._pending = {}
+        self._oldest = None
+        self._retry_at = 0
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._closed = False
+        self._journal = None
+        if journal_path:
+            self._replay()
+            self._journal = open(journal_path, 'a')
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+    def __len__(self):
+        with self._lock:
+            return len(self._pending)
+
+    def set_transfer_fixity(self, remote_node_namespace, replication_id, fixity):
+        """
+        Queues a fixity receipt. See Client.set_transfer_fixity.
+        """
+        self.put(remote_node_namespace, replication_id, fixity_value=fixity)
+
+    def reject_transfer_request(self, remote_node_namespace, replication_id):
+        """
+        Queues a rejection. See Client.reject_transfer_request.
+        """
+        self.put(remote_node_namespace, replication_id, status=const.STATUS_REJECTED)
+
+    def put(self, remote_node_namespace, replication_id, **changes):
+        """
+        Queues changes to a transfer request, merging them into any
+        changes already queued for it.
+        """
+        with self._lock:
+            # Checked under the lock, so nothing slips in after close().
+            if self._closed:
+                raise ValueError("TransferUpdateQueue is closed")
+            # The flusher sleeps until woken while nothing is pending.
+            if self._oldest is None:
+                self._wake.set()
+            self._merge(remote_node_namespace, replication_id, changes)
+            if self._journal is not None:
+                self._journal.write(json.dumps({
+                    'namespace': remote_node_namespace,
+                    'replication_id': replication_id,
+                    'changes': changes}) + "\n")
+                self._journal.flush()
+                os.fsync(self._journal.fileno())
+            if len(self._pending) >= self.max_pending:
+                self._wake.set()
+
+    def flush(self):
+        """
+        Sends all pending updates now, and waits for them.
+
+        :returns: A list with one dict per update sent, with keys
+        'namespace', 'replication_id', 'changes', 'result' (the updated
+        transfer request, or None) and 'error' (None, or the exception
+        raised for that update).
+        """
+        with self._flush_lock:
+            with self._lock:
+                batch = self._pending
+                self._pending = {}
+                self._oldest = None
+            jobs = [{'namespace': key[0], 'replication_id': key[1], 'changes': changes,
+                     'result': None, 'error': None}
+                    for key, changes in batch.items()]
+            if jobs:
+                with ThreadPoolExecutor(max_workers=max(1, self.max_workers)) as executor:
+                    list(executor.map(self._send, jobs))
+            final = []
+            with self._lock:
+                self._retry_at = 0
+                for job in jobs:
+                    if job['error'] is None:
+                        continue
+                    if _retryable(job['error']):
+                        # Anything queued since wins over the failed values.
+                        key = (job['namespace'], job['replication_id'])
+                        self._pending[key] = dict(job['changes'], **self._pending.get(key, {}))
+                        if self._oldest is None:
+                            self._oldest = time.time()
+                        # Back off, so a node that's down isn't hammered.
+                        self._retry_at = time.time() + self.max_delay
+                    else:
+                        final.append(job)
+                self._rewrite_journal()
+            for job in final:
+                self._report(job)
+            return jobs
+
+    def close(self):
+        """
+        Stops the background flusher and sends everything still pending.
+        Updates that still can't be sent stay in the journal.
+        """
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+        self._wake.set()
+        self._thread.join()
+        self.flush()
+        if self._journal is not None:
+            with self._lock:
+                self._journal.close()
+                self._journal = None
+
+    def _merge(self, namespace, replication_id, changes):
+        key = (namespace, replication_id)
+        self._pending[key] = dict(self._pending.get(key, {}), **changes)
+        if self._oldest is None:
+            self._oldest = time.time()
+
+    def _report(self, job):
+        if self.on_error is None:
+            self.failed.append(job)
+            return
+        try:
+            self.on_error(job)
+        except Exception:
+            # A broken callback must not stop the flusher.
+            pass
+
+    def _send(self, job):
+        data = dict(job['changes'], replication_id=job['replication_id'])
+        try:
+            client = self.client.remote_client(job['namespace'])
+            response = client.transfer_update(data)
+            job['result'] = jsoncodec.response_json(response)
+        except Exception as err:
+            job['error'] = err
+
+    def _run(self):
+        while not self._closed:
+            with self._lock:
+                oldest = self._oldest
+                count = len(self._pending)
+                retry_at = self._retry_at
+            now = time.time()
+            timeout = None
+            if oldest is not None:
+                timeout = max(0, oldest + self.max_delay - now)
+            if retry_at > now:
+                # After failures to retry, even the size trigger waits.
+                timeout = retry_at - now
+            elif count >= self.max_pending or timeout == 0:
+                self.flush()
+                continue
+            self._wake.wait(timeout)
+            self._wake.clear()
+
+    def _replay(self):
+        """
+        Loads updates left in the journal by an earlier queue.
+        """
+        if not os.path.exists(self.journal_path):
+            return
+        with open(self.journal_path) as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                    self._merge(entry['namespace'], entry['replication_id'],
+                                entry['changes'])
+                except (ValueError, KeyError, TypeError):
+                    # A line cut short by a crash.
+                    continue
+
+    def _rewrite_journal(self):
+        """
+        Replaces the journal with the updates still pending. Called with
+        the lock held.
+        """
+        if self._journal is None:
+            return
+        tmp = self.journal_path + '.tmp'
+        with open(tmp, 'w') as f:
+            for (namespace, replication_id), changes in self._pending.items():
+                f.write(json.dumps({'namespace': namespace,
+                                    'replication_id': replication_id,
+                                    'changes': changes}) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        self._journal.close()
+        os.replace(tmp, self.journal_path)
+        self._journal = open(self.journal_path, 'a')
+
+
+def _retryable(err):
+    """
+    Returns True if an update that failed with err is worth sending again:
+    connection errors, timeouts, an open circuit breaker and 5xx responses.
+    Anything else (a 4xx, an unknown namespace, a bug) is final.
+    """
+    if isinstance(err, (requests.exceptions.ConnectionError,
+                        requests.exceptions.Timeout,
+                        resilience.CircuitOpenError,
+                        ConnectionError)):
+        return True
+    response = getattr(err, 'response', None)
+    return response is not None and response.status_code >= 500
@@ -1,12 +1,21 @@
+import os
 import re
 from . import const
+from . import fixity_cache
 import hashlib
-from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
 
 # Regex for something that looks like a UUID.
 RE_UUID = re.compile("^[a-f0-9]{8}-[a-f0-9]{4}-[a-f0-9]{4}-[a-f0-9]{4}-?[a-f0-9]{12}\Z", re.IGNORECASE)
 RE_TIMESTAMP = re.compile(r'^\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}\.*\d*Z\Z')
 
+# Number of bytes to read at a time when calculating checksums.
+DEFAULT_BLOCK_SIZE = 1024 * 1024
+
+# Max number of files to checksum at once in digest_files.
+DEFAULT_DIGEST_WORKERS = 4
+
 def now_str():
     """
     Returns datetime.now in the form of a string. Useful for creating
@@ -14,6 +23,18 @@ def now_str():
     """
     return datetime.utcnow().isoformat("T") + "Z"
 
+def just_before(timestamp):
+    """
+    Returns the updated_at timestamp one second before timestamp, so that
+    an after filter with it also matches records updated at timestamp.
+    Returns timestamp itself if it can't be parsed.
+    """
+    try:
+        parsed = datetime.strptime(timestamp[:19], "%Y-%m-%dT%H:%M:%S")
+    except ValueError:
+        return timestamp
+    return (parsed - timedelta(seconds=1)).strftime("%Y-%m-%dT%H:%M:%S") + timestamp[19:]
+
 def looks_like_uuid(string):
     """
     Returns True if string looks like a UUID.
@@ -85,25 +106,112 @@ def rsync_link(namespace, my_server, partner_outbound_dir, filename):
     return "{0}@{1}:{2}{3}".format(
         username(namespace), my_server, partner_outbound_dir, filename)
 
-def digest(abs_path, algorithm):
+def new_checksum(algorithm):
     """
-    Returns the sha256 or md5 hex hash of a file.
+    Returns a new hashlib object for the specified algorithm.
 
-    :param abs_path: Absolute path to file.
     :param algorithm: Either 'md5' or 'sha256'
 
-    :returns str: Hex digest of the file.
+    :raises ValueError: If algorithm is not supported.
     """
-    size = 65536
     if algorithm == 'md5':
-        checksum = hashlib.md5()
+        return hashlib.md5()
     elif algorithm == 'sha256':
-        checksum = hashlib.sha256()
-    else:
-        raise ValueError("algorithm must be either md5 or sha256")
-    with open(abs_path, 'rb') as f:
-        buf = f.read(size)
-        while len(buf) > 0:
-            checksum.update(buf)
-            buf = f.read(size)
-    return checksum.hexdigest()
+        return hashlib.sha256()
+    raise ValueError("algorithm must be either md5 or sha256")
+
+def digests(abs_path, algorithms, block_size=DEFAULT_BLOCK_SIZE, force=False):
+    """
+    Returns the hex hashes of a file for several algorithms, reading
+    the file only once. The file is read into a single reusable buffer,
+    so memory use stays at block_size no matter how big the file is.
+
+    If a fixity cache is configured (see fixity_cache.configure), digests
+    of unchanged files come from the cache, and new digests are saved to it.
+
+    :param abs_path: Absolute path to file.
+    :param algorithms: A list of algorithms. Each must be 'md5' or 'sha256'.
+    :param block_size: Number of bytes to read at a time.
+    :param force: Set to True to re-hash the file even if the cache has
+    digests for it.
+
+    :returns dict: Hex digests of the file, keyed by algorithm.
+    """
+    for algorithm in algorithms:
+        new_checksum(algorithm)
+    abs_path = os.path.abspath(abs_path)
+    cache = fixity_cache.default_cache()
+    results = {}
+    stat = None
+    if cache is not None:
+        stat = os.stat(abs_path)
+        if not force:
+            for algorithm in algorithms:
+                cached = cache.get(abs_path, algorithm, stat)
+                if cached is not None:
+                    results[algorithm] = cached
+    missing = [algorithm for algorithm in algorithms if algorithm not in results]
+    if not missing:
+        return results
+    hashed = _hash_file(abs_path, missing, block_size)
+    results.update(hashed)
+    # Don't cache digests of a file that changed while we were reading it.
+    if cache is not None and _same_file_version(stat, os.stat(abs_path)):
+        for algorithm, hex_digest in hashed.items():
+            cache.put(abs_path, algorithm, hex_digest, stat)
+    return results
+
+def _hash_file(abs_path, algorithms, block_size):
+    checksums = [(algorithm, new_checksum(algorithm)) for algorithm in algorithms]
+    buf = bytearray(block_size)
+    view = memoryview(buf)
+    with open(abs_path, 'rb', buffering=0) as f:
+        while True:
+            bytes_read = f.readinto(buf)
+            if not bytes_read:
+                break
+            chunk = view[:bytes_read]
+            for algorithm, checksum in checksums:
+                checksum.update(chunk)
+    return dict((algorithm, checksum.hexdigest())
+                for algorithm, checksum in checksums)
+
+def _same_file_version(stat1, stat2):
+    return (stat1.st_ino == stat2.st_ino and stat1.st_size == stat2.st_size
+            and stat1.st_mtime_ns == stat2.st_mtime_ns)
+
+def digest(abs_path, algorithm, block_size=DEFAULT_BLOCK_SIZE, force=False):
+    """
+    Returns the sha256 or md5 hex hash of a file. Uses the fixity cache,
+    if one is configured.
+
+    :param abs_path: Absolute path to file.
+    :param algorithm: Either 'md5' or 'sha256'
+    :param block_size: Number of bytes to read at a time.
+    :param force: Set to True to re-hash the file even if it's cached.
+
+    :returns str: Hex digest of the file.
+    """
+    return digests(abs_path, [algorithm], block_size, force)[algorithm]
+
+def digest_files(abs_paths, algorithms, max_workers=DEFAULT_DIGEST_WORKERS,
+                 block_size=DEFAULT_BLOCK_SIZE, force=False):
+    """
+    Hashes many files at once on a thread pool. hashlib releases the
+    GIL while hashing, so this scales with the number of cores and
+    disks available.
+
+    :param abs_paths: A list of absolute paths to files.
+    :param algorithms: A list of algorithms. Each must be 'md5' or 'sha256'.
+    :param max_workers: Max number of files to hash at once.
+    :param block_size: Number of bytes to read at a time.
+    :param force: Set to True to re-hash files even if they're cached.
+
+    :returns dict: For each path, a dict of hex digests keyed by algorithm.
+    """
+    for algorithm in algorithms:
+        new_checksum(algorithm)
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        results = executor.map(
+            lambda path: digests(path, algorithms, block_size, force), abs_paths)
+        return dict(zip(abs_paths, results))
@@ -0,0 +1,112 @@
+import sqlite3
+import threading
+
+class WatermarkStore:
+    """
+    Remembers, per node and endpoint, the newest updated_at seen by
+    incremental polling (the "watermark"), plus a snapshot of the
+    {record ID: updated_at} pairs seen so far. The snapshot is what
+    polling falls back on to find changes when a node ignores the
+    after filter. Both are kept in SQLite, so they survive restarts.
+
+    :param path: Path to the SQLite database. It will be created if it
+    doesn't exist. Use ':memory:' for a store that lasts only as long as
+    the process.
+    """
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        with self._db:
+            self._db.execute(
+                "create table if not exists watermark ("
+                "namespace text not null, endpoint text not null, "
+                "updated_at text not null, "
+                "primary key (namespace, endpoint))")
+            self._db.execute(
+                "create table if not exists snapshot ("
+                "namespace text not null, endpoint text not null, "
+                "record_id text not null, updated_at text, "
+                "primary key (namespace, endpoint, record_id))")
+
+    def close(self):
+        """
+        Closes the store's database.
+        """
+        with self._lock:
+            self._db.close()
+
+    def get(self, namespace, endpoint):
+        """
+        Returns the watermark for a node and endpoint, or None if the
+        endpoint has never been polled.
+        """
+        with self._lock:
+            row = self._db.execute(
+                "select updated_at from watermark "
+                "where namespace = ? and endpoint = ?",
+                (namespace, endpoint)).fetchone()
+        return row[0] if row else None
+
+    def snapshot(self, namespace, endpoint):
+        """
+        Returns the snapshot for a node and endpoint, as a dict of
+        updated_at keyed by record ID.
+        """
+        with self._lock:
+            rows = self._db.execute(
+                "select record_id, updated_at from snapshot "
+                "where namespace = ? and endpoint = ?",
+                (namespace, endpoint)).fetchall()
+        return dict(rows)
+
+    def save(self, namespace, endpoint, watermark, snapshot, replace=False,
+             prune_before=None):
+        """
+        Saves a new watermark and snapshot in one transaction.
+
+        :param watermark: The newest updated_at seen, or None to keep the
+        current watermark.
+        :param snapshot: Dict of updated_at keyed by record ID.
+        :param replace: If True, snapshot replaces the stored snapshot.
+        Otherwise it's merged into it.
+        :param prune_before: If set, snapshot entries updated before this
+        timestamp are deleted.
+        """
+        with self._lock, self._db:
+            if watermark is not None:
+                self._db.execute(
+                    "insert or replace into watermark "
+                    "(namespace, endpoint, updated_at) values (?, ?, ?)",
+                    (namespace, endpoint, watermark))
+            if replace:
+                self._db.execute(
+                    "delete from snapshot where namespace = ? and endpoint = ?",
+                    (namespace, endpoint))
+            self._db.executemany(
+                "insert or replace into snapshot "
+                "(namespace, endpoint, record_id, updated_at) values (?, ?, ?, ?)",
+                [(namespace, endpoint, record_id, updated_at)
+                 for record_id, updated_at in snapshot.items()])
+            if prune_before is not None:
+                self._db.execute(
+                    "delete from snapshot where namespace = ? and endpoint = ? "
+                    "and updated_at < ?", (namespace, endpoint, prune_before))
+
+    def reset(self, namespace=None, endpoint=None):
+        """
+        Forgets watermarks and snapshots, so the next poll starts from
+        scratch. With no arguments, forgets everything.
+        """
+        where = []
+        params = []
+        if namespace is not None:
+            where.append("namespace = ?")
+            params.append(namespace)
+        if endpoint is not None:
+            where.append("endpoint = ?")
+            params.append(endpoint)
+        condition = " where " + " and ".join(where) if where else ""
+        with self._lock, self._db:
+            for table in ('watermark', 'snapshot'):
+                self._db.execute("delete from " + table + condition, params)
@@ -30,6 +30,38 @@ INBOUND_DIR  = '/path/to/inbound'
 # copy.
 PARTNER_OUTBOUND_DIR = "outbound"
 
+# FIXITY_CACHE_DIR - directory where we cache checksums of bags we've
+#                    already hashed, so unchanged bags aren't re-hashed.
+#                    Set to None to turn the cache off.
+# FIXITY_CACHE_MAX_ENTRIES - max number of checksums to keep in the cache.
+FIXITY_CACHE_DIR = '/path/to/fixity_cache'
+FIXITY_CACHE_MAX_ENTRIES = 100000
+
+# NODE_CACHE_FILE - file in which to cache the list of DPN nodes, so
+#                   clients start without querying the server. Set to
+#                   None to query the server on first use instead.
+# NODE_CACHE_TTL  - number of seconds after which the cached node list is
+#                   refreshed in the background.
+NODE_CACHE_FILE = '/path/to/dpn_node_cache.json'
+NODE_CACHE_TTL = 3600
+
+# REGISTRY_MIRROR_PATH - SQLite file in which to keep a local copy of the
+#                        registry (bags, transfers and restores), for
+#                        fast local audits. Set to None to turn it off.
+REGISTRY_MIRROR_PATH = '/path/to/dpn_registry_mirror.sqlite3'
+
+# WATERMARK_FILE - SQLite file in which incremental polling remembers what
+#                  it has already seen from each node, so polling stays
+#                  incremental across restarts. Set to None to keep it
+#                  in memory only.
+WATERMARK_FILE = '/path/to/dpn_watermarks.sqlite3'
+
+# UPDATE_JOURNAL_FILE - File in which Client.transfer_update_queue() records
+#                       transfer request updates until they have been sent,
+#                       so none are lost if the process dies. Set to None
+#                       to keep them in memory only.
+UPDATE_JOURNAL_FILE = '/path/to/dpn_update_journal.jsonl'
+
 
 # Configurations for OUR OWN node.
 # url is the url for your own node
@@ -10,6 +10,8 @@
 # 3. Calculate the sha-265 checksums of the files.
 # 4. Send the checksums back to the remote node.
 #
+# Steps 2-4 run as a pipeline in dpnclient.replication.ReplicationEngine.
+#
 # Pre-reqs:
 #
 # 1. This must run on a box that has access to the remote DPN servers,
@@ -25,48 +27,29 @@
 # Param remote_node should be one of: tdr, sdr, chron or hathi
 #
 # ----------------------------------------------------------------------
-from dpnclient import client, util
+from dpnclient import client, replication
 import dpn_rest_settings
-import hashlib
-import os
-import subprocess
+import json
 
 class XferTest:
 
     def __init__(self, config):
-        self.client = client.Client(dpn_rest_settings, dpn_rest_settings.TEST)
+        self.client = client.Client(dpn_rest_settings, config)
 
     def replicate_files(self, namespace):
         """
         Replicate bags from the specified namespace.
         """
-        requests = self.client.get_transfer_requests(namespace)
-        for request in requests:
-            link = request['link']
-            replication_id = request['replication_id']
-            # download the file via rsync
-            print("Downloading {0}".format(link))
-            local_path = self.copy_file(link)
-            # calculate the checksum
-            checksum = util.digest(local_path, "sha256")
-            # send the checksum as receipt
-            print("Returning checksum receipt {0}".format(checksum))
-            self.client.set_transfer_fixity(namespace, replication_id, checksum)
-
-    def copy_file(self, location):
-        filename = os.path.basename(location.split(":")[1])
-        dst = os.path.join(dpn_rest_settings.INBOUND_DIR, filename)
-        command = ["rsync", "-Lav", "--compress",
-                   "--compress-level=0", "--quiet", location, dst]
-        #print(" ".join(command))
-        try:
-            with subprocess.Popen(command, stdout=subprocess.PIPE) as proc:
-                print(str(proc.communicate()[0]))
-            return dst
+        engine = replication.ReplicationEngine(
+            self.client, dpn_rest_settings.INBOUND_DIR,
+            on_progress=self.print_progress)
+        report = engine.run([namespace])
+        print(json.dumps(report, indent=2))
+        return report
 
-        except Exception as err:
-            print("ERROR Transfer failed: {0}".format(err))
-            raise err
+    def print_progress(self, progress):
+        print("{0} {1}: {2}".format(progress.namespace, progress.replication_id,
+                                    progress.state))
 
 
 if __name__ == "__main__":